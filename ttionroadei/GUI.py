@@ -5,7 +5,10 @@ This needs to be revised based on how the GUI gets redesigned.
 Created on: 10/05/2023
 Created by: Apoorb
 """
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import math
 from pathlib import Path
+import shutil
 import pandas as pd
 import logging as lg
 import yaml
@@ -16,9 +19,57 @@ from ttionroadei.utils import (
     get_labels,
     unit_converter,
     delete_old_log_files,
+    get_profile_stages,
+    load_labels_snapshot,
+    save_labels_snapshot,
+)
+from ttionroadei.csvxmlpostprc.csvxmlgen import (
+    CsvXmlGen,
+    make_csvxmlgen,
+    store_measures,
+)
+from ttionroadei.csvxmlpostprc.stagecache import (
+    StageCache,
+    STAGE_UPSTREAM,
+    STAGE_SETTINGS,
+    FRAME_STAGES,
+    code_version,
+)
+from ttionroadei.metrics import (
+    MetricsRecorder,
+    metrics_file,
+    count_rows,
+    count_bytes,
+)
+from ttionroadei.csvxmlpostprc.memestimate import estimate_peak_memory
+from ttionroadei.csvxmlpostprc.preflight import preflight_problems
+from ttionroadei.csvxmlpostprc.fileindex import get_index
+from ttionroadei.csvxmlpostprc.sqlitedb import write_sqlite_db
+from ttionroadei.csvxmlpostprc.incremental import (
+    selected_partitions,
+    existing_partitions,
+    partition_selections,
+    partition_mask,
+    append_csv,
+    merge_aggregate_tables,
+    merge_scc_rows,
+)
+from ttionroadei.csvxmlpostprc.starschema import (
+    FACT_FIS,
+    fact_table,
+    star_paths,
+    write_dims,
+    write_star_schema,
+    load_star_schema,
+)
+from ttionroadei.csvxmlpostprc.sharding import (
+    split_fips,
+    shard_outputs,
+    run_shard,
+    concat_csv_parts,
+    merge_partial_aggs,
+    merge_scc_tables,
 )
-from ttionroadei.csvxmlpostprc.csvxmlgen import CsvXmlGen
-from ttionroadei.csvxmlpostprc.xmlgen import XMLGenerator
 
 
 class PostProcessorGUI:
@@ -73,18 +124,61 @@ class PostProcessorGUI:
         Specify the input options for post-processing of XML files.
     set_xml_param()
         Set the post-processing parameters for XML file generation.
+    load_params(params, labels_db=None)
+        Set the post-processing parameters from a dictionary saved by `save_params`.
     save_params()
         Save the post-processing parameters as a YAML file.
+    get_params()
+        Get the post-processing parameters and configuration as a dictionary.
     process_detailed_csv()
         Process and combine main module data to develop detailed data and save it as CSV files.
+    write_detailed_csv(act_emis_dict)
+        Save the detailed activity and emission data as CSV files.
+    detailed_out_fis()
+        Get the detailed activity and emission data files of the `detailed_format`.
+    dimension_tables()
+        Get the label tables and the road type mapping as dimension tables.
     load_detailed_csv_data()
         Load detailed activity and emission data from CSV files.
     process_aggregate_tables()
         Aggregate detailed activity data to develop aggregate tables and save them as Excel files.
+    write_aggregate_tables(agg_act_emis_dict)
+        Save the aggregate tables as an Excel file.
+    get_xml_out_fi(year, season, daytype)
+        Get the XML output file path for a year, season, and day type scenario.
     process_xml_files()
         Process and combine detailed activity and emission data to develop XML staging
         table and save it as a CSV file. Then, use the staging table to generate an XML
-        file.
+        file, or one XML file per scenario with `xml_all_scenarios`.
+    process_scc_table(csvxmlgen, act_emis_dict)
+        Develop the XML staging table and save it as a CSV file.
+    get_scc_table(csvxmlgen, act_emis_dict)
+        Aggregate the detailed data to the XML staging table.
+    plan_memory(csvxmlgen)
+        Estimate the peak memory and increase the number of shards to fit the
+        memory budget.
+    process_sharded()
+        Run the detailed, aggregate, and XML staging table steps per shard of counties
+        and merge the shard outputs.
+    process_incremental(csvxmlgen)
+        Append the new scenario partitions to the existing detailed, aggregate, and
+        XML staging table outputs.
+    process_xml_from_staging()
+        Generate the XML file(s) from the saved XML staging table.
+    write_xml_file(xmlscc_df, year, xml_out_fi)
+        Generate the XML file of a single scenario from the XML staging table.
+    sqlite_sources()
+        Get the output files loaded into the SQLite database.
+    write_sqlite_db()
+        Bulk load the outputs into an indexed SQLite database.
+    stage_params(stage)
+        Get the slice of the post-processing parameters that a stage depends on.
+    run_hash()
+        Hash the post-processing parameters identifying a run that can be resumed.
+    run_stage(stage, csvxmlgen)
+        Run a post-processing stage unless its cached artifacts can be reused.
+    stage_output(stage)
+        Get the output of a stage, from this run or from the stage cache.
     run_pp()
         Execute the post-processing workflow, including generating CSV and XML files.
 
@@ -114,6 +208,7 @@ class PostProcessorGUI:
         )
         delete_old_log_files(log_directory=log_dir, max_age_in_days=30)
         self.labels = dict()
+        self.labels_snapshot = None
         self.out_dir_pp = Path()
         self.ei_fis_EMS = dict()
         self.ei_fis_RF = dict()
@@ -130,6 +225,9 @@ class PostProcessorGUI:
         self.xmlscc_csv_out_fi = Path()
         self.xmlscc_xml_out_fi = Path()
         self.agg_tab_out_fi = Path()
+        self.sqlite_out_fi = Path()
+        self.star_out_dir = Path()
+        self.fips_index_dir = Path()
         ##### Parameters ###############################################################
         self.EI_dropdown = tuple()
         self.EIs_selected = tuple()
@@ -155,7 +253,22 @@ class PostProcessorGUI:
         self.output_units = dict()
         self.conversion_factor = pd.DataFrame()
         self.gendetailedcsvfiles = True
+        self.detailed_format = "wide"
         self.genaggpivfiles = True
+        self.gensqlitedb = False
+        self.use_stage_cache = False
+        self.resume = False
+        self.incremental = False
+        self.n_shards = 1
+        self.shard_n_workers = 1
+        self.memory_budget = None
+        self.trace_memory = False
+        self.preflight = False
+        self.use_fips_index = False
+        self.ingest_engine = "pandas"
+        self.csvxml_backend = "pandas"
+        self.measure_dtype = "float64"
+        self.metrics = MetricsRecorder()
         ##### XML Fields ###############################################################
         self.genxmlfile = True
         self.xml_pollutant_codes_dropdown = list()
@@ -166,6 +279,10 @@ class PostProcessorGUI:
         self.xml_year_selected = int()
         self.xml_season_selected = ""
         self.xml_daytype_selected = ""
+        self.xml_n_workers = 1
+        self.xml_all_scenarios = False
+        self.xml_compress = False
+        self.xml_compress_level = 6
         self.xml_data = {"Header": {}, "Payload": {}}
 
     def set_paths(self):
@@ -224,6 +341,9 @@ class PostProcessorGUI:
         self.emis_out_fi = self.out_dir_pp.joinpath("emissionDetailed.csv")
         self.xmlscc_csv_out_fi = self.out_dir_pp.joinpath("xmlSCCStagingTable.csv")
         self.agg_tab_out_fi = self.out_dir_pp.joinpath("aggregateTable.xlsx")
+        self.sqlite_out_fi = self.out_dir_pp.joinpath("postProcessorOutput.sqlite")
+        self.star_out_dir = self.out_dir_pp.joinpath("starSchema")
+        self.fips_index_dir = self.out_dir_pp.joinpath(".ppfipsidx")
 
     def _get_roadtype(self):
         """Retrieve and process road type data from a mapping file."""
@@ -419,6 +539,47 @@ class PostProcessorGUI:
         #  following columns:
         #  areaTypeId, areaType, roadTypeId, roadType, mvSroadTypeId, mvSroadType
         self.use_tdm_area_rdtype = False
+        # Skip the stages whose inputs (parameters, settings, upstream outputs, and
+        # code version) are unchanged since the last run and reuse their outputs,
+        # at the cost of saving the ingested and labelled data to `.ppcache` in the
+        # output directory.
+        self.use_stage_cache = False
+        # Restart a failed run with the same parameters after its last completed
+        # stage, without checking the inputs of the completed stages.
+        self.resume = False
+        # Split the counties into shards processed one at a time by each of the
+        # `shard_n_workers` worker processes, to bound the peak memory of large (e.g.,
+        # statewide) runs. One shard processes all the counties at once.
+        self.n_shards = 1
+        self.shard_n_workers = 1
+        # Memory budget in GB. When the peak memory estimated from the main module
+        # outputs exceeds the budget, the counties are split into more shards. None
+        # disables the check.
+        self.memory_budget = None
+        # Check the selections against the headers and key columns of the main module
+        # outputs before the full ingest, and stop on any mismatch.
+        self.preflight = False
+        # Read only the rows of the selected counties from the main module outputs,
+        # using a byte-offset index by county of each file saved to `fips_index_dir`
+        # (built by scanning the file on the first run, rebuilt when the file
+        # changes). Worth it when the same large outputs are post-processed for a
+        # few of their counties several times. Sharded runs always use it.
+        self.use_fips_index = False
+        # Engine parsing the main module outputs: "pandas", or "arrow" for the
+        # multithreaded Arrow CSV reader (requires pyarrow). Both give identical data.
+        self.ingest_engine = "pandas"
+        # Backend of the ingest, label, aggregation, and SCC steps: "pandas", or
+        # "duckdb" to run them as multithreaded queries in an embedded DuckDB database
+        # (requires duckdb; see `duckdbgen.DuckDBCsvXmlGen`).
+        self.csvxml_backend = "pandas"
+        # Storage dtype of the activity and emission measures of the detailed data:
+        # "float64", or "float32" to halve their memory. The aggregate and XML
+        # staging tables are still summed in float64.
+        self.measure_dtype = "float64"
+        # Append only the selected (year, season, dayType, FIPS) partitions missing
+        # from the existing detailed outputs, and merge their aggregate and XML
+        # staging table rows into the existing tables (see `process_incremental`).
+        self.incremental = False
         self._get_roadtype()
         self.labels = get_labels(
             database_nm=settings.get("MOVES4_Default_DB"),
@@ -428,10 +589,16 @@ class PostProcessorGUI:
             port=3308,
         )
         # 7. Specific the options that need to be generated:
-        # a) Detailed CSV files
+        # a) Detailed CSV files: "wide" with the labels on every row, or "star" with
+        # ID-only fact tables and one dimension table per label table in
+        # `star_out_dir` (see `starschema.load_star_schema` to rejoin them).
+        self.detailed_format = "wide"
         # b) Aggregated and Pivoted CSV files
         # TODO: Ask the user for the type of aggregation and pivot.
         # c) XML file
+        # d) Indexed SQLite database of the detailed, aggregate, and XML staging
+        # tables, with the label tables as dimension tables (see `sqlitedb`).
+        self.gensqlitedb = False
 
     def provide_xml_options(self):
         """
@@ -458,6 +625,14 @@ class PostProcessorGUI:
         self.xml_year_selected = 2020
         self.xml_season_selected = "s"
         self.xml_daytype_selected = "wkd"
+        # Number of worker processes used to build the per-county XML fragments.
+        self.xml_n_workers = 1
+        # Generate one XML per year, season, and day type in the detailed data
+        # instead of only the selected scenario.
+        self.xml_all_scenarios = False
+        # Write gzip compressed XML files (.xml.gz) with the given compression level.
+        self.xml_compress = False
+        self.xml_compress_level = 6
         self.xml_data["Header"]["id"] = "ELP_20wwkd"
         self.xml_data["Header"]["AuthorName"] = "Mogwai Turner"
         self.xml_data["Header"][
@@ -485,18 +660,44 @@ class PostProcessorGUI:
         ] = "AERR MOVES 3.0.3-based 2020 annual on-road inventories for 254 Texas Counties"
         self.xml_data["Payload"]["ReportingPeriod"] = "O3D"
         self.xml_data["Payload"]["CalculationParameterTypeCode"] = "I"
-        xml_fi_name = f"{self.area_selected}{self.xml_year_selected}{self.xml_season_selected}{self.xml_daytype_selected}.xml"
-        self.xmlscc_xml_out_fi = self.out_dir_pp.joinpath(xml_fi_name)
+        self.xmlscc_xml_out_fi = self.get_xml_out_fi(
+            self.xml_year_selected, self.xml_season_selected, self.xml_daytype_selected
+        )
 
-    def save_params(self):
+    def get_xml_out_fi(self, year, season, daytype):
         """
-        Save the post-processing parameters as a YAML file.
+        Get the XML output file path for a year, season, and day type scenario.
 
-        This method saves the post-processing parameters and configuration as a YAML
-        file for future reference and reproducibility.
+        Parameters
+        ----------
+        year : int
+            The scenario year.
+        season : str
+            The scenario season.
+        daytype : str
+            The scenario day type.
+
+        Returns
+        -------
+        pathlib.Path
+            The XML output file path. The `.xml.gz` extension is used when
+            `xml_compress` is set.
         """
-        # Define a dictionary to hold all the variables
-        variables_dict = {
+        xml_fi_name = f"{self.area_selected}{year}{season}{daytype}.xml"
+        if self.xml_compress:
+            xml_fi_name += ".gz"
+        return self.out_dir_pp.joinpath(xml_fi_name)
+
+    def get_params(self):
+        """
+        Get the post-processing parameters and configuration as a dictionary.
+
+        Returns
+        -------
+        dict
+            The post-processing parameters, as saved by `save_params`.
+        """
+        return {
             "EIs_selected": self.EIs_selected,
             "area_selected": self.area_selected,
             "FIPSs_selected": self.FIPSs_selected,
@@ -509,12 +710,33 @@ class PostProcessorGUI:
             "xml_season_selected": self.xml_season_selected,
             "xml_daytype_selected": self.xml_daytype_selected,
             "xml_pollutant_codes_selected": self.xml_pollutant_codes_selected,
+            "xml_n_workers": self.xml_n_workers,
+            "xml_all_scenarios": self.xml_all_scenarios,
+            "xml_compress": self.xml_compress,
+            "xml_compress_level": self.xml_compress_level,
             "conversion_factor": self.conversion_factor.to_dict(),
             "fi_temp_tdm_hpms_rdtype": str(self.fi_temp_tdm_hpms_rdtype),
             "use_tdm_area_rdtype": self.use_tdm_area_rdtype,
             "gendetailedcsvfiles": self.gendetailedcsvfiles,
+            "detailed_format": self.detailed_format,
             "genaggpivfiles": self.genaggpivfiles,
             "genxmlfile": self.genxmlfile,
+            "gensqlitedb": self.gensqlitedb,
+            "use_stage_cache": self.use_stage_cache,
+            "resume": self.resume,
+            "incremental": self.incremental,
+            "n_shards": self.n_shards,
+            "shard_n_workers": self.shard_n_workers,
+            "memory_budget": self.memory_budget,
+            "trace_memory": self.trace_memory,
+            "preflight": self.preflight,
+            "use_fips_index": self.use_fips_index,
+            "ingest_engine": self.ingest_engine,
+            "csvxml_backend": self.csvxml_backend,
+            "measure_dtype": self.measure_dtype,
+            "labels_snapshot": (
+                str(self.labels_snapshot) if self.labels_snapshot is not None else None
+            ),
             "ei_base_dir": self.ei_base_dir,
             "log_dir": str(self.log_dir),
             "ei_dir": str(self.ei_dir),
@@ -528,10 +750,128 @@ class PostProcessorGUI:
             "xmlscc_csv_out_fi": str(self.xmlscc_csv_out_fi),
             "xmlscc_xml_out_fi": str(self.xmlscc_xml_out_fi),
             "agg_tab_out_fi": str(self.agg_tab_out_fi),
-            "xml_data": self.xml_data,
+            "sqlite_out_fi": str(self.sqlite_out_fi),
+            "star_out_dir": str(self.star_out_dir),
+            "fips_index_dir": str(self.fips_index_dir),
+            "xml_data": {
+                "Header": self.xml_data["Header"],
+                "Payload": {
+                    key: val
+                    for key, val in self.xml_data["Payload"].items()
+                    if key != "Location"
+                },
+            },
         }
-        # Define the output YAML file path
 
+    def load_params(self, params, labels_db=None):
+        """
+        Set the post-processing parameters from a dictionary saved by `save_params`
+        (the content of a `postProcessorSelection.yaml` file), so the
+        post-processing can run without the hard-coded `set_paths` and
+        `set_csv_param` calls.
+
+        Parameters
+        ----------
+        params : dict
+            The post-processing parameters, as returned by `get_params`.
+        labels_db : dict, optional
+            Keyword arguments for `get_labels` (database_nm, user, password, host,
+            port). Default is None (`get_labels` defaults). Not used when the
+            parameters have a `labels_snapshot` directory (see
+            `utils.save_labels_snapshot`).
+
+        Returns
+        -------
+        None
+        """
+        simple_keys = [
+            "EIs_selected",
+            "area_selected",
+            "FIPSs_selected",
+            "years_selected",
+            "seasons_selected",
+            "daytypes_selected",
+            "pollutant_map_codes_selected",
+            "pollutant_codes_selected",
+            "xml_year_selected",
+            "xml_season_selected",
+            "xml_daytype_selected",
+            "xml_pollutant_codes_selected",
+            "xml_n_workers",
+            "xml_all_scenarios",
+            "xml_compress",
+            "xml_compress_level",
+            "use_tdm_area_rdtype",
+            "gendetailedcsvfiles",
+            "detailed_format",
+            "genaggpivfiles",
+            "genxmlfile",
+            "gensqlitedb",
+            "use_stage_cache",
+            "resume",
+            "incremental",
+            "n_shards",
+            "shard_n_workers",
+            "memory_budget",
+            "trace_memory",
+            "preflight",
+            "use_fips_index",
+            "ingest_engine",
+            "csvxml_backend",
+            "measure_dtype",
+            "labels_snapshot",
+            "xml_data",
+        ]
+        for key in simple_keys:
+            if key in params:
+                setattr(self, key, params[key])
+        self.conversion_factor = pd.DataFrame(params["conversion_factor"])
+        self.fi_temp_tdm_hpms_rdtype = params["fi_temp_tdm_hpms_rdtype"]
+        self.ei_dir = Path(params["ei_dir"])
+        self.out_dir_pp = Path(params["summary_dir"])
+        for key in ["ei_fis_EMS", "ei_fis_RF", "ei_fis_TEC", "act_fis"]:
+            setattr(self, key, {cat: Path(fi) for cat, fi in params[key].items()})
+        for key in [
+            "act_out_fi",
+            "emis_out_fi",
+            "xmlscc_csv_out_fi",
+            "xmlscc_xml_out_fi",
+            "agg_tab_out_fi",
+        ]:
+            setattr(self, key, Path(params[key]))
+        # Parameters saved before the SQLite and star-schema outputs and the county
+        # indexes have no paths for them.
+        self.sqlite_out_fi = Path(
+            params.get(
+                "sqlite_out_fi",
+                self.out_dir_pp.joinpath("postProcessorOutput.sqlite"),
+            )
+        )
+        self.star_out_dir = Path(
+            params.get("star_out_dir", self.out_dir_pp.joinpath("starSchema"))
+        )
+        self.fips_index_dir = Path(
+            params.get("fips_index_dir", self.out_dir_pp.joinpath(".ppfipsidx"))
+        )
+        self.output_yaml_file = Path(self.log_dir).joinpath(
+            "postProcessorSelection.yaml"
+        )
+        self.out_dir_pp.mkdir(parents=True, exist_ok=True)
+        self._get_roadtype()
+        if self.labels_snapshot is not None:
+            self.labels = load_labels_snapshot(self.labels_snapshot)
+        else:
+            self.labels = get_labels(**(labels_db or {}))
+
+    def save_params(self):
+        """
+        Save the post-processing parameters as a YAML file.
+
+        This method saves the post-processing parameters and configuration as a YAML
+        file for future reference and reproducibility.
+        """
+        # Define a dictionary to hold all the variables
+        variables_dict = self.get_params()
         # Save the variables as YAML
         with open(self.output_yaml_file, "w") as yaml_file:
             yaml.dump(
@@ -557,16 +897,71 @@ class PostProcessorGUI:
             "Processing and combining main module data to develop detailed data..."
         )
         act_emis_dict = csvxmlgen.detailedcsvgen()
+        self.write_detailed_csv(act_emis_dict)
+        return act_emis_dict
+
+    def write_detailed_csv(self, act_emis_dict):
+        """
+        Save the detailed activity and emission data as CSV files.
+
+        Parameters
+        ----------
+        act_emis_dict : dict
+            A dictionary containing detailed activity and emission data.
+
+        Returns
+        -------
+        list
+            The detailed activity and emission CSV file paths, and the dimension
+            table paths with the "star" `detailed_format`.
+        """
+        if self.detailed_format == "star":
+            star_fis = write_star_schema(
+                act_emis_dict, self.dimension_tables(), self.star_out_dir
+            )
+            self.logger.info(
+                f"Saved detailed activity and emission data as a star schema to {str(self.star_out_dir)}."
+            )
+            return star_fis
         act_emis_dict["act"].to_csv(self.act_out_fi, index=False)
         act_emis_dict["emis"].to_csv(self.emis_out_fi, index=False)
         self.logger.info(
             f"Saved detailed activity and emission data to {str(self.act_out_fi)} and {str(self.emis_out_fi)}, respectively."
         )
-        return act_emis_dict
+        return [self.act_out_fi, self.emis_out_fi]
+
+    def detailed_out_fis(self):
+        """
+        Get the detailed activity and emission data files: the detailed CSV files,
+        or the fact tables with the "star" `detailed_format`.
+
+        Returns
+        -------
+        list
+            The activity and emission data file paths.
+        """
+        if self.detailed_format == "star":
+            paths = star_paths(self.star_out_dir)
+            return [paths["act"], paths["emis"]]
+        return [self.act_out_fi, self.emis_out_fi]
+
+    def dimension_tables(self):
+        """
+        Get the dimension tables of the outputs: the label tables and the road type
+        mapping ("area_rdtype").
+
+        Returns
+        -------
+        dict
+            The dimension DataFrames by name.
+        """
+        return {**self.labels, "area_rdtype": self.tdm_hpms_rdtype_flt}
 
     def load_detailed_csv_data(self):
         """
-        Load detailed activity and emission data from CSV files.
+        Load detailed activity and emission data from CSV files, rejoining the fact
+        and dimension tables with the "star" `detailed_format`. The measures are
+        stored with the `measure_dtype`.
 
         Parameters
         ----------
@@ -578,10 +973,19 @@ class PostProcessorGUI:
             A dictionary containing detailed activity and emission data.
         """
         try:
-            act_emis_dict = {
-                "act": pd.read_csv(self.out_dir_pp.joinpath("activityDetailed.csv")),
-                "emis": pd.read_csv(self.out_dir_pp.joinpath("emissionDetailed.csv")),
-            }
+            with self.metrics.measure("load_detailed") as record:
+                if self.detailed_format == "star":
+                    act_emis_dict = load_star_schema(self.star_out_dir)
+                else:
+                    act_emis_dict = {
+                        "act": pd.read_csv(self.act_out_fi),
+                        "emis": pd.read_csv(self.emis_out_fi),
+                    }
+                store_measures(act_emis_dict, self.measure_dtype)
+                record.update(
+                    rows_out=count_rows(act_emis_dict),
+                    bytes_read=count_bytes(self.detailed_out_fis()),
+                )
         except:
             self.logger.error("Generate detailed CSV files to prepare aggregate files!")
             raise
@@ -601,23 +1005,44 @@ class PostProcessorGUI:
 
         Returns
         -------
-        None
+        list
+            The aggregate tables file path.
         """
         self.logger.info(
             "Aggregating detailed activity to develop aggregate tables table..."
         )
         agg_act_emis_dict = csvxmlgen.aggxlsxgen(act_emis_dict)
+        return self.write_aggregate_tables(agg_act_emis_dict)
+
+    def write_aggregate_tables(self, agg_act_emis_dict):
+        """
+        Save the aggregate tables as an Excel file, with one activity and one
+        emission sheet per aggregation type.
+
+        Parameters
+        ----------
+        agg_act_emis_dict : dict
+            A dictionary containing aggregated activity and emission data by
+            aggregation type.
+
+        Returns
+        -------
+        list
+            The aggregate tables file path.
+        """
         with pd.ExcelWriter(self.agg_tab_out_fi, engine="xlsxwriter") as writer:
             for key, val in agg_act_emis_dict.items():
                 val["emis"].to_excel(writer, sheet_name=f"{key}_emis", index=False)
                 val["act"].to_excel(writer, sheet_name=f"{key}_act", index=False)
         self.logger.info(f"Saved aggregate tables to {str(self.agg_tab_out_fi)}.")
+        return [self.agg_tab_out_fi]
 
     def process_xml_files(self, csvxmlgen, act_emis_dict):
         """
         Process and combine detailed activity and emission data to develop XML staging
         table and save it as a CSV file. Then, use the staging table to generate an XML
-        file.
+        file. With `xml_all_scenarios`, the SCC aggregation is done once for all the
+        year, season, and day type scenarios and one XML is generated per scenario.
 
         Parameters
         ----------
@@ -630,37 +1055,682 @@ class PostProcessorGUI:
         -------
         None
         """
+        self.process_scc_table(csvxmlgen, act_emis_dict)
+        self.process_xml_from_staging()
+
+    def process_scc_table(self, csvxmlgen, act_emis_dict):
+        """
+        Process and combine detailed activity and emission data to develop XML staging
+        table and save it as a CSV file.
+
+        Parameters
+        ----------
+        csvxmlgen : CsvXmlGen
+            An instance of the CsvXmlGen class for generating CSV and XML files.
+        act_emis_dict : dict
+            A dictionary containing detailed activity and emission data.
+
+        Returns
+        -------
+        list
+            The XML staging table file path.
+        """
         self.logger.info(
             "Processing and combining detailed activity and emission data to develop XML staging table..."
         )
+        xmlscc_df = self.get_scc_table(csvxmlgen, act_emis_dict)
+        xmlscc_df.to_csv(self.xmlscc_csv_out_fi, index=False)
+        self.logger.info(f"Saved XML staging table to {str(self.xmlscc_csv_out_fi)}.")
+        return [self.xmlscc_csv_out_fi]
+
+    def get_scc_table(self, csvxmlgen, act_emis_dict):
+        """
+        Aggregate detailed activity and emission data to the XML staging table of
+        the selected scenario, or of all scenarios with `xml_all_scenarios`.
+
+        Parameters
+        ----------
+        csvxmlgen : CsvXmlGen
+            An instance of the CsvXmlGen class for generating CSV and XML files.
+        act_emis_dict : dict
+            A dictionary containing detailed activity and emission data.
+
+        Returns
+        -------
+        pd.DataFrame
+            The XML staging table.
+        """
         xml_pols = self.xml_pollutant_codes_selected
-        xmlscc_df = csvxmlgen.aggsccgen(
+        if self.xml_all_scenarios:
+            return csvxmlgen.aggsccgen(
+                act_emis_dict=act_emis_dict, xml_pols_selected=xml_pols
+            )
+        return csvxmlgen.aggsccgen(
             act_emis_dict=act_emis_dict,
             xml_pols_selected=xml_pols,
             xml_year_selected=self.xml_year_selected,
             xml_season_selected=self.xml_season_selected,
             xml_daytype_selected=self.xml_daytype_selected,
         )
-        xmlscc_df.to_csv(self.xmlscc_csv_out_fi, index=False)
-        self.logger.info(f"Saved XML staging table to {str(self.xmlscc_csv_out_fi)}.")
 
+    def plan_memory(self, csvxmlgen):
+        """
+        Estimate the peak memory of ingesting and labelling the selected data from
+        the main module outputs, before reading them. When the estimate exceeds
+        `memory_budget`, increase `n_shards` so that the `shard_n_workers`
+        concurrent shards fit in the budget.
+
+        Parameters
+        ----------
+        csvxmlgen : CsvXmlGen
+            An instance of the CsvXmlGen class for generating CSV and XML files.
+
+        Returns
+        -------
+        dict or None
+            The memory estimate (see `estimate_peak_memory`), or None when no
+            memory budget is set or the detailed data are not generated.
+        """
+        if self.memory_budget is None or not self.gendetailedcsvfiles:
+            return None
+        estimate = estimate_peak_memory(csvxmlgen)
+        peak_gb = estimate["peak_bytes"] / 2**30
+        self.logger.info(
+            f"Estimated peak memory {peak_gb:.2f} GB for {estimate['act_rows']} "
+            f"activity and {estimate['emis_rows']} emission rows from "
+            f"{estimate['input_bytes'] / 2**30:.2f} GB of main module outputs. "
+            f"Memory budget: {self.memory_budget} GB."
+        )
+        n_shards = math.ceil(peak_gb * self.shard_n_workers / self.memory_budget)
+        if n_shards <= self.n_shards:
+            self.logger.info(f"Running with {self.n_shards} shard(s).")
+            return estimate
+        if n_shards > len(self.FIPSs_selected):
+            self.logger.warning(
+                f"{n_shards} shards are needed to fit the memory budget, but only "
+                f"{len(self.FIPSs_selected)} counties are selected. Processing one "
+                f"county per shard may still exceed the budget."
+            )
+            n_shards = len(self.FIPSs_selected)
+        self.logger.info(
+            f"Estimated peak memory exceeds the memory budget. Switching from "
+            f"{self.n_shards} to {n_shards} shards."
+        )
+        self.n_shards = n_shards
+        return estimate
+
+    def process_sharded(self):
+        """
+        Run the ingest, label, detailed, aggregate, and XML staging table steps per
+        shard of counties and merge the shard outputs. Each shard is processed in a
+        worker process, so the peak memory is bounded by the largest shard times
+        `shard_n_workers`. The workers read the main module outputs through their
+        county index (built once here, see `fileindex.read_counties`), so each parses
+        only the rows of its counties; files not grouped by county are read in full.
+        The detailed CSV files are concatenated from the shard parts and the partial
+        aggregates are summed.
+
+        When the stage cache is used, every completed shard and the merge are
+        checkpointed, so a rerun only processes the shards that did not complete or
+        whose inputs changed.
+
+        Returns
+        -------
+        None
+        """
+        shards = split_fips(self.FIPSs_selected, self.n_shards)
+        if self.stage_cache is not None:
+            shard_root = self.stage_cache.cache_dir.joinpath("shards")
+        else:
+            shard_root = self.out_dir_pp.joinpath(".ppshards")
+        shard_dirs = [shard_root.joinpath(f"shard{i}") for i in range(len(shards))]
+        shard_outs = [
+            shard_outputs(shard_dir, self.genaggpivfiles, self.genxmlfile)
+            for shard_dir in shard_dirs
+        ]
+        shard_params = self.stage_params("shard")
+        shard_hashes = [
+            StageCache.hash_inputs({**shard_params, "FIPSs_shard": FIPSs})
+            for FIPSs in shards
+        ]
+        pending = [
+            i
+            for i in range(len(shards))
+            if self._reuse_status(f"shard{i}", shard_hashes[i]) is None
+        ]
+        self.logger.info(
+            f"Processing {len(self.FIPSs_selected)} counties in {len(shards)} shards "
+            f"with {self.shard_n_workers} worker(s). Reusing "
+            f"{len(shards) - len(pending)} checkpointed shard(s)..."
+        )
+        if pending:
+            # Build the county indexes once, before the workers read the files.
+            raw_fis = [fi for cat, fi in self.act_fis.items() if cat != "TotSHP"]
+            for ei in self.EIs_selected:
+                raw_fis += list(getattr(self, f"ei_fis_{ei}").values())
+            for raw_fi in raw_fis:
+                get_index(raw_fi, index_dir=self.fips_index_dir, logger=self.logger)
+        # The workers rebuild the post-processing from its parameters, with the
+        # labels read from a snapshot instead of the labels database.
+        params = self.get_params()
+        # Each worker reads only the rows of its counties, whatever
+        # `use_fips_index`.
+        params["use_fips_index"] = True
+        if pending and self.labels_snapshot is None:
+            params["labels_snapshot"] = str(
+                save_labels_snapshot(self.labels, shard_root.joinpath("labels"))
+            )
+        shard_err = None
+        with ProcessPoolExecutor(max_workers=self.shard_n_workers) as executor:
+            futures = {
+                executor.submit(
+                    run_shard, params, shards[i], shard_dirs[i], self.metrics
+                ): i
+                for i in pending
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    future.result()
+                except Exception as err:
+                    self.logger.error(f"Error in processing shard {shards[i]}: {err}")
+                    shard_err = shard_err or err
+                    continue
+                if self.stage_cache is not None:
+                    self.stage_cache.record(
+                        f"shard{i}",
+                        shard_hashes[i],
+                        [fi for fi in shard_outs[i].values() if fi is not None],
+                    )
+                    self.stage_cache.complete_stage(f"shard{i}")
+        if shard_err is not None:
+            raise shard_err
+        merge_hash = StageCache.hash_inputs(
+            self.stage_params("merge"), StageCache.hash_inputs(shard_hashes)
+        )
+        if self._reuse_status("merge", merge_hash) is not None:
+            self.logger.info("Reusing the merged shard outputs.")
+            return
+        with self.metrics.measure("merge") as record:
+            merged_fis = self.detailed_out_fis()
+            if self.detailed_format == "star":
+                # The shard parts are fact tables.
+                merged_fis += write_dims(self.dimension_tables(), self.star_out_dir)
+            concat_csv_parts([out["act"] for out in shard_outs], merged_fis[0])
+            concat_csv_parts([out["emis"] for out in shard_outs], merged_fis[1])
+            self.logger.info(
+                f"Saved detailed activity and emission data to {str(merged_fis[0])} and {str(merged_fis[1])}, respectively."
+            )
+            if self.genaggpivfiles:
+                agg_act_emis_dict = CsvXmlGen.aggxlsxfinal(
+                    merge_partial_aggs(
+                        [pd.read_pickle(out["agg"]) for out in shard_outs]
+                    )
+                )
+                merged_fis += self.write_aggregate_tables(agg_act_emis_dict)
+            if self.genxmlfile:
+                xmlscc_df = merge_scc_tables(
+                    [pd.read_pickle(out["scc"]) for out in shard_outs]
+                )
+                xmlscc_df.to_csv(self.xmlscc_csv_out_fi, index=False)
+                self.logger.info(
+                    f"Saved XML staging table to {str(self.xmlscc_csv_out_fi)}."
+                )
+                merged_fis.append(self.xmlscc_csv_out_fi)
+            record.update(
+                bytes_read=count_bytes(
+                    [fi for out in shard_outs for fi in out.values() if fi is not None]
+                ),
+                bytes_written=count_bytes(merged_fis),
+            )
+        if self.stage_cache is not None:
+            self.stage_cache.record("merge", merge_hash, merged_fis)
+            self.stage_cache.complete_stage("merge")
+        else:
+            shutil.rmtree(shard_root)
+
+    def process_incremental(self, csvxmlgen):
+        """
+        Ingest and label only the selected (year, season, dayType, FIPS) partitions
+        missing from the existing detailed outputs, append them to the detailed
+        outputs, and replace their rows in the aggregate tables and the XML staging
+        table. The rows of the other partitions are reused as-is.
+
+        The appended detailed rows follow the existing rows, while the aggregate and
+        XML staging table rows are in the same order as with a run over all the
+        partitions.
+
+        Parameters
+        ----------
+        csvxmlgen : CsvXmlGen
+            An instance of the CsvXmlGen class for generating CSV and XML files.
+
+        Returns
+        -------
+        None
+        """
+        selected = selected_partitions(
+            self.years_selected,
+            self.seasons_selected,
+            self.daytypes_selected,
+            self.FIPSs_selected,
+        )
+        partitions = selected - existing_partitions(self.detailed_out_fis())
+        self.logger.info(
+            f"Appending {len(partitions)} new (year, season, dayType, FIPS) "
+            f"partitions. Reusing {len(selected) - len(partitions)} existing "
+            f"partition(s)..."
+        )
+        if not partitions:
+            return
+        with self.metrics.measure("incremental") as record:
+            # Ingest only the years, seasons, day types, and counties of the new
+            # partitions.
+            (
+                csvxmlgen.years_selected,
+                csvxmlgen.seasons_selected,
+                csvxmlgen.daytypes_selected,
+                csvxmlgen.FIPSs_selected,
+            ) = partition_selections(
+                partitions,
+                self.years_selected,
+                self.seasons_selected,
+                self.daytypes_selected,
+                self.FIPSs_selected,
+            )
+            act_emis_dict = {
+                key: df.loc[partition_mask(df, partitions)].reset_index(drop=True)
+                for key, df in csvxmlgen.detailedcsvgen().items()
+            }
+            out_fis = self.detailed_out_fis()
+            for key, out_fi in zip(["act", "emis"], out_fis):
+                df = act_emis_dict[key]
+                if self.detailed_format == "star":
+                    df = fact_table(df, key)
+                append_csv(df, out_fi)
+            self.logger.info(
+                f"Appended detailed activity and emission data to {str(out_fis[0])} and {str(out_fis[1])}, respectively."
+            )
+            if self.detailed_format == "star":
+                out_fis += write_dims(self.dimension_tables(), self.star_out_dir)
+            if self.genaggpivfiles:
+                old_sheets = {}
+                if self.agg_tab_out_fi.exists():
+                    old_sheets = pd.read_excel(self.agg_tab_out_fi, sheet_name=None)
+                out_fis += self.write_aggregate_tables(
+                    merge_aggregate_tables(
+                        old_sheets, csvxmlgen.aggxlsxgen(act_emis_dict), partitions
+                    )
+                )
+            if self.genxmlfile:
+                xmlscc_df = self.get_scc_table(csvxmlgen, act_emis_dict)
+                if self.xmlscc_csv_out_fi.exists():
+                    xmlscc_df = merge_scc_rows(
+                        pd.read_csv(self.xmlscc_csv_out_fi, dtype={"sccNEI": str}),
+                        xmlscc_df,
+                        partitions,
+                    )
+                xmlscc_df.to_csv(self.xmlscc_csv_out_fi, index=False)
+                self.logger.info(
+                    f"Saved XML staging table to {str(self.xmlscc_csv_out_fi)}."
+                )
+                out_fis.append(self.xmlscc_csv_out_fi)
+            record.update(
+                rows_out=count_rows(act_emis_dict), bytes_written=count_bytes(out_fis)
+            )
+
+    def process_xml_from_staging(self):
+        """
+        Use the metadata and the saved XML staging table to generate the XML file, or
+        one XML file per scenario with `xml_all_scenarios`.
+
+        Returns
+        -------
+        list
+            The XML file paths.
+        """
         self.logger.info("Using Metadata and XML staging table to develop XML...")
         xmlscc_df = pd.read_csv(self.xmlscc_csv_out_fi)
-        xmlscc_df_filt = xmlscc_df.loc[
-            lambda df: (df.year == self.xml_year_selected)
-            & (df.season == self.xml_season_selected)
-            & (df.dayType == self.xml_daytype_selected)
-        ]
-        self.xml_data["Payload"]["Location"] = xmlscc_df_filt
-        xmlgen_obj = XMLGenerator(self.xml_data)
-        tree = xmlgen_obj.generate_xml()
-        tree.write(
-            str(self.xmlscc_xml_out_fi),
-            pretty_print=True,
-            xml_declaration=True,
-            encoding="utf-8",
+        xml_out_fis = []
+        if self.xml_all_scenarios:
+            for (year, season, daytype), xmlscc_df_filt in xmlscc_df.groupby(
+                ["year", "season", "dayType"]
+            ):
+                xml_out_fi = self.get_xml_out_fi(year, season, daytype)
+                self.write_xml_file(xmlscc_df_filt, year, xml_out_fi)
+                xml_out_fis.append(xml_out_fi)
+        else:
+            xmlscc_df_filt = xmlscc_df.loc[
+                lambda df: (df.year == self.xml_year_selected)
+                & (df.season == self.xml_season_selected)
+                & (df.dayType == self.xml_daytype_selected)
+            ]
+            self.write_xml_file(
+                xmlscc_df_filt, self.xml_year_selected, self.xmlscc_xml_out_fi
+            )
+            xml_out_fis.append(self.xmlscc_xml_out_fi)
+        return xml_out_fis
+
+    def write_xml_file(self, xmlscc_df, year, xml_out_fi):
+        """
+        Use the metadata and the XML staging table of a single scenario to generate
+        an XML file.
+
+        Parameters
+        ----------
+        xmlscc_df : pd.DataFrame
+            The XML staging table filtered to a single scenario.
+        year : int
+            The emissions year of the scenario.
+        xml_out_fi : pathlib.Path
+            The XML output file path.
+
+        Returns
+        -------
+        None
+        """
+        self.xml_data["Payload"]["EmissionsYear"] = f"{year}"
+        self.xml_data["Payload"]["Location"] = xmlscc_df
+        # Imported here: lxml is only needed for the XML generation.
+        from ttionroadei.csvxmlpostprc.xmlgen import XMLGenerator
+
+        xmlgen_obj = XMLGenerator(self.xml_data, n_workers=self.xml_n_workers)
+        xmlgen_obj.write_xml(xml_out_fi, compresslevel=self.xml_compress_level)
+        self.logger.info(f"Saved XML to {str(xml_out_fi)}.")
+
+    def sqlite_sources(self):
+        """
+        Get the output files loaded into the SQLite database: the detailed data, and
+        the aggregate and XML staging tables when they are generated.
+
+        Returns
+        -------
+        list
+            The output file paths.
+        """
+        source_fis = self.detailed_out_fis()
+        if self.genaggpivfiles:
+            source_fis.append(self.agg_tab_out_fi)
+        if self.genxmlfile:
+            source_fis.append(self.xmlscc_csv_out_fi)
+        return source_fis
+
+    def write_sqlite_db(self):
+        """
+        Bulk load the detailed activity and emission data, the aggregate tables,
+        and the XML staging table into an indexed SQLite database, with the label
+        tables and the road type mapping as dimension tables (see
+        `sqlitedb.write_sqlite_db`). With the "star" `detailed_format`, the fact
+        tables are loaded instead of the detailed data.
+
+        Returns
+        -------
+        list
+            The SQLite database file path.
+        """
+        self.logger.info("Writing the SQLite database of the outputs...")
+        if self.detailed_format == "star":
+            tables = [Path(fi).stem for fi in FACT_FIS.values()]
+        else:
+            tables = ["activityDetailed", "emissionDetailed"]
+        n_rows = write_sqlite_db(
+            self.sqlite_out_fi,
+            detailed_fis=dict(zip(tables, self.detailed_out_fis())),
+            agg_tab_fi=self.agg_tab_out_fi if self.genaggpivfiles else None,
+            xmlscc_fi=self.xmlscc_csv_out_fi if self.genxmlfile else None,
+            dims=self.dimension_tables(),
         )
-        self.logger.info(f"Saved XML to {str(self.xmlscc_xml_out_fi)}.")
+        self.logger.info(
+            f"Saved {len(n_rows)} tables ({sum(n_rows.values())} rows) to "
+            f"{str(self.sqlite_out_fi)}."
+        )
+        return [self.sqlite_out_fi]
+
+    def stage_params(self, stage):
+        """
+        Get the slice of the post-processing parameters that a stage depends on.
+
+        Parameters
+        ----------
+        stage : str
+            The stage name (see `STAGE_UPSTREAM`), or "shard" and "merge" for the
+            sharded processing.
+
+        Returns
+        -------
+        dict
+            The stage parameters. The raw main module outputs and the road type
+            mapping file are included as size and modification time fingerprints,
+            with a hash of the settings sections used by the stage (see
+            `STAGE_SETTINGS`) and the code version (see `code_version`).
+        """
+        params = self.get_params()
+        if stage == "ingest":
+            keys = [
+                "EIs_selected",
+                "area_selected",
+                "FIPSs_selected",
+                "years_selected",
+                "seasons_selected",
+                "daytypes_selected",
+                "pollutant_map_codes_selected",
+                "conversion_factor",
+                "measure_dtype",
+                "ei_fis_EMS",
+                "ei_fis_RF",
+                "ei_fis_TEC",
+                "act_fis",
+            ]
+            stage_params = {key: params[key] for key in keys}
+            raw_fis = list(self.act_fis.values())
+            for ei in self.EIs_selected:
+                raw_fis += list(getattr(self, f"ei_fis_{ei}").values())
+            stage_params["raw_fis"] = StageCache.fingerprint_files(raw_fis)
+        elif stage == "label":
+            keys = ["area_selected", "fi_temp_tdm_hpms_rdtype", "use_tdm_area_rdtype"]
+            stage_params = {key: params[key] for key in keys}
+            stage_params["labels"] = StageCache.hash_frames(
+                {**self.labels, "area_rdtype": self.tdm_hpms_rdtype_flt}
+            )
+        elif stage == "detailed":
+            keys = ["act_out_fi", "emis_out_fi", "detailed_format", "star_out_dir"]
+            stage_params = {key: params[key] for key in keys}
+        elif stage == "aggregate":
+            stage_params = {"agg_tab_out_fi": params["agg_tab_out_fi"]}
+        elif stage == "scc":
+            keys = [
+                "xml_pollutant_codes_selected",
+                "xml_year_selected",
+                "xml_season_selected",
+                "xml_daytype_selected",
+                "xml_all_scenarios",
+                "xmlscc_csv_out_fi",
+            ]
+            stage_params = {key: params[key] for key in keys}
+        elif stage == "xml":
+            keys = [
+                "area_selected",
+                "xml_year_selected",
+                "xml_season_selected",
+                "xml_daytype_selected",
+                "xml_all_scenarios",
+                "xml_compress",
+                "xml_compress_level",
+                "xmlscc_xml_out_fi",
+                "xml_data",
+            ]
+            stage_params = {key: params[key] for key in keys}
+        elif stage == "sqlite":
+            stage_params = {"sqlite_out_fi": params["sqlite_out_fi"]}
+            stage_params["source_fis"] = StageCache.fingerprint_files(
+                self.sqlite_sources()
+            )
+        elif stage == "shard":
+            stage_params = {
+                "ingest": self.stage_params("ingest"),
+                "label": self.stage_params("label"),
+                "scc": self.stage_params("scc") if self.genxmlfile else None,
+                "genaggpivfiles": self.genaggpivfiles,
+                "detailed_format": self.detailed_format,
+            }
+            # Each shard adds its own counties.
+            del stage_params["ingest"]["FIPSs_selected"]
+        elif stage == "merge":
+            keys = [
+                "act_out_fi",
+                "emis_out_fi",
+                "agg_tab_out_fi",
+                "xmlscc_csv_out_fi",
+                "genaggpivfiles",
+                "genxmlfile",
+                "detailed_format",
+                "star_out_dir",
+            ]
+            stage_params = {key: params[key] for key in keys}
+        else:
+            raise ValueError(f"Unknown post-processing stage: {stage}")
+        stage_params["settings"] = StageCache.hash_settings(STAGE_SETTINGS[stage])
+        stage_params["code"] = code_version()
+        return stage_params
+
+    def run_hash(self):
+        """
+        Hash the post-processing parameters identifying a run that can be resumed.
+
+        Returns
+        -------
+        str
+            Hex digest of the parameters, except the caching and resume options.
+        """
+        params = self.get_params()
+        for key in ["use_stage_cache", "resume"]:
+            del params[key]
+        return StageCache.hash_inputs(params)
+
+    def run_stage(self, stage, csvxmlgen):
+        """
+        Run a post-processing stage, unless the stage cache shows that its inputs
+        are unchanged since the last run, or the stage was completed by the failed
+        run being resumed, in which case its artifacts are reused.
+
+        Parameters
+        ----------
+        stage : str
+            The stage name (see `STAGE_UPSTREAM`).
+        csvxmlgen : CsvXmlGen
+            An instance of the CsvXmlGen class for generating CSV and XML files.
+
+        Returns
+        -------
+        None
+        """
+        upstream = STAGE_UPSTREAM[stage]
+        input_hash = StageCache.hash_inputs(
+            self.stage_params(stage), self._stage_hashes.get(upstream)
+        )
+        status = self._reuse_status(stage, input_hash)
+        if status is not None:
+            self._stage_hashes[stage] = self.stage_cache.artifact_hash(stage)
+            self.logger.info(f"Reusing the output of the {stage} stage ({status}).")
+            with self.metrics.measure(stage) as record:
+                record["status"] = status
+            return
+        upstream_output = (
+            self.stage_output(upstream) if upstream in FRAME_STAGES else None
+        )
+        with self.metrics.measure(stage) as record:
+            output, artifacts = getattr(self, f"_stage_{stage}")(
+                csvxmlgen, upstream_output
+            )
+            record.update(
+                rows_in=count_rows(upstream_output),
+                rows_out=count_rows(output),
+                bytes_written=count_bytes(artifacts),
+            )
+        self._stage_outputs[stage] = output
+        # The ingested data are only consumed by the label stage: release them.
+        if stage == "label":
+            self._stage_outputs.pop("ingest", None)
+        if self.stage_cache is not None:
+            self._stage_hashes[stage] = self.stage_cache.record(
+                stage, input_hash, artifacts
+            )
+            self.stage_cache.complete_stage(stage)
+
+    def _reuse_status(self, stage, input_hash):
+        """
+        Check if the artifacts of a stage (or shard) can be reused instead of running
+        it.
+
+        Parameters
+        ----------
+        stage : str
+            The stage name.
+        input_hash : str
+            The current input hash of the stage.
+
+        Returns
+        -------
+        str or None
+            "resumed" if the stage was completed by the failed run being resumed and
+            its artifacts are intact, whatever its inputs; "cached" if the stage
+            cache is used and its inputs are unchanged; else None.
+        """
+        if self.stage_cache is None:
+            return None
+        if stage in self._resume_stages and self.stage_cache.artifacts_intact(stage):
+            return "resumed"
+        if self.use_stage_cache and self.stage_cache.is_fresh(stage, input_hash):
+            self.stage_cache.complete_stage(stage)
+            return "cached"
+        return None
+
+    def stage_output(self, stage):
+        """
+        Get the output of a stage, from this run or from the stage cache.
+
+        Parameters
+        ----------
+        stage : str
+            The stage name (see `STAGE_UPSTREAM`).
+
+        Returns
+        -------
+        dict or None
+            The activity and emission data produced by the stage.
+        """
+        if stage not in self._stage_outputs:
+            self._stage_outputs[stage] = self.stage_cache.load_frames(stage)
+        return self._stage_outputs[stage]
+
+    def _cache_frames(self, stage, frames):
+        """Persist the DataFrames of a stage when the stage cache is used."""
+        if self.stage_cache is None:
+            return []
+        return self.stage_cache.save_frames(stage, frames)
+
+    def _stage_ingest(self, csvxmlgen, _):
+        act_emis_dict = csvxmlgen.ingest()
+        return act_emis_dict, self._cache_frames("ingest", act_emis_dict)
+
+    def _stage_label(self, csvxmlgen, act_emis_dict):
+        act_emis_dict = csvxmlgen.add_labs(act_emis_dict)
+        return act_emis_dict, self._cache_frames("label", act_emis_dict)
+
+    def _stage_detailed(self, csvxmlgen, act_emis_dict):
+        return None, self.write_detailed_csv(act_emis_dict)
+
+    def _stage_aggregate(self, csvxmlgen, act_emis_dict):
+        return None, self.process_aggregate_tables(csvxmlgen, act_emis_dict)
+
+    def _stage_scc(self, csvxmlgen, act_emis_dict):
+        return None, self.process_scc_table(csvxmlgen, act_emis_dict)
+
+    def _stage_xml(self, csvxmlgen, _):
+        return None, self.process_xml_from_staging()
+
+    def _stage_sqlite(self, csvxmlgen, _):
+        return None, self.write_sqlite_db()
 
     def run_pp(self):
         """
@@ -668,30 +1738,177 @@ class PostProcessorGUI:
         This method executes the complete post-processing workflow, which includes
         generating detailed CSV files, aggregated and pivoted xlsx files, and XML files
         for emissions data based on the specified parameters and options.
+
+        The workflow runs as the ingest, label, detailed, aggregate, SCC, XML, and
+        SQLite stages. With `use_stage_cache`, a stage whose inputs (upstream
+        artifacts, parameters, settings, and code version) are unchanged since the
+        last run is skipped and its artifacts are reused.
+
+        Wall time, CPU time, rows, bytes, and peak memory of every stage and input
+        file are appended to a JSON lines metrics file next to the log (see
+        `MetricsRecorder`) and returned. The stages listed in the `profile_stages`
+        setting or the `TTIONROADEI_PROFILE` environment variable are profiled to
+        binary `.prof` files.
+
+        With `gensqlitedb`, the detailed, aggregate, and XML staging table outputs
+        are then bulk loaded into an indexed SQLite database (see
+        `write_sqlite_db`).
+
+        With `preflight`, the selections are first checked against the headers and
+        key columns of the main module outputs (see `qc_pp_selections`).
+
+        With `csvxml_backend` "duckdb", the ingest, label, aggregate, and SCC steps
+        run as DuckDB queries (see `duckdbgen.DuckDBCsvXmlGen`).
+
+        With `resume`, a run that failed (e.g., during the XML generation) with the
+        same parameters restarts after its last completed stage: the stages (and
+        shards) it completed are not rerun, whatever the state of their inputs
+        (e.g., touched main module outputs or a fixed code version), and the
+        labelled data are loaded from their checkpoint instead of re-ingesting the
+        main module outputs. The stage artifacts are checkpointed for that purpose
+        even without `use_stage_cache`.
+
+        With `incremental` and existing detailed outputs, only the new scenario
+        partitions are processed and merged into the existing outputs (see
+        `process_incremental`), instead of the ingest to SCC stages.
+
+        With more than one shard (`n_shards`), the detailed, aggregate, and XML
+        staging table outputs are produced per shard of counties and merged (see
+        `process_sharded`); each shard and the merge are then checkpointed instead
+        of the ingest to SCC stages.
+        With a `memory_budget`, the number of shards is first increased if the
+        estimated peak memory exceeds the budget (see `plan_memory`).
+
+        Returns
+        -------
+        list
+            The metric records of the run.
         """
+        self._stage_outputs, self._stage_hashes = {}, {}
+        self.stage_cache = None
+        self._resume_stages = set()
+        self.metrics = MetricsRecorder(
+            metrics_file(self.log_dir),
+            trace_memory=self.trace_memory,
+            profile_stages=get_profile_stages(),
+            profile_aggregate=settings.get("profile_aggregate", True),
+        )
+        if self.metrics.profile_dir is not None:
+            self.logger.info(
+                f"Profiling stages {sorted(self.metrics.profile_stages)} to "
+                f"{str(self.metrics.profile_dir)}."
+            )
         try:
-            csvxmlgen = CsvXmlGen(self)
-            if self.gendetailedcsvfiles:
-                act_emis_dict = self.process_detailed_csv(csvxmlgen)
-            else:
-                act_emis_dict = self.load_detailed_csv_data()
-            if self.genaggpivfiles:
-                self.process_aggregate_tables(csvxmlgen, act_emis_dict)
-        except Exception as err:
-            self.logger.error(f"Error in processing raw data: {err}")
-            raise
-        try:
-            if self.genxmlfile:
-                self.process_xml_files(csvxmlgen, act_emis_dict)
-        except Exception as err:
-            self.logger.error(f"Error in XML generation: {err}")
-            raise
+            with self.metrics.measure("run_pp"):
+                try:
+                    csvxmlgen = make_csvxmlgen(self)
+                    if self.preflight and self.gendetailedcsvfiles:
+                        self.qc_pp_selections(csvxmlgen)
+                    self.plan_memory(csvxmlgen)
+                    incremental = (
+                        self.incremental
+                        and self.gendetailedcsvfiles
+                        and all(fi.exists() for fi in self.detailed_out_fis())
+                    )
+                    sharded = (
+                        self.gendetailedcsvfiles
+                        and self.n_shards > 1
+                        and not incremental
+                    )
+                    # Stages whose outputs are produced by the sharded or incremental
+                    # processing instead.
+                    merged = sharded or incremental
+                    if self.use_stage_cache or self.resume:
+                        self.stage_cache = StageCache(
+                            self.out_dir_pp.joinpath(".ppcache"), logger=self.logger
+                        )
+                        self._resume_stages = self.stage_cache.begin_run(
+                            self.run_hash(), self.resume
+                        )
+                        if self._resume_stages:
+                            self.logger.info(
+                                "Resuming the failed run after its completed stages "
+                                f"{sorted(self._resume_stages)}."
+                            )
+                    if incremental:
+                        self.process_incremental(csvxmlgen)
+                    elif sharded:
+                        self.process_sharded()
+                    if merged:
+                        self._stage_hashes["scc"] = (
+                            StageCache.hash_fingerprints([self.xmlscc_csv_out_fi])
+                            if self.genxmlfile
+                            else None
+                        )
+                    elif self.gendetailedcsvfiles:
+                        self.run_stage("ingest", csvxmlgen)
+                        self.run_stage("label", csvxmlgen)
+                        self.run_stage("detailed", csvxmlgen)
+                    else:
+                        self._stage_outputs["label"] = self.load_detailed_csv_data()
+                        self._stage_hashes["label"] = StageCache.hash_fingerprints(
+                            self.detailed_out_fis()
+                        )
+                    if self.genaggpivfiles and not merged:
+                        self.run_stage("aggregate", csvxmlgen)
+                except Exception as err:
+                    self.logger.error(f"Error in processing raw data: {err}")
+                    raise
+                try:
+                    if self.genxmlfile:
+                        if not merged:
+                            self.run_stage("scc", csvxmlgen)
+                        self.run_stage("xml", csvxmlgen)
+                except Exception as err:
+                    self.logger.error(f"Error in XML generation: {err}")
+                    raise
+                try:
+                    if self.gensqlitedb:
+                        self.run_stage("sqlite", csvxmlgen)
+                except Exception as err:
+                    self.logger.error(f"Error in writing the SQLite database: {err}")
+                    raise
+                if self.stage_cache is not None:
+                    self.stage_cache.end_run()
+        finally:
+            # Do not keep the data of the run on the object.
+            self._stage_outputs = {}
         self.logger.info("Post-processing ended")
+        return self.metrics.read_run()
+
+    def qc_pp_selections(self, csvxmlgen):
+        """
+        Check the selected counties, pollutants, units, and road type mapping
+        against the headers and key columns of the main module outputs, before the
+        full ingest (see `preflight.preflight_problems`).
 
-    def qc_pp_selections(self):
-        # ToDo: Write validation test for selected parameters, based on the output of
-        #  main module.Such as, the season + daytype selected here match the output of main module.
-        ...
+        Parameters
+        ----------
+        csvxmlgen : CsvXmlGen
+            An instance of the CsvXmlGen class for generating CSV and XML files.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        ValueError
+            If a selection does not match the main module outputs.
+        """
+        # ToDo: Check that the season + daytype selected here match the output of main
+        #  module once the MOVES 4 utilities outputs have these columns.
+        self.logger.info("Running pre-flight checks of the selections...")
+        with self.metrics.measure("preflight"):
+            problems = preflight_problems(csvxmlgen)
+        if problems:
+            for problem in problems:
+                self.logger.error(problem)
+            raise ValueError(
+                f"Pre-flight checks failed with {len(problems)} problem(s):\n"
+                + "\n".join(problems)
+            )
+        self.logger.info("Pre-flight checks passed.")
 
 
 if __name__ == "__main__":
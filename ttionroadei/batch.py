@@ -0,0 +1,199 @@
+"""
+Headless batch runner for post-processing several areas concurrently.
+
+Each job is a `postProcessorSelection.yaml`-style file saved by
+`PostProcessorGUI.save_params`. Jobs run concurrently, each in a fresh worker
+process, so loggers and peak memory are isolated per job.
+
+Example usage:
+```
+python -m ttionroadei.batch HGB.yaml DFW.yaml TLM.yaml --max-workers 3
+```
+"""
+import argparse
+import multiprocessing as mp
+import queue
+import time
+from pathlib import Path
+import yaml
+
+from ttionroadei.utils import peak_rss_mb
+
+
+def _run_job(job_fi, labels_db, result_queue):
+    """
+    Run the post-processing for a single job file in a worker process and report
+    the runtime and peak memory.
+
+    Parameters
+    ----------
+    job_fi : str
+        The `postProcessorSelection.yaml`-style job file.
+    labels_db : dict or None
+        Keyword arguments for `get_labels`.
+    result_queue : multiprocessing.Queue
+        Queue receiving the job summary.
+    """
+    # Import here so that each spawned worker sets up its own loggers.
+    from ttionroadei.GUI import PostProcessorGUI
+
+    start = time.perf_counter()
+    status, error = "done", ""
+    try:
+        with open(job_fi, "r") as yaml_file:
+            params = yaml.safe_load(yaml_file)
+        Path(params["log_dir"]).mkdir(parents=True, exist_ok=True)
+        ppgui = PostProcessorGUI(
+            ei_base_dir=params.get("ei_base_dir"), log_dir=params["log_dir"]
+        )
+        ppgui.load_params(params, labels_db=params.get("labels_db", labels_db))
+        ppgui.run_pp()
+    except Exception as err:
+        status, error = "failed", f"{type(err).__name__}: {err}"
+    result_queue.put(
+        {
+            "job": str(job_fi),
+            "status": status,
+            "runtime_s": time.perf_counter() - start,
+            "peak_rss_mb": peak_rss_mb(),
+            "error": error,
+        }
+    )
+
+
+def check_job_isolation(job_fis):
+    """
+    Check that no two jobs write to the same output or log directory.
+
+    Parameters
+    ----------
+    job_fis : list
+        The job files.
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    ValueError
+        If two jobs share an output (summary) or log directory.
+    """
+    seen = {}
+    for job_fi in job_fis:
+        with open(job_fi, "r") as yaml_file:
+            params = yaml.safe_load(yaml_file)
+        for key in ("summary_dir", "log_dir"):
+            out_dir = Path(params[key]).resolve()
+            if (key, out_dir) in seen:
+                raise ValueError(
+                    f"Jobs {seen[(key, out_dir)]} and {job_fi} share the {key} "
+                    f"{out_dir}. Each job needs its own output and log directories."
+                )
+            seen[(key, out_dir)] = job_fi
+
+
+def run_batch(job_fis, max_workers=None, labels_db=None):
+    """
+    Run the post-processing jobs concurrently, each in a fresh worker process.
+
+    Parameters
+    ----------
+    job_fis : list
+        The `postProcessorSelection.yaml`-style job files.
+    max_workers : int, optional
+        The maximum number of concurrent jobs. Default is None (number of CPUs).
+    labels_db : dict, optional
+        Keyword arguments for `get_labels`, used for jobs whose file has no
+        `labels_db` entry.
+
+    Returns
+    -------
+    list
+        The job summaries (job, status, runtime_s, peak_rss_mb, error) in the order
+        of `job_fis`.
+    """
+    job_fis = [str(job_fi) for job_fi in job_fis]
+    check_job_isolation(job_fis)
+    max_workers = max_workers or mp.cpu_count()
+    ctx = mp.get_context("spawn")
+    result_queue = ctx.Queue()
+    pending = list(job_fis)
+    running = {}
+    results = {}
+    while pending or running:
+        while pending and len(running) < max_workers:
+            job_fi = pending.pop(0)
+            running[job_fi] = ctx.Process(
+                target=_run_job, args=(job_fi, labels_db, result_queue)
+            )
+            running[job_fi].start()
+        try:
+            result = result_queue.get(timeout=1)
+            results[result["job"]] = result
+            running.pop(result["job"]).join()
+        except queue.Empty:
+            # A worker killed by the OS (e.g., out of memory) never reports.
+            for job_fi, proc in list(running.items()):
+                if not proc.is_alive() and result_queue.empty():
+                    proc.join()
+                    del running[job_fi]
+                    results[job_fi] = {
+                        "job": job_fi,
+                        "status": "failed",
+                        "runtime_s": float("nan"),
+                        "peak_rss_mb": None,
+                        "error": f"Worker exited with code {proc.exitcode}.",
+                    }
+    return [results[job_fi] for job_fi in job_fis]
+
+
+def format_summary(results):
+    """
+    Format the job summaries as a text table.
+
+    Parameters
+    ----------
+    results : list
+        The job summaries returned by `run_batch`.
+
+    Returns
+    -------
+    str
+        The consolidated summary table.
+    """
+    header = f"{'Job':<50} {'Status':<8} {'Runtime (s)':>12} {'Peak RSS (MB)':>14}"
+    lines = [header, "-" * len(header)]
+    for result in results:
+        peak = result["peak_rss_mb"]
+        peak = f"{peak:14.1f}" if peak is not None else f"{'n/a':>14}"
+        lines.append(
+            f"{result['job']:<50} {result['status']:<8} "
+            f"{result['runtime_s']:12.1f} {peak}"
+        )
+        if result["error"]:
+            lines.append(f"    {result['error']}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run post-processing jobs for several areas concurrently."
+    )
+    parser.add_argument(
+        "job_fis", nargs="+", help="postProcessorSelection.yaml-style job files."
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=None,
+        help="Maximum number of concurrent jobs (default: number of CPUs).",
+    )
+    args = parser.parse_args(argv)
+    results = run_batch(args.job_fis, max_workers=args.max_workers)
+    print(format_summary(results))
+    return 0 if all(result["status"] == "done" for result in results) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,4 @@
+"""
+Synthetic MOVES utility outputs and stage benchmarks of the post-processing, so the
+performance of `CsvXmlGen` and `XMLGenerator` can be measured without project data.
+"""
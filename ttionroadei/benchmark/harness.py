@@ -0,0 +1,304 @@
+"""
+Stage benchmarks of the post-processing on synthetic data of several sizes.
+
+For each number of counties, synthetic main module outputs are generated (see
+`synthetic.write_synthetic_area`) and the post-processing is run in a fresh worker
+process, `repeats` times. The wall time, CPU time, and peak memory of each stage
+are taken from the run metrics (see `MetricsRecorder`) and written to a JSON file.
+
+Example usage:
+```
+python -m ttionroadei.benchmark.harness --sizes 1 4 16 --repeats 3 --out bench.json
+```
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing as mp
+import os
+import platform
+import shutil
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from ttionroadei.benchmark.synthetic import write_synthetic_area, synthetic_job_params
+from ttionroadei.utils import ts
+
+# Stages reported by the benchmark, in run order.
+BENCH_STAGES = [
+    "preflight",
+    "ingest",
+    "label",
+    "detailed",
+    "aggregate",
+    "scc",
+    "xml",
+    "shard",
+    "merge",
+    "run_pp",
+]
+
+
+def _run_once(params):
+    """
+    Run the post-processing of a synthetic area in a worker process.
+
+    Parameters
+    ----------
+    params : dict
+        The post-processing parameters.
+
+    Returns
+    -------
+    list
+        The metric records of the run.
+    """
+    # Import here so that each spawned worker sets up its own loggers.
+    from ttionroadei.GUI import PostProcessorGUI
+
+    Path(params["log_dir"]).mkdir(parents=True, exist_ok=True)
+    ppgui = PostProcessorGUI(ei_base_dir=None, log_dir=params["log_dir"])
+    ppgui.load_params(params)
+    return ppgui.run_pp()
+
+
+def stage_totals(records):
+    """
+    Sum the stage-level metric records of a run by stage. Per-file records are
+    skipped; stages measured several times (e.g., shards) are summed, and their
+    peak memory is the maximum.
+
+    Parameters
+    ----------
+    records : list
+        The metric records of a run.
+
+    Returns
+    -------
+    dict
+        The wall_s, cpu_s, peak_rss_mb, rows_out, and bytes_written by stage.
+    """
+    totals = {}
+    for record in records:
+        if record.get("file") is not None or record["stage"] not in BENCH_STAGES:
+            continue
+        total = totals.setdefault(
+            record["stage"],
+            {
+                "wall_s": 0.0,
+                "cpu_s": 0.0,
+                "peak_rss_mb": None,
+                "rows_out": None,
+                "bytes_written": None,
+            },
+        )
+        total["wall_s"] += record["wall_s"]
+        total["cpu_s"] += record["cpu_s"]
+        if record["peak_rss_mb"] is not None:
+            total["peak_rss_mb"] = max(total["peak_rss_mb"] or 0, record["peak_rss_mb"])
+        for key in ("rows_out", "bytes_written"):
+            if record.get(key) is not None:
+                total[key] = (total[key] or 0) + record[key]
+    return totals
+
+
+def summarize_runs(n_counties, runs):
+    """
+    Summarize the stage totals of the repeated runs of a size with their medians.
+
+    Parameters
+    ----------
+    n_counties : int
+        The number of counties.
+    runs : list
+        The stage totals (see `stage_totals`) of each run.
+
+    Returns
+    -------
+    list
+        One result per stage: n_counties, stage, the median wall_s, cpu_s, and
+        peak_rss_mb, rows_out, bytes_written, and the wall time of each run
+        ("wall_s_runs").
+    """
+    results = []
+    stages = [stage for stage in BENCH_STAGES if any(stage in run for run in runs)]
+    for stage in stages:
+        stage_runs = [run[stage] for run in runs if stage in run]
+        peaks = [run["peak_rss_mb"] for run in stage_runs if run["peak_rss_mb"]]
+        results.append(
+            {
+                "n_counties": n_counties,
+                "stage": stage,
+                "wall_s": float(np.median([run["wall_s"] for run in stage_runs])),
+                "cpu_s": float(np.median([run["cpu_s"] for run in stage_runs])),
+                "peak_rss_mb": float(np.median(peaks)) if peaks else None,
+                "rows_out": stage_runs[0]["rows_out"],
+                "bytes_written": stage_runs[0]["bytes_written"],
+                "wall_s_runs": [run["wall_s"] for run in stage_runs],
+            }
+        )
+    return results
+
+
+def environment():
+    """
+    Get the environment of the benchmark, to judge whether two benchmark files are
+    comparable.
+
+    Returns
+    -------
+    dict
+        The platform, Python, pandas, and numpy versions, and the number of CPUs.
+    """
+    return {
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_benchmark(sizes, work_dir, repeats=1, EIs=("EMS",), keep_data=False, **options):
+    """
+    Benchmark the post-processing stages on synthetic data of several sizes.
+
+    Parameters
+    ----------
+    sizes : list
+        The numbers of counties (1 to 254).
+    work_dir : str or Path
+        The directory receiving the synthetic data and the post-processing outputs.
+    repeats : int, optional
+        The number of runs per size. Default is 1.
+    EIs : tuple, optional
+        The emission inventory types. Default is ("EMS",).
+    keep_data : bool, optional
+        Keep the synthetic data and outputs in `work_dir`. Default is False.
+    **options
+        Post-processing parameters overriding the defaults of
+        `synthetic_job_params` (e.g., genxmlfile, n_shards).
+
+    Returns
+    -------
+    dict
+        The benchmark: creation time ("created"), environment, configuration
+        ("config"), and stage results ("results", see `summarize_runs`).
+    """
+    work_dir = Path(work_dir)
+    ctx = mp.get_context("spawn")
+    results = []
+    for n_counties in sizes:
+        size_dir = work_dir.joinpath(f"n{n_counties}")
+        area_data = write_synthetic_area(size_dir.joinpath("data"), n_counties)
+        runs = []
+        for i in range(repeats):
+            params = synthetic_job_params(
+                area_data,
+                out_dir=size_dir.joinpath("out"),
+                log_dir=size_dir.joinpath("logs"),
+                EIs=EIs,
+                **options,
+            )
+            # A fresh process per run, so the peak memory of a run is its own.
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as executor:
+                runs.append(stage_totals(executor.submit(_run_once, params).result()))
+        results.extend(summarize_runs(n_counties, runs))
+        if not keep_data:
+            shutil.rmtree(size_dir, ignore_errors=True)
+    return {
+        "created": ts(),
+        "environment": environment(),
+        "config": {
+            "sizes": list(sizes),
+            "repeats": repeats,
+            "EIs": list(EIs),
+            "options": options,
+        },
+        "results": results,
+    }
+
+
+def format_results(benchmark):
+    """
+    Format the stage results of a benchmark as a text table.
+
+    Parameters
+    ----------
+    benchmark : dict
+        The benchmark returned by `run_benchmark`.
+
+    Returns
+    -------
+    str
+        The results table.
+    """
+    header = (
+        f"{'Counties':>8} {'Stage':<10} {'Wall (s)':>10} {'CPU (s)':>10} "
+        f"{'Peak RSS (MB)':>14} {'Rows out':>12}"
+    )
+    lines = [header, "-" * len(header)]
+    for result in benchmark["results"]:
+        peak = result["peak_rss_mb"]
+        rows = result["rows_out"]
+        lines.append(
+            f"{result['n_counties']:>8} {result['stage']:<10} "
+            f"{result['wall_s']:10.2f} {result['cpu_s']:10.2f} "
+            f"{(f'{peak:.1f}' if peak is not None else 'n/a'):>14} "
+            f"{(rows if rows is not None else 'n/a'):>12}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the post-processing stages on synthetic data."
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16],
+        help="Numbers of counties (default: 1 4 16).",
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=1, help="Runs per size (default: 1)."
+    )
+    parser.add_argument(
+        "--eis",
+        nargs="+",
+        default=["EMS"],
+        choices=["EMS", "RF", "TEC"],
+        help="Emission inventory types (default: EMS).",
+    )
+    parser.add_argument(
+        "--work-dir",
+        default="ppbenchmark",
+        help="Directory of the synthetic data and outputs (default: ppbenchmark).",
+    )
+    parser.add_argument(
+        "--keep-data", action="store_true", help="Keep the synthetic data and outputs."
+    )
+    parser.add_argument(
+        "--out",
+        default="benchmark.json",
+        help="Benchmark JSON file (default: benchmark.json).",
+    )
+    args = parser.parse_args(argv)
+    benchmark = run_benchmark(
+        args.sizes,
+        args.work_dir,
+        repeats=args.repeats,
+        EIs=tuple(args.eis),
+        keep_data=args.keep_data,
+    )
+    with open(args.out, "w") as f:
+        json.dump(benchmark, f, indent=2)
+    print(format_results(benchmark))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
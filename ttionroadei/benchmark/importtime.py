@@ -0,0 +1,133 @@
+"""
+Import-time benchmark of the package modules.
+
+Each module is imported in a fresh interpreter with `-X importtime`, so the
+measured time includes all the modules it imports. The heavy optional modules
+(sqlalchemy, pint, lxml, pkg_resources) loaded by the import are also reported:
+they should only be loaded when the labels, the unit conversion, or the XML
+generation are first used.
+
+Example usage:
+```
+python -m ttionroadei.benchmark.importtime --repeats 5
+```
+"""
+import argparse
+import json
+import re
+import subprocess
+import sys
+import numpy as np
+
+# Modules imported at startup by the GUI, the batch runner, and worker processes.
+MODULES = ["ttionroadei.utils", "ttionroadei.GUI", "ttionroadei.batch"]
+HEAVY_MODULES = ["sqlalchemy", "pint", "lxml", "pkg_resources"]
+_IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)")
+
+
+def measure_import(module, repeats=5):
+    """
+    Measure the import time of a module in fresh interpreters.
+
+    Parameters
+    ----------
+    module : str
+        The module name.
+    repeats : int, optional
+        The number of imports. Default is 5.
+
+    Returns
+    -------
+    dict
+        The module, the median import time in seconds ("import_s"), the slowest
+        direct imports of the module with their cumulative time in seconds
+        ("slowest"), and the heavy modules loaded ("heavy_loaded").
+    """
+    code = (
+        f"import sys, json, {module}; "
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    times, direct, heavy_loaded = [], {}, []
+    for _ in range(repeats):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        heavy_loaded = json.loads(proc.stdout.strip().splitlines()[-1])
+        imports = [
+            (len(match[3]), match[4], int(match[2]) / 1e6)
+            for match in map(_IMPORTTIME_RE.match, proc.stderr.splitlines())
+            if match is not None
+        ]
+        # A module is listed after the modules it imports, which are indented more.
+        for i, (depth, name, cumulative) in enumerate(imports):
+            if name != module:
+                continue
+            times.append(cumulative)
+            for child_depth, child, child_cumulative in reversed(imports[:i]):
+                if child_depth <= depth:
+                    break
+                if child_depth == depth + 2:
+                    direct.setdefault(child, []).append(child_cumulative)
+    slowest = sorted(
+        ((name, float(np.median(vals))) for name, vals in direct.items()),
+        key=lambda item: -item[1],
+    )[:5]
+    return {
+        "module": module,
+        "import_s": float(np.median(times)) if times else None,
+        "slowest": slowest,
+        "heavy_loaded": heavy_loaded,
+    }
+
+
+def format_import_times(results):
+    """
+    Format the import-time results as a text table.
+
+    Parameters
+    ----------
+    results : list
+        The outputs of `measure_import`.
+
+    Returns
+    -------
+    str
+        The import-time table.
+    """
+    header = f"{'Module':<22} {'Import (s)':>10}  Heavy modules loaded"
+    lines = [header, "-" * len(header)]
+    for result in results:
+        lines.append(
+            f"{result['module']:<22} {result['import_s']:10.3f}  "
+            f"{', '.join(result['heavy_loaded']) or '-'}"
+        )
+        for name, import_s in result["slowest"]:
+            lines.append(f"    {name:<34} {import_s:8.3f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure the import time of the package modules."
+    )
+    parser.add_argument(
+        "modules", nargs="*", default=MODULES, help="Modules (default: main modules)."
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=5, help="Imports per module (default: 5)."
+    )
+    parser.add_argument("--out", default=None, help="Save the results as JSON.")
+    args = parser.parse_args(argv)
+    results = [measure_import(module, args.repeats) for module in args.modules]
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    print(format_import_times(results))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
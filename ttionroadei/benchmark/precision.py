@@ -0,0 +1,239 @@
+"""
+Precision of the float32 measure storage against a float64 run on synthetic data.
+
+The post-processing of a synthetic area (see `synthetic.write_synthetic_area`) is
+run once with each `measure_dtype`, in fresh worker processes. The measures of the
+detailed data, the aggregate tables, and the XML staging table of the float32 run
+are matched by their key columns with those of the float64 run, and the maximum
+relative error of each output is reported with the peak memory of the stages.
+
+Example usage:
+```
+python -m ttionroadei.benchmark.precision --counties 4 --out precision.json
+```
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing as mp
+import shutil
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from ttionroadei.benchmark.harness import _run_once, stage_totals, environment
+from ttionroadei.benchmark.synthetic import write_synthetic_area, synthetic_job_params
+from ttionroadei.csvxmlpostprc.csvxmlgen import MEASURE_DTYPES
+from ttionroadei.utils import ts
+
+# Measure columns of the compared outputs; the other columns are keys.
+MEASURES = ["activity", "emission", "E6MILE"]
+
+
+def max_relative_error(ref_df, test_df):
+    """
+    Get the maximum relative error of the measures of a DataFrame against a
+    reference, matching their rows by the key columns.
+
+    Parameters
+    ----------
+    ref_df, test_df : pd.DataFrame
+        The reference (float64) and tested (float32) data, with the same columns.
+
+    Returns
+    -------
+    dict
+        The maximum relative error by measure column. A nonzero value whose
+        reference is zero, or a row missing from either DataFrame, gives an
+        infinite error.
+    """
+    measures = [col for col in MEASURES if col in ref_df.columns]
+    keys = [col for col in ref_df.columns if col not in measures]
+    df = ref_df.merge(
+        test_df[list(ref_df.columns)],
+        on=keys,
+        how="outer",
+        suffixes=("Ref", "Test"),
+    )
+    errors = {}
+    for col in measures:
+        ref, test = df[f"{col}Ref"].to_numpy(), df[f"{col}Test"].to_numpy()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rel = np.abs(test - ref) / np.abs(ref)
+        rel = np.where((test == ref) | (np.isnan(test) & np.isnan(ref)), 0.0, rel)
+        errors[col] = float(np.nan_to_num(rel, nan=np.inf).max()) if len(rel) else 0.0
+    return errors
+
+
+def output_errors(ref_params, test_params):
+    """
+    Get the maximum relative errors of the outputs of a run against those of a
+    reference run.
+
+    Parameters
+    ----------
+    ref_params, test_params : dict
+        The post-processing parameters of the reference and tested runs.
+
+    Returns
+    -------
+    dict
+        The maximum relative error by measure column of each output: "act" and
+        "emis" (detailed data), "<sheet>" (aggregate tables), and "scc" (XML
+        staging table).
+    """
+    errors = {}
+    for key in ["act", "emis"]:
+        errors[key] = max_relative_error(
+            pd.read_csv(ref_params[f"{key}_out_fi"]),
+            pd.read_csv(test_params[f"{key}_out_fi"]),
+        )
+    if ref_params.get("genaggpivfiles"):
+        ref_sheets = pd.read_excel(ref_params["agg_tab_out_fi"], sheet_name=None)
+        test_sheets = pd.read_excel(test_params["agg_tab_out_fi"], sheet_name=None)
+        for sheet, ref_df in ref_sheets.items():
+            errors[sheet] = max_relative_error(ref_df, test_sheets[sheet])
+    if ref_params.get("genxmlfile"):
+        errors["scc"] = max_relative_error(
+            pd.read_csv(ref_params["xmlscc_csv_out_fi"]),
+            pd.read_csv(test_params["xmlscc_csv_out_fi"]),
+        )
+    return errors
+
+
+def run_precision(n_counties, work_dir, EIs=("EMS",), keep_data=False, **options):
+    """
+    Run the post-processing of a synthetic area with float64 and float32 measure
+    storage and compare their outputs.
+
+    Parameters
+    ----------
+    n_counties : int
+        The number of counties (1 to 254).
+    work_dir : str or Path
+        The directory receiving the synthetic data and the post-processing outputs.
+    EIs : tuple, optional
+        The emission inventory types. Default is ("EMS",).
+    keep_data : bool, optional
+        Keep the synthetic data and outputs in `work_dir`. Default is False.
+    **options
+        Post-processing parameters overriding the defaults of
+        `synthetic_job_params` (e.g., csvxml_backend).
+
+    Returns
+    -------
+    dict
+        The comparison: creation time ("created"), environment, configuration
+        ("config"), the maximum relative error of each output ("errors", see
+        `output_errors`) and overall ("max_rel_error"), and the stage totals of
+        each run by measure dtype ("stages", see `harness.stage_totals`).
+    """
+    work_dir = Path(work_dir)
+    ctx = mp.get_context("spawn")
+    area_data = write_synthetic_area(work_dir.joinpath("data"), n_counties)
+    params, stages = {}, {}
+    for dtype in MEASURE_DTYPES:
+        params[dtype] = synthetic_job_params(
+            area_data,
+            out_dir=work_dir.joinpath(f"out_{dtype}"),
+            log_dir=work_dir.joinpath("logs"),
+            EIs=EIs,
+            **{**options, "measure_dtype": dtype},
+        )
+        # A fresh process per run, so the peak memory of a run is its own.
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as executor:
+            stages[dtype] = stage_totals(
+                executor.submit(_run_once, params[dtype]).result()
+            )
+    errors = output_errors(params["float64"], params["float32"])
+    if not keep_data:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "created": ts(),
+        "environment": environment(),
+        "config": {"n_counties": n_counties, "EIs": list(EIs), "options": options},
+        "errors": errors,
+        "max_rel_error": max(max(val.values()) for val in errors.values()),
+        "stages": stages,
+    }
+
+
+def format_precision(precision):
+    """
+    Format the errors and peak memory of a comparison as text tables.
+
+    Parameters
+    ----------
+    precision : dict
+        The comparison returned by `run_precision`.
+
+    Returns
+    -------
+    str
+        The tables.
+    """
+    header = f"{'Output':<26} {'Measure':<10} {'Max rel. error':>15}"
+    lines = [header, "-" * len(header)]
+    for output, val in precision["errors"].items():
+        for measure, error in val.items():
+            lines.append(f"{output:<26} {measure:<10} {error:15.3e}")
+    lines.append(f"{'All outputs':<37} {precision['max_rel_error']:15.3e}")
+    lines.append("")
+    header = f"{'Stage':<10} " + " ".join(
+        f"{f'{dtype} peak (MB)':>18}" for dtype in MEASURE_DTYPES
+    )
+    lines += [header, "-" * len(header)]
+    for stage in precision["stages"]["float64"]:
+        peaks = [
+            precision["stages"][dtype].get(stage, {}).get("peak_rss_mb")
+            for dtype in MEASURE_DTYPES
+        ]
+        lines.append(
+            f"{stage:<10} "
+            + " ".join(
+                f"{(f'{peak:.1f}' if peak is not None else 'n/a'):>18}"
+                for peak in peaks
+            )
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare float32 and float64 measure storage on synthetic data."
+    )
+    parser.add_argument(
+        "--counties", type=int, default=4, help="Number of counties (default: 4)."
+    )
+    parser.add_argument(
+        "--eis",
+        nargs="+",
+        default=["EMS"],
+        choices=["EMS", "RF", "TEC"],
+        help="Emission inventory types (default: EMS).",
+    )
+    parser.add_argument(
+        "--work-dir",
+        default="ppprecision",
+        help="Directory of the synthetic data and outputs (default: ppprecision).",
+    )
+    parser.add_argument(
+        "--keep-data", action="store_true", help="Keep the synthetic data and outputs."
+    )
+    parser.add_argument(
+        "--out",
+        default="precision.json",
+        help="Comparison JSON file (default: precision.json).",
+    )
+    args = parser.parse_args(argv)
+    precision = run_precision(
+        args.counties, args.work_dir, EIs=tuple(args.eis), keep_data=args.keep_data
+    )
+    with open(args.out, "w") as f:
+        json.dump(precision, f, indent=2)
+    print(format_precision(precision))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,238 @@
+"""
+Performance regression gate comparing a benchmark against a stored baseline.
+
+The wall time and peak memory of each stage and size of the current benchmark (see
+`harness.run_benchmark`) are compared with those of the baseline benchmark. A stage
+fails when its increase over the baseline exceeds both the relative tolerance of
+the stage (`benchmark_tolerances` setting) and the noise floor
+(`benchmark_min_delta` setting).
+
+Example usage (runs the benchmark of the baseline configuration on synthetic data
+when no current benchmark file is given):
+```
+python -m ttionroadei.benchmark.regression baseline.json
+python -m ttionroadei.benchmark.regression baseline.json --current benchmark.json
+```
+"""
+import argparse
+import json
+from pathlib import Path
+import tempfile
+
+from ttionroadei.benchmark.harness import run_benchmark
+from ttionroadei.utils import settings
+
+# Compared metrics of the stage results.
+METRICS = ["wall_s", "peak_rss_mb"]
+
+
+def load_benchmark(path):
+    """
+    Load a benchmark JSON file written by the benchmark harness.
+
+    Parameters
+    ----------
+    path : str or Path
+        The benchmark JSON file.
+
+    Returns
+    -------
+    dict
+        The benchmark.
+    """
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def stage_tolerances(stage, tolerances=None):
+    """
+    Get the relative tolerances of a stage.
+
+    Parameters
+    ----------
+    stage : str
+        The stage name.
+    tolerances : dict, optional
+        The default ("default") and per-stage relative tolerances by metric.
+        Default is None (`benchmark_tolerances` setting).
+
+    Returns
+    -------
+    dict
+        The relative tolerance by metric.
+    """
+    tolerances = tolerances or settings["benchmark_tolerances"]
+    return {**tolerances["default"], **tolerances.get(stage, {})}
+
+
+def compare_benchmarks(current, baseline, tolerances=None, min_delta=None):
+    """
+    Compare the stage results of a benchmark with those of a baseline benchmark.
+
+    Parameters
+    ----------
+    current : dict
+        The current benchmark.
+    baseline : dict
+        The baseline benchmark.
+    tolerances : dict, optional
+        The default and per-stage relative tolerances by metric. Default is None
+        (`benchmark_tolerances` setting).
+    min_delta : dict, optional
+        The increase by metric below which a change is ignored as noise. Default is
+        None (`benchmark_min_delta` setting).
+
+    Returns
+    -------
+    list
+        One row per size, stage, and metric: n_counties, stage, metric, baseline,
+        current, change (relative), tolerance, and status ("ok", "fail", "missing"
+        when the current benchmark lacks the stage, or "new" when the baseline
+        lacks it).
+    """
+    min_delta = min_delta or settings["benchmark_min_delta"]
+    current_res = {(res["n_counties"], res["stage"]): res for res in current["results"]}
+    baseline_res = {
+        (res["n_counties"], res["stage"]): res for res in baseline["results"]
+    }
+    rows = []
+    for key in list(baseline_res) + [k for k in current_res if k not in baseline_res]:
+        n_counties, stage = key
+        tols = stage_tolerances(stage, tolerances)
+        for metric in METRICS:
+            base_val = baseline_res.get(key, {}).get(metric)
+            cur_val = current_res.get(key, {}).get(metric)
+            row = {
+                "n_counties": n_counties,
+                "stage": stage,
+                "metric": metric,
+                "baseline": base_val,
+                "current": cur_val,
+                "change": None,
+                "tolerance": tols.get(metric),
+                "status": "ok",
+            }
+            if key not in current_res:
+                row["status"] = "missing"
+            elif key not in baseline_res:
+                row["status"] = "new"
+            elif base_val is not None and cur_val is not None:
+                if base_val > 0:
+                    row["change"] = cur_val / base_val - 1
+                exceeded = cur_val > base_val * (1 + row["tolerance"])
+                if exceeded and cur_val - base_val > min_delta.get(metric, 0):
+                    row["status"] = "fail"
+            rows.append(row)
+    return rows
+
+
+def environment_differences(current, baseline):
+    """
+    Get the environment entries that differ between two benchmarks, which make
+    their timings not comparable.
+
+    Parameters
+    ----------
+    current : dict
+        The current benchmark.
+    baseline : dict
+        The baseline benchmark.
+
+    Returns
+    -------
+    dict
+        The differing entries, as (baseline, current) tuples.
+    """
+    cur_env = current.get("environment", {})
+    base_env = baseline.get("environment", {})
+    return {
+        key: (base_env.get(key), cur_env.get(key))
+        for key in sorted(set(cur_env) | set(base_env))
+        if cur_env.get(key) != base_env.get(key)
+    }
+
+
+def format_comparison(rows):
+    """
+    Format the comparison rows as a text table.
+
+    Parameters
+    ----------
+    rows : list
+        The rows returned by `compare_benchmarks`.
+
+    Returns
+    -------
+    str
+        The comparison table.
+    """
+
+    def fmt(val, spec):
+        return format(val, spec) if val is not None else "n/a"
+
+    header = (
+        f"{'Counties':>8} {'Stage':<10} {'Metric':<12} {'Baseline':>10} "
+        f"{'Current':>10} {'Change':>8} {'Limit':>7}  Status"
+    )
+    lines = [header, "-" * len(header)]
+    for row in rows:
+        lines.append(
+            f"{row['n_counties']:>8} {row['stage']:<10} {row['metric']:<12} "
+            f"{fmt(row['baseline'], '.2f'):>10} {fmt(row['current'], '.2f'):>10} "
+            f"{fmt(row['change'], '+.0%'):>8} {fmt(row['tolerance'], '+.0%'):>7}  "
+            f"{row['status'].upper() if row['status'] == 'fail' else row['status']}"
+        )
+    n_fail = sum(row["status"] == "fail" for row in rows)
+    lines.append("")
+    lines.append(
+        f"{n_fail} regression(s) beyond tolerance."
+        if n_fail
+        else "No regression beyond tolerance."
+    )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare a post-processing benchmark against a baseline."
+    )
+    parser.add_argument("baseline", help="Baseline benchmark JSON file.")
+    parser.add_argument(
+        "--current",
+        default=None,
+        help="Current benchmark JSON file (default: run the benchmark of the "
+        "baseline configuration on synthetic data).",
+    )
+    parser.add_argument(
+        "--save-current",
+        default=None,
+        help="Save the benchmark run by the gate to this JSON file.",
+    )
+    args = parser.parse_args(argv)
+    baseline = load_benchmark(args.baseline)
+    if args.current is not None:
+        current = load_benchmark(args.current)
+    else:
+        config = baseline["config"]
+        with tempfile.TemporaryDirectory() as work_dir:
+            current = run_benchmark(
+                config["sizes"],
+                work_dir,
+                repeats=config["repeats"],
+                EIs=tuple(config["EIs"]),
+                **config["options"],
+            )
+        if args.save_current is not None:
+            Path(args.save_current).write_text(json.dumps(current, indent=2))
+    env_diff = environment_differences(current, baseline)
+    if env_diff:
+        print("Warning: the benchmarks ran in different environments:")
+        for key, (base_val, cur_val) in env_diff.items():
+            print(f"    {key}: {base_val} (baseline) vs. {cur_val} (current)")
+    rows = compare_benchmarks(current, baseline)
+    print(format_comparison(rows))
+    return 1 if any(row["status"] == "fail" for row in rows) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,494 @@
+"""
+Generator of synthetic MOVES utility main module outputs.
+
+Writes the activity (`VMT_st_ft_Summary.txt`, `Adjusted_SHP.txt`, `SHP.txt`,
+`ONI.txt`, `Hotelling_Hours.txt`, `Start.txt`) and emission (`emission_output_*.txt`
+with their `RF_` and `TEC_` variants) files with the column schemas of the
+`act_rename` and `emis_rename` settings, the road type mapping file, and a label
+snapshot, for 1 to 254 Texas counties. The files are written one county at a time,
+so the memory used does not grow with the number of counties.
+
+Example usage:
+```
+area = write_synthetic_area("bench_data/n16", n_counties=16)
+params = synthetic_job_params(area, out_dir="bench_out/n16", log_dir="bench_out/n16/logs")
+```
+"""
+import itertools
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from ttionroadei.utils import settings, unit_converter, save_labels_snapshot
+
+# Texas county FIPS codes (48001 to 48507, odd codes only).
+TX_FIPS = list(range(48001, 48509, 2))
+HOURS = list(range(1, 25))
+AREA_TYPES = [1, 2]
+FUNC_CLASSES = [1, 2, 3, 4]
+SUTS = [11, 21, 31, 32, 41, 42, 43, 51, 52, 53, 54, 61, 62]
+FUEL_TYPES = [1, 2]
+# Id columns of the on-network, off-network, and hotelling files.
+GRIDS = {
+    "onnet": {
+        "Hour": HOURS,
+        "Areatype": AREA_TYPES,
+        "Roadtype": FUNC_CLASSES,
+        "SUT": SUTS,
+        "Fueltype": FUEL_TYPES,
+    },
+    "offnet": {"Hour": HOURS, "SUT": SUTS, "Fueltype": FUEL_TYPES},
+    "hotelling": {"Hour": HOURS},
+}
+# Activity files: relative path, grid, and value columns with their maximum value.
+ACT_FILES = {
+    "OnRoad": (
+        "Summarized_output/VMT_st_ft_Summary.txt",
+        "onnet",
+        {"VMT Calculated": 1e4, "VHT Calculated": 300, "Speed": 70},
+    ),
+    "AdjSHP": (
+        "Activity_output/Adjusted_SHP.txt",
+        "offnet",
+        {"Adjust SHP Calculated": 100},
+    ),
+    "TotSHP": ("Activity_output/SHP.txt", "offnet", {"SHP Calculated": 100}),
+    "ONI": ("Activity_output/ONI.txt", "offnet", {"ONI Calculated": 10}),
+    "APU_SHEI": (
+        "Activity_output/Hotelling_Hours.txt",
+        "hotelling",
+        {"SHEI Calculated": 10, "APU Calculated": 3},
+    ),
+    "Starts": ("Activity_output/Start.txt", "offnet", {"Starts Calculated": 100}),
+}
+# Emission files: file name and grid by category.
+EMIS_FILES = {
+    "OnRoad": ("emission_output_VMT.txt", "onnet"),
+    "APU": ("emission_output_APU.txt", "hotelling"),
+    "ONI": ("emission_output_ONI.txt", "offnet"),
+    "SHEI": ("emission_output_SHEI.txt", "hotelling"),
+    "SHP": ("emission_output_SHP.txt", "offnet"),
+    "Starts": ("emission_output_Starts.txt", "offnet"),
+}
+# Emission inventory types: file name prefix, MOVES pollutantIDs, and, by category,
+# the MOVES processIDs and the value column.
+EI_TYPES = {
+    "EMS": (
+        "",
+        [2, 3, 87, 100, 106, 107, 110, 116, 117],
+        {
+            "OnRoad": ([1, 9, 10, 15, 16], "VMT_Emission"),
+            "APU": ([91], "Emission"),
+            "ONI": ([90], "ONI Emission"),
+            "SHEI": ([90], "Emission"),
+            "SHP": ([1], "Adjusted SHP Emission"),
+            "Starts": ([2], "Start Emission"),
+        },
+    ),
+    "RF": (
+        "RF_",
+        [87],
+        {
+            "OnRoad": ([18, 19], "VMT_RF_Emission"),
+            "APU": ([18], "RF Emission"),
+            "ONI": ([18], "ONI RF Emission"),
+            "SHEI": ([18], "RF Emission"),
+            "Starts": ([18], "Start RF Emission"),
+        },
+    ),
+    "TEC": (
+        "TEC_",
+        [91],
+        {
+            "OnRoad": ([1], "VMT_TEC_Emission"),
+            "APU": ([91], "TEC Emission"),
+            "ONI": ([90], "ONI TEC Emission"),
+            "SHEI": ([90], "TEC Emission"),
+            "Starts": ([2], "Start TEC Emission"),
+        },
+    ),
+}
+# MOVES pollutants reported in energy units.
+ENERGY_POLLUTANTS = [91]
+
+
+def check_schemas():
+    """
+    Check that the columns of the synthetic files are those renamed by the
+    `act_rename` and `emis_rename` settings.
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    ValueError
+        If a column is not in the settings.
+    """
+    for cat, (_, grid, values) in ACT_FILES.items():
+        cols = ["County", *GRIDS[grid]] + ([] if cat == "TotSHP" else list(values))
+        missing = set(cols) - set(settings["act_rename"])
+        if missing:
+            raise ValueError(f"Activity columns {missing} are not in act_rename.")
+    for ei, (_, _, cats) in EI_TYPES.items():
+        for cat, (_, value_col) in cats.items():
+            cols = ["County", *GRIDS[EMIS_FILES[cat][1]]]
+            cols += ["Pollutant", "Process", value_col, "Unit"]
+            missing = set(cols) - set(settings["emis_rename"])
+            if missing:
+                raise ValueError(f"{ei} emission columns {missing} not in emis_rename.")
+
+
+def synthetic_labels():
+    """
+    Get labels with the structure of `get_labels` covering the synthetic data.
+
+    Returns
+    -------
+    dict
+        The label DataFrames.
+    """
+    processes = [1, 2, 9, 10, 11, 12, 13, 15, 16, 17, 18, 19, 90, 91]
+    pollutants = sorted(
+        set(pol for _, pols, _ in EI_TYPES.values() for pol in pols) | {1, 5, 6, 90}
+    )
+    return {
+        "county": pd.DataFrame(
+            {
+                "FIPS": TX_FIPS,
+                "county": [f"County{fips % 1000:03d}" for fips in TX_FIPS],
+            }
+        ),
+        "emisprc": pd.DataFrame(
+            {
+                "processID": processes,
+                "processName": [f"Process {prc}" for prc in processes],
+                "processABB": [f"P{prc}" for prc in processes],
+            }
+        ),
+        "pollutants": pd.DataFrame(
+            {"pollutantID": pollutants, "pollutant": [f"Pol{p}" for p in pollutants]}
+        ),
+        "moves_roadtypes": pd.DataFrame(
+            {
+                "mvsRoadTypeID": [1, 2, 3, 4, 5],
+                "mvsRoadType": [
+                    "Off-Network",
+                    "Rural Restricted Access",
+                    "Rural Unrestricted Access",
+                    "Urban Restricted Access",
+                    "Urban Unrestricted Access",
+                ],
+                "mvsRoadLab": ["offNet", "rurRes", "rurUnRes", "urbRes", "urbUnRes"],
+            }
+        ),
+        "moves_sut": pd.DataFrame(
+            {
+                "sourceUseTypeID": SUTS,
+                "sourceUseType": [f"Source Type {sut}" for sut in SUTS],
+                "sutLab": [
+                    "MC",
+                    "PC",
+                    "PT",
+                    "LCT",
+                    "OBus",
+                    "TBus",
+                    "SBus",
+                    "RT",
+                    "SuShT",
+                    "SuLhT",
+                    "MH",
+                    "CShT",
+                    "CLhT",
+                ],
+            }
+        ),
+        "moves_ft": pd.DataFrame(
+            {
+                "fuelTypeID": [1, 2, 3, 4, 5, 9],
+                "fuelType": [
+                    "Gasoline",
+                    "Diesel Fuel",
+                    "Compressed Natural Gas (CNG)",
+                    "Liquefied Petroleum Gas (LPG)",
+                    "Ethanol (E-85)",
+                    "Electricity",
+                ],
+                "ftLab": ["G", "D", "CNG", "LPG", "E85", "ELEC"],
+            }
+        ),
+        "act_lab": pd.DataFrame(
+            {
+                "actTypeABB": [
+                    "VMT",
+                    "VHT",
+                    "Speed",
+                    "AdjSHP",
+                    "ONI",
+                    "Starts",
+                    "SHEI",
+                    "APU",
+                ],
+                "actType": [
+                    "VMT",
+                    "VHT",
+                    "Speed",
+                    "Adjusted SHP",
+                    "ONI",
+                    "Starts",
+                    "Extended Idle Hours",
+                    "APU Hours",
+                ],
+            }
+        ),
+    }
+
+
+def synthetic_rdtype(area="VLink"):
+    """
+    Get a road type mapping of the TDM area and functional class codes of the
+    synthetic data to the MOVES road types.
+
+    Parameters
+    ----------
+    area : str, optional
+        The area of the mapping. Default is "VLink".
+
+    Returns
+    -------
+    pd.DataFrame
+        The road type mapping, with the columns of `RoadType_Designation.csv`.
+    """
+    rows = []
+    for areatype, area_lab, rdtypes in [
+        (1, "Urban", [4, 5, 5, 5]),
+        (2, "Rural", [2, 3, 3, 3]),
+    ]:
+        for func_class, func_lab, rdtype in zip(
+            FUNC_CLASSES, ["Freeway", "Arterial", "Collector", "Local"], rdtypes
+        ):
+            rows.append([area, func_class, func_lab, areatype, area_lab, rdtype])
+    rdtype_df = pd.DataFrame(
+        rows,
+        columns=[
+            "Area",
+            "TDM_FunctionClass_Code",
+            "FunctionClass",
+            "TDM_AreaType_Code",
+            "AreaType",
+            "MOVES_RoadTypeID",
+        ],
+    )
+    return rdtype_df.assign(
+        MOVES_RoadType=lambda df: df.MOVES_RoadTypeID.map(
+            synthetic_labels()["moves_roadtypes"].set_index("mvsRoadTypeID").mvsRoadType
+        )
+    )
+
+
+def _grid(grid, **extra):
+    # Cartesian product of the id columns of a county.
+    cols = {**GRIDS[grid], **extra}
+    return pd.DataFrame(list(itertools.product(*cols.values())), columns=list(cols))
+
+
+def _write_by_county(path, FIPSs, template, fill):
+    # Append the rows of each county, so only one county is held in memory.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", newline="") as f:
+        for i, fips in enumerate(FIPSs):
+            df = template.copy()
+            df.insert(0, "County", fips)
+            fill(df)
+            df.to_csv(f, sep="\t", index=False, header=i == 0)
+    return path
+
+
+def write_synthetic_area(out_dir, n_counties=1, seed=0, area="VLink"):
+    """
+    Write synthetic main module outputs, a road type mapping file, and a label
+    snapshot.
+
+    Parameters
+    ----------
+    out_dir : str or Path
+        The output directory.
+    n_counties : int, optional
+        The number of counties (1 to 254). Default is 1.
+    seed : int, optional
+        The random seed of the values. Default is 0.
+    area : str, optional
+        The area of the road type mapping. Default is "VLink".
+
+    Returns
+    -------
+    dict
+        The county FIPS codes ("FIPSs"), the emission output directory ("ei_dir"),
+        the activity ("act_fis") and emission ("ei_fis_EMS", "ei_fis_RF",
+        "ei_fis_TEC") file paths by category, the road type mapping file path
+        ("fi_temp_tdm_hpms_rdtype"), and the label snapshot directory
+        ("labels_snapshot").
+    """
+    if not 1 <= n_counties <= len(TX_FIPS):
+        raise ValueError(f"n_counties must be between 1 and {len(TX_FIPS)}.")
+    check_schemas()
+    out_dir = Path(out_dir)
+    rng = np.random.default_rng(seed)
+    FIPSs = TX_FIPS[:n_counties]
+
+    def fill_values(values):
+        def fill(df):
+            for col, max_val in values.items():
+                df[col] = rng.random(len(df)) * max_val
+
+        return fill
+
+    act_fis = {}
+    for cat, (rel_path, grid, values) in ACT_FILES.items():
+        act_fis[cat] = _write_by_county(
+            out_dir.joinpath(rel_path), FIPSs, _grid(grid), fill_values(values)
+        )
+    ei_dir = out_dir.joinpath("Emission_output")
+    ei_fis = {}
+    for ei, (prefix, pols, cats) in EI_TYPES.items():
+        ei_fis[ei] = {}
+        for cat, (procs, value_col) in cats.items():
+            file_nm, grid = EMIS_FILES[cat]
+            template = _grid(grid, Pollutant=pols, Process=procs)
+            template["Unit"] = np.where(
+                template.Pollutant.isin(ENERGY_POLLUTANTS), "Kilojoules", "grams"
+            )
+            # Keep the value column before the unit column, as in the utility outputs.
+            template.insert(len(template.columns) - 1, value_col, 0.0)
+            ei_fis[ei][cat] = _write_by_county(
+                ei_dir.joinpath(prefix + file_nm),
+                FIPSs,
+                template,
+                fill_values({value_col: 100}),
+            )
+    rdtype_fi = out_dir.joinpath("RoadType_Designation.csv")
+    synthetic_rdtype(area).to_csv(rdtype_fi, index=False)
+    snapshot_dir = save_labels_snapshot(synthetic_labels(), out_dir.joinpath("labels"))
+    return {
+        "FIPSs": FIPSs,
+        "ei_dir": ei_dir,
+        "act_fis": act_fis,
+        "ei_fis_EMS": ei_fis["EMS"],
+        "ei_fis_RF": ei_fis["RF"],
+        "ei_fis_TEC": ei_fis["TEC"],
+        "fi_temp_tdm_hpms_rdtype": rdtype_fi,
+        "labels_snapshot": snapshot_dir,
+    }
+
+
+def synthetic_job_params(area_data, out_dir, log_dir, EIs=("EMS",), **options):
+    """
+    Get post-processing parameters of a synthetic area, loadable with
+    `PostProcessorGUI.load_params` or savable as a batch job file.
+
+    Parameters
+    ----------
+    area_data : dict
+        The output of `write_synthetic_area`.
+    out_dir : str or Path
+        The post-processing output (summary) directory.
+    log_dir : str or Path
+        The log directory.
+    EIs : tuple, optional
+        The emission inventory types. Default is ("EMS",).
+    **options
+        Other parameters overriding the defaults (e.g., genxmlfile, n_shards).
+
+    Returns
+    -------
+    dict
+        The post-processing parameters, as returned by
+        `PostProcessorGUI.get_params`.
+    """
+    out_dir = Path(out_dir)
+    pollutant_map = {
+        "CO": [2],
+        "NOx": [3],
+        "PM10": [100, 106, 107],
+        "PM25": [110, 116, 117],
+        "TEC": [91],
+        "VOC": [87],
+    }
+    pollutant_codes = ["CO", "NOx", "PM10", "PM25"]
+    if "TEC" in EIs:
+        pollutant_codes.append("TEC")
+    if "RF" in EIs:
+        pollutant_codes.append("VOC")
+    units = [("grams", "short_ton"), ("Kilojoules", "MBTU")]
+    area, year, season, daytype = "SYN", 2020, "s", "wkd"
+    params = {
+        "EIs_selected": list(EIs),
+        "area_selected": area,
+        "FIPSs_selected": list(area_data["FIPSs"]),
+        "years_selected": [year],
+        "seasons_selected": [season],
+        "daytypes_selected": [daytype],
+        "pollutant_map_codes_selected": {
+            code: pollutant_map[code] for code in pollutant_codes
+        },
+        "pollutant_codes_selected": pollutant_codes,
+        "xml_year_selected": year,
+        "xml_season_selected": season,
+        "xml_daytype_selected": daytype,
+        "xml_pollutant_codes_selected": ["CO", "NOx", "PM10", "PM25"],
+        "conversion_factor": {
+            "input_units": [in_unit for in_unit, _ in units],
+            "output_units": [out_unit for _, out_unit in units],
+            "confactor": [unit_converter(*unit_pair) for unit_pair in units],
+        },
+        "fi_temp_tdm_hpms_rdtype": str(area_data["fi_temp_tdm_hpms_rdtype"]),
+        "use_tdm_area_rdtype": False,
+        "gendetailedcsvfiles": True,
+        "genaggpivfiles": True,
+        "genxmlfile": True,
+        "use_stage_cache": False,
+        "resume": False,
+        "labels_snapshot": str(area_data["labels_snapshot"]),
+        "ei_base_dir": None,
+        "log_dir": str(log_dir),
+        "ei_dir": str(area_data["ei_dir"]),
+        "summary_dir": str(out_dir),
+        "ei_fis_EMS": {cat: str(fi) for cat, fi in area_data["ei_fis_EMS"].items()},
+        "ei_fis_RF": {cat: str(fi) for cat, fi in area_data["ei_fis_RF"].items()},
+        "ei_fis_TEC": {cat: str(fi) for cat, fi in area_data["ei_fis_TEC"].items()},
+        "act_fis": {cat: str(fi) for cat, fi in area_data["act_fis"].items()},
+        "act_out_fi": str(out_dir.joinpath("activityDetailed.csv")),
+        "emis_out_fi": str(out_dir.joinpath("emissionDetailed.csv")),
+        "xmlscc_csv_out_fi": str(out_dir.joinpath("xmlSCCStagingTable.csv")),
+        "xmlscc_xml_out_fi": str(
+            out_dir.joinpath(f"{area}{year}{season}{daytype}.xml")
+        ),
+        "agg_tab_out_fi": str(out_dir.joinpath("aggregateTable.xlsx")),
+        "sqlite_out_fi": str(out_dir.joinpath("postProcessorOutput.sqlite")),
+        "star_out_dir": str(out_dir.joinpath("starSchema")),
+        "xml_data": {
+            "Header": {
+                "id": f"{area}_{year}{season}{daytype}",
+                "AuthorName": "Synthetic Benchmark",
+                "OrganizationName": "Synthetic Benchmark",
+                "DocumentTitle": "EIS",
+                "CreationDateTime": "2020-01-01T00:00:00",
+                "Comment": "Synthetic MOVES utility outputs for benchmarking",
+                "DataFlowName": "CERS_V2",
+                "Properties": {"SubmissionType": "QA", "DataCategory": "Onroad"},
+            },
+            "Payload": {
+                "UserIdentifier": "SYNTHETIC",
+                "ProgramSystemCode": "TXCEQ",
+                "EmissionsYear": f"{year}",
+                "Model": "MOVES",
+                "ModelVersion": "MOVES3.0.3",
+                "SubmittalComment": "Synthetic MOVES utility outputs",
+                "ReportingPeriod": "O3D",
+                "CalculationParameterTypeCode": "I",
+            },
+        },
+    }
+    params.update(options)
+    return params
@@ -0,0 +1,70 @@
+"""
+Shared fixtures of the tests: synthetic main module outputs (see
+`ttionroadei.benchmark.synthetic`) and post-processing runs on them, so the tests do
+not need project data.
+
+The synthetic outputs and the full run are built once per test session; the tests
+reading the outputs of the full run must not modify them.
+"""
+from pathlib import Path
+import pytest
+
+from ttionroadei.benchmark.synthetic import write_synthetic_area, synthetic_job_params
+from ttionroadei.GUI import PostProcessorGUI
+
+
+@pytest.fixture(scope="session")
+def synthetic_area(tmp_path_factory):
+    """Synthetic main module outputs of two counties."""
+    return write_synthetic_area(tmp_path_factory.mktemp("synthetic_area"), n_counties=2)
+
+
+@pytest.fixture(scope="session")
+def job_params(synthetic_area, tmp_path_factory):
+    """
+    Factory of the parameters of synthetic runs. Each run gets new output and log
+    directories unless `out_dir` or `log_dir` is given.
+    """
+
+    def make(out_dir=None, log_dir=None, EIs=("EMS",), **options):
+        base = tmp_path_factory.mktemp("run")
+        out_dir = out_dir or base.joinpath("out")
+        log_dir = Path(log_dir or base.joinpath("logs"))
+        log_dir.mkdir(parents=True, exist_ok=True)
+        return synthetic_job_params(
+            synthetic_area, out_dir, log_dir, EIs=EIs, **options
+        )
+
+    return make
+
+
+@pytest.fixture(scope="session")
+def make_gui():
+    """Factory of a post-processing GUI object loaded with parameters."""
+
+    def make(params, **overrides):
+        ppgui = PostProcessorGUI(ei_base_dir=None, log_dir=params["log_dir"])
+        ppgui.load_params({**params, **overrides})
+        return ppgui
+
+    return make
+
+
+@pytest.fixture(scope="session")
+def run_job(make_gui):
+    """Factory running the post-processing and returning its metric records."""
+
+    def run(params, **overrides):
+        return make_gui(params, **overrides).run_pp()
+
+    return run
+
+
+@pytest.fixture(scope="session")
+def full_run(job_params, run_job):
+    """
+    Parameters and metric records of a run of the two counties producing every
+    output (XML files of all the scenarios and the SQLite database).
+    """
+    params = job_params(xml_all_scenarios=True, gensqlitedb=True)
+    return params, run_job(params)
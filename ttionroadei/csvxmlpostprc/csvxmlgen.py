@@ -6,6 +6,67 @@ Created by: Apoorb
 import pandas as pd
 import logging as lg
 from ttionroadei.utils import _add_handler, settings
+from ttionroadei.metrics import MetricsRecorder
+from ttionroadei.csvxmlpostprc.fileindex import read_counties
+
+# Execution backends of the CsvXmlGen transformations (see `make_csvxmlgen`).
+CSVXML_BACKENDS = ("pandas", "duckdb")
+# Main module output categories without road and area types (set to -99), and
+# hotelling categories without source use and fuel types (set to combination
+# long-haul truck, diesel).
+EMIS_OFFNET_CATS = ["SHP", "ONI", "APU", "SHEI", "Starts"]
+EMIS_HOTELLING_CATS = ["APU", "SHEI"]
+ACT_OFFNET_CATS = ["AdjSHP", "ONI", "APU_SHEI", "Starts"]
+ACT_HOTELLING_CATS = ["APU_SHEI"]
+# Storage dtypes of the activity and emission measures of the detailed data.
+MEASURE_DTYPES = ("float64", "float32")
+MEASURE_COLS = {"act": "activity", "emis": "emission"}
+
+
+def store_measures(act_emis_dict, measure_dtype):
+    """
+    Cast the activity and emission measures to their storage dtype, in place.
+
+    Parameters
+    ----------
+    act_emis_dict : dict
+        A dictionary containing activity and emissions data.
+    measure_dtype : str
+        The storage dtype, one of MEASURE_DTYPES.
+
+    Returns
+    -------
+    dict
+        `act_emis_dict`.
+    """
+    for key, col in MEASURE_COLS.items():
+        df = act_emis_dict[key]
+        df[col] = df[col].astype(measure_dtype, copy=False)
+    return act_emis_dict
+
+
+def sum_by(df, idx, value):
+    """
+    Sum a measure by index columns, accumulating in float64 whatever the storage
+    dtype of the measure. Gives the same result as
+    `df.groupby(idx, as_index=False)[value].sum()` for float64 measures.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The data.
+    idx : list
+        The index columns.
+    value : str
+        The measure column.
+
+    Returns
+    -------
+    pd.DataFrame
+        The index columns and the summed measure.
+    """
+    values = df[value].astype("float64", copy=False)
+    return values.groupby([df[col] for col in idx]).sum().reset_index()
 
 
 class CsvXmlGen:
@@ -52,23 +113,46 @@ class CsvXmlGen:
         A lambda function for generating SCC (Source Classification Code) from data.
     sutFtfun : function
         A lambda function for generating SUT-FT labels from data.
+    metrics : MetricsRecorder
+        The recorder of the per-file ingestion metrics.
+    use_fips_index : bool
+        Read only the byte ranges of the selected counties of the main module
+        outputs using their county index (see `fileindex.read_counties`).
+    fips_index_dir : pathlib.Path or None
+        The directory of the county indexes. None stores them next to the main
+        module outputs.
+    ingest_engine : str
+        The engine parsing the main module outputs, "pandas" or "arrow" (see
+        `readers.read_delimited`).
+    measure_dtype : str
+        The storage dtype of the activity and emission measures of the ingested and
+        detailed data, "float64" or "float32". The aggregations sum in float64.
 
     Methods
     -------
     paramqc()
         Perform parameter quality checks to ensure data processing parameters are valid.
+    ingest(dev_w_mvs3=True)
+        Read, filter, and reshape the activity and emissions data without labels.
+    add_labs(act_emis_dict)
+        Check the area and road type mapping and add labels to the ingested data.
     detailedcsvgen(dev_w_mvs3=True)
         Generate detailed CSV files from activity and emissions data.
     aggxlsxgen(act_emis_dict)
         Aggregate detailed activity and emissions data and generate summary Excel files.
+    aggxlsxpartial(act_emis_dict)
+        Sum detailed activity and emissions data by the aggregation indices.
+    aggxlsxfinal(aggdfs)
+        Sort the summed data and keep the columns shown in the aggregate tables.
     aggsccgen(
         act_emis_dict,
         xml_pols_selected,
-        xml_year_selected,
-        xml_season_selected,
-        xml_daytype_selected,
+        xml_year_selected=None,
+        xml_season_selected=None,
+        xml_daytype_selected=None,
     )
         Aggregate emissions data to NEI SCCs and return the result as a DataFrame.
+        Scenario parameters left as None aggregate all the scenarios at once.
     _emisprc()
         Process emissions data and filter it based on selected parameters.
     _actprc()
@@ -110,6 +194,16 @@ class CsvXmlGen:
             + "0080"
         )
         self.sutFtfun = lambda df: df.sutLab + "_" + df.ftLab
+        self.metrics = getattr(gui_obj, "metrics", None) or MetricsRecorder()
+        self.use_fips_index = getattr(gui_obj, "use_fips_index", False)
+        self.fips_index_dir = getattr(gui_obj, "fips_index_dir", None)
+        self.ingest_engine = getattr(gui_obj, "ingest_engine", "pandas")
+        self.measure_dtype = getattr(gui_obj, "measure_dtype", "float64")
+        if self.measure_dtype not in MEASURE_DTYPES:
+            raise ValueError(
+                f"Unknown measure dtype {self.measure_dtype}. Use one of "
+                f"{MEASURE_DTYPES}."
+            )
 
     def qc_input_units_and_conversion(self, _emis_tmp1):
         try:
@@ -123,12 +217,42 @@ class CsvXmlGen:
             self.logger.error(msg=f"{verr}")
             raise
 
+    def _melt_id_cols(self, columns_key, exclude, dev_w_mvs3):
+        """
+        Get the id columns of the main module outputs kept when melting their value
+        columns.
+
+        Parameters
+        ----------
+        columns_key : str
+            The settings key of the detailed data columns ("csvxml_act" or
+            "csvxml_ei").
+        exclude : list
+            The index columns added after melting.
+        dev_w_mvs3 : bool
+            A flag indicating whether the data is from MOVES3 or MOVES4 utilities.
+
+        Returns
+        -------
+        list
+            The id columns.
+        """
+        id_cols = set(self.settings[columns_key]["idx"]) - set(exclude)
+        # FixMe: Update after MOVES 4 main utilities are ready.
+        if dev_w_mvs3:
+            id_cols = [
+                i for i in id_cols if i not in ("area", "dayType", "season", "year")
+            ]
+        return list(id_cols)
+
     def _emisprc(self, dev_w_mvs3):
         """
         This method processes emissions data, applies filters, and formats it for
         further processing. It reads emissions data files for different EI
         categories, filters them based on selected parameters such as FIPS codes,
-        and renames columns for consistency.
+        and renames columns for consistency. With `use_fips_index`, only the rows of
+        the selected counties are read. Only the renamed columns are parsed, by the
+        `ingest_engine`.
 
         Parameters
         ----------
@@ -142,46 +266,55 @@ class CsvXmlGen:
             attributes.
         """
         emis_filter_rename_dict = self.settings["emis_rename"]
-        emis_id_cols = set(self.settings["csvxml_ei"]["idx"]) - set(
-            ["pollutantCode", "actTypeABB"]
+        emis_id_cols = self._melt_id_cols(
+            "csvxml_ei", ["pollutantCode", "actTypeABB"], dev_w_mvs3
         )
-        # FixMe: Update after MOVES 4 main utilities are ready.
-        if dev_w_mvs3:
-            emis_id_cols = [
-                i
-                for i in emis_id_cols
-                if i not in ("area", "dayType", "season", "year")
-            ]
         ls_df = []
         for ei in self.ei_fis.keys():
             if ei not in self.EIs_selected:
                 continue
             for cat, path in self.ei_fis[ei].items():
-                df = pd.read_csv(path, sep="\t")
-                # FixMe: the revised output from Chaoyi might handle this
-                df["EIType"] = ei
-                df1 = (
-                    df.filter(items=emis_filter_rename_dict.keys())
-                    .rename(columns=emis_filter_rename_dict)
-                    .loc[
-                        lambda df: (df.FIPS.isin(self.FIPSs_selected))
-                        # FixMe: Add the following columns and filters for MOVES 4 utilities
-                        # & (df.area == self.area_selected)
-                        # & (df.year.isin(self.year_selected))
-                        # & (df.season.isin(self.season_selected))
-                        # & (df.dayType.isin(self.dayType_selected))
-                    ]
-                )
-                df1 = df1.rename(columns={"emission": cat})
-                if cat in ["SHP", "ONI", "APU", "SHEI", "Starts"]:
-                    df1[["funcClassID", "areaTypeID"]] = -99
-                if cat in ["APU", "SHEI"]:
-                    df1[["sourceUseTypeID"]] = 62
-                    df1[["fuelTypeID"]] = 2
-                df2 = df1.melt(
-                    id_vars=emis_id_cols, var_name="actTypeABB", value_name="emission"
-                )
-                ls_df.append(df2)
+                with self.metrics.measure("ingest", file=str(path)) as record:
+                    df, n_bytes = read_counties(
+                        path,
+                        self.FIPSs_selected,
+                        use_index=self.use_fips_index,
+                        index_dir=self.fips_index_dir,
+                        logger=self.logger,
+                        engine=self.ingest_engine,
+                        columns=emis_filter_rename_dict.keys(),
+                    )
+                    # FixMe: the revised output from Chaoyi might handle this
+                    df["EIType"] = ei
+                    df1 = (
+                        df.filter(items=emis_filter_rename_dict.keys())
+                        .rename(columns=emis_filter_rename_dict)
+                        .loc[
+                            lambda df: (df.FIPS.isin(self.FIPSs_selected))
+                            # FixMe: Add the following columns and filters for MOVES 4 utilities
+                            # & (df.area == self.area_selected)
+                            # & (df.year.isin(self.year_selected))
+                            # & (df.season.isin(self.season_selected))
+                            # & (df.dayType.isin(self.dayType_selected))
+                        ]
+                    )
+                    df1 = df1.rename(columns={"emission": cat})
+                    if cat in EMIS_OFFNET_CATS:
+                        df1[["funcClassID", "areaTypeID"]] = -99
+                    if cat in EMIS_HOTELLING_CATS:
+                        df1[["sourceUseTypeID"]] = 62
+                        df1[["fuelTypeID"]] = 2
+                    df2 = df1.melt(
+                        id_vars=emis_id_cols,
+                        var_name="actTypeABB",
+                        value_name="emission",
+                    )
+                    ls_df.append(df2)
+                    record.update(
+                        rows_in=len(df),
+                        rows_out=len(df2),
+                        bytes_read=n_bytes,
+                    )
         _emis_tmp = pd.concat(ls_df)
         _emis_tmp1 = self.outpollutants.merge(_emis_tmp, on="pollutantID", how="left")
         self.qc_input_units_and_conversion(_emis_tmp1)
@@ -199,6 +332,8 @@ class CsvXmlGen:
         This method processes activity data, applies filters, and formats it
         for further processing. It reads activity data files, filters them based on
         selected parameters such as FIPS codes, and renames columns for consistency.
+        With `use_fips_index`, only the rows of the selected counties are read. Only
+        the renamed columns are parsed, by the `ingest_engine`.
 
         Parameters
         ----------
@@ -212,43 +347,46 @@ class CsvXmlGen:
             and attributes.
         """
         act_filter_rename_dict = self.settings["act_rename"]
-        act_id_cols = set(self.settings["csvxml_act"]["idx"]) - set(
-            ["actTypeABB", "activityunits"]
+        act_id_cols = self._melt_id_cols(
+            "csvxml_act", ["actTypeABB", "activityunits"], dev_w_mvs3
         )
-        # FixMe: Update after MOVES 4 main utilities are ready.
-        if dev_w_mvs3:
-            act_id_cols = [
-                i for i in act_id_cols if i not in ("area", "dayType", "season", "year")
-            ]
         ls_df = []
         for cat, path in self.act_fis.items():
             if cat == "TotSHP":
                 # Note: removing total SHP. It is a combination of AdjSHP and ONI.
                 continue
-            df = pd.read_csv(path, sep="\t")
-            df1 = (
-                df.filter(items=act_filter_rename_dict.keys())
-                .rename(columns=act_filter_rename_dict)
-                .loc[
-                    lambda df: (df.FIPS.isin(self.FIPSs_selected))
-                    # FixMe: Add the following columns and filters for MOVES 4 utilities
-                    # & (df.area == self.area_selected)
-                    # & (df.year.isin(self.year_selected))
-                    # & (df.season.isin(self.season_selected))
-                    # & (df.dayType.isin(self.dayType_selected))
-                ]
-            )
-            if cat in ["AdjSHP", "ONI", "APU_SHEI", "Starts"]:
-                df1[["funcClassID", "areaTypeID"]] = -99
-            if cat in [
-                "APU_SHEI",
-            ]:
-                df1[["sourceUseTypeID"]] = 62
-                df1[["fuelTypeID"]] = 2
-            df2 = df1.melt(
-                id_vars=act_id_cols, var_name="actTypeABB", value_name="activity"
-            )
-            ls_df.append(df2)
+            with self.metrics.measure("ingest", file=str(path)) as record:
+                df, n_bytes = read_counties(
+                    path,
+                    self.FIPSs_selected,
+                    use_index=self.use_fips_index,
+                    index_dir=self.fips_index_dir,
+                    logger=self.logger,
+                    engine=self.ingest_engine,
+                    columns=act_filter_rename_dict.keys(),
+                )
+                df1 = (
+                    df.filter(items=act_filter_rename_dict.keys())
+                    .rename(columns=act_filter_rename_dict)
+                    .loc[
+                        lambda df: (df.FIPS.isin(self.FIPSs_selected))
+                        # FixMe: Add the following columns and filters for MOVES 4 utilities
+                        # & (df.area == self.area_selected)
+                        # & (df.year.isin(self.year_selected))
+                        # & (df.season.isin(self.season_selected))
+                        # & (df.dayType.isin(self.dayType_selected))
+                    ]
+                )
+                if cat in ACT_OFFNET_CATS:
+                    df1[["funcClassID", "areaTypeID"]] = -99
+                if cat in ACT_HOTELLING_CATS:
+                    df1[["sourceUseTypeID"]] = 62
+                    df1[["fuelTypeID"]] = 2
+                df2 = df1.melt(
+                    id_vars=act_id_cols, var_name="actTypeABB", value_name="activity"
+                )
+                ls_df.append(df2)
+                record.update(rows_in=len(df), rows_out=len(df2), bytes_read=n_bytes)
         _act = pd.concat(ls_df).assign(
             activityunits=lambda df: df.actTypeABB.map(self.settings["activityunits"])
         )
@@ -353,10 +491,11 @@ class CsvXmlGen:
             )
             raise
 
-    def detailedcsvgen(self, dev_w_mvs3=True):
+    def ingest(self, dev_w_mvs3=True):
         """
-        This method generates detailed CSV files for activity and emissions data,
-        applying various processing steps and adding labels.
+        This method reads, filters, and reshapes the activity and emissions data from
+        the main modules, without adding labels. The measures are converted to
+        float64 and stored with the `measure_dtype`.
 
         Parameters
         ----------
@@ -367,7 +506,7 @@ class CsvXmlGen:
         Returns
         -------
         dict
-            A dictionary containing detailed CSV data for activities and emissions.
+            A dictionary containing the unlabelled activity and emissions data.
         """
         self.logger.info(msg="ETL activity data from the main modules...")
         act_df = self._actprc(dev_w_mvs3=dev_w_mvs3)
@@ -378,7 +517,6 @@ class CsvXmlGen:
                 year=self.years_selected * len(act_df),
                 area=[self.area_selected] * len(act_df),
             )
-        act_out = self.act_add_labs(act_df)
         self.logger.info(msg="Processed activity data.")
         self.logger.info(msg="ETL emission data from the main modules...")
         emis_df = self._emisprc(dev_w_mvs3=dev_w_mvs3)
@@ -389,11 +527,49 @@ class CsvXmlGen:
                 year=self.years_selected * len(emis_df),
                 area=[self.area_selected] * len(emis_df),
             )
-        self.qc_areardtype(emis_df, act_df)
-        emis_out = self.emis_add_labs(emis_df)
         self.logger.info(msg="Processed emission data.")
+        return store_measures({"act": act_df, "emis": emis_df}, self.measure_dtype)
+
+    def add_labs(self, act_emis_dict):
+        """
+        This method checks the area and road type mapping and adds labels to the
+        ingested activity and emissions data.
+
+        Parameters
+        ----------
+        act_emis_dict : dict
+            A dictionary containing the unlabelled activity and emissions data from
+            `ingest`.
+
+        Returns
+        -------
+        dict
+            A dictionary containing detailed CSV data for activities and emissions.
+        """
+        self.qc_areardtype(act_emis_dict["emis"], act_emis_dict["act"])
+        act_out = self.act_add_labs(act_emis_dict["act"])
+        emis_out = self.emis_add_labs(act_emis_dict["emis"])
+        self.logger.info(msg="Added labels to activity and emission data.")
         return {"act": act_out, "emis": emis_out}
 
+    def detailedcsvgen(self, dev_w_mvs3=True):
+        """
+        This method generates detailed CSV files for activity and emissions data,
+        applying various processing steps and adding labels.
+
+        Parameters
+        ----------
+        dev_w_mvs3 : bool, optional
+            A flag indicating whether the data is from MOVES3 or MOVES4 utilities
+            (default is True).
+
+        Returns
+        -------
+        dict
+            A dictionary containing detailed CSV data for activities and emissions.
+        """
+        return self.add_labs(self.ingest(dev_w_mvs3=dev_w_mvs3))
+
     def aggxlsxgen(self, act_emis_dict):
         """
         Generate aggregated Excel file for activity and emissions data. This method
@@ -410,6 +586,65 @@ class CsvXmlGen:
             A dictionary containing aggregated Excel data for activities and emissions.
         """
         self.logger.info(msg="Aggregating detailed activity and emission data...")
+        aggdfs = self.aggxlsxfinal(self.aggxlsxpartial(act_emis_dict))
+        self.logger.info(msg="Aggregated detailed activity and emission data.")
+        return aggdfs
+
+    def aggxlsxpartial(self, act_emis_dict):
+        """
+        Sum detailed activity and emissions data by the indices of each aggregation
+        type, without sorting or dropping the index columns. Partial aggregates of
+        disjoint subsets of the detailed data (e.g., county shards) can be merged by
+        summing them again by the same indices. The sums are float64 (see `sum_by`).
+
+        Parameters
+        ----------
+        act_emis_dict : dict
+            A dictionary containing detailed activity and emissions data.
+
+        Returns
+        -------
+        dict
+            A dictionary containing the summed activity and emissions data by
+            aggregation type.
+        """
+        act_idx = self.settings["csvxml_act"]["idx"]
+        emis_idx = self.settings["csvxml_ei"]["idx"]
+        aggdfs = {}
+        for aggtype, val in self.settings["xlsxxml_aggpiv_opts"].items():
+            remove = val["remove"]
+            add = val["add"]
+            act_idx1 = set(act_idx) - set(remove) | set(add)
+            emis_idx1 = set(emis_idx) - set(remove) | set(add)
+            agg_act = sum_by(
+                act_emis_dict["act"].loc[lambda df: df.actTypeABB != "Speed"],
+                list(act_idx1),
+                "activity",
+            )
+            agg_emis = sum_by(act_emis_dict["emis"], list(emis_idx1), "emission")
+            aggdfs[aggtype] = {
+                "act": agg_act,
+                "emis": agg_emis,
+            }
+        return aggdfs
+
+    @staticmethod
+    def aggxlsxfinal(aggdfs):
+        """
+        Sort the summed activity and emissions data and keep the columns shown in
+        the aggregate tables.
+
+        Parameters
+        ----------
+        aggdfs : dict
+            A dictionary containing the summed activity and emissions data by
+            aggregation type, from `aggxlsxpartial`.
+
+        Returns
+        -------
+        dict
+            A dictionary containing aggregated Excel data for activities and emissions.
+        """
         emis_scenario_cols = [
             "EIType",
             "area",
@@ -454,55 +689,64 @@ class CsvXmlGen:
             "mvsRoadLab",
             "emission",
         ]
-        act_idx = self.settings["csvxml_act"]["idx"]
-        emis_idx = self.settings["csvxml_ei"]["idx"]
-        aggdfs = {}
-        for aggtype, val in self.settings["xlsxxml_aggpiv_opts"].items():
-            remove = val["remove"]
-            add = val["add"]
-            act_idx1 = set(act_idx) - set(remove) | set(add)
-            emis_idx1 = set(emis_idx) - set(remove) | set(add)
-            agg_act = (
-                act_emis_dict["act"]
-                .loc[lambda df: df.actTypeABB != "Speed"]
-                .groupby(list(act_idx1), as_index=False)
-                .activity.sum()
-            )
+        aggdfs_final = {}
+        for aggtype, val in aggdfs.items():
+            agg_act, agg_emis = val["act"], val["emis"]
             act_sort_cols = [i for i in order_act if i in agg_act.columns]
             agg_act = (
                 agg_act.sort_values(act_sort_cols)
                 .reset_index(drop=True)
                 .filter(items=keep_act)
             )
-            agg_emis = (
-                act_emis_dict["emis"]
-                .groupby(list(emis_idx1), as_index=False)
-                .emission.sum()
-            )
             emis_sort_cols = [i for i in order_emis if i in agg_emis.columns]
             agg_emis = (
                 agg_emis.sort_values(emis_sort_cols)
                 .reset_index(drop=True)
                 .filter(items=keep_emis)
             )
-            aggdfs[aggtype] = {
+            aggdfs_final[aggtype] = {
                 "act": agg_act,
                 "emis": agg_emis,
             }
-        self.logger.info(msg="Aggregated detailed activity and emission data.")
-        return aggdfs
+        return aggdfs_final
+
+    @staticmethod
+    def _scenario_mask(df, scenario):
+        """
+        Boolean mask of the rows matching the selected scenario.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Detailed activity or emissions data.
+        scenario : dict
+            Mapping of scenario columns (year, season, dayType) to the selected
+            value. None selects all values of the column.
+
+        Returns
+        -------
+        pd.Series
+            Boolean mask aligned with `df`.
+        """
+        mask = pd.Series(True, index=df.index)
+        for col, val in scenario.items():
+            if val is not None:
+                mask &= df[col] == val
+        return mask
 
     def aggsccgen(
         self,
         act_emis_dict,
         xml_pols_selected,
-        xml_year_selected,
-        xml_season_selected,
-        xml_daytype_selected,
+        xml_year_selected=None,
+        xml_season_selected=None,
+        xml_daytype_selected=None,
     ):
         """
         This method aggregates detailed activity and emissions data to NEI SCCs for
-        specific parameters.
+        specific parameters. The aggregation is always grouped by year, season, and
+        day type, so leaving the scenario parameters as None aggregates every
+        scenario in one pass. The sums are float64 (see `sum_by`).
 
         Parameters
         ----------
@@ -510,12 +754,12 @@ class CsvXmlGen:
             A dictionary containing detailed activity and emissions data.
         xml_pols_selected : list
             A list of pollutant codes for NEI.
-        xml_year_selected : int
-            The selected year for NEI data.
-        xml_season_selected : int
-            The selected season for NEI data.
-        xml_daytype_selected : int
-            The selected day type for NEI data.
+        xml_year_selected : int, optional
+            The selected year for NEI data. Default is None (all years).
+        xml_season_selected : int, optional
+            The selected season for NEI data. Default is None (all seasons).
+        xml_daytype_selected : int, optional
+            The selected day type for NEI data. Default is None (all day types).
 
         Returns
         -------
@@ -525,19 +769,23 @@ class CsvXmlGen:
         self.logger.info(
             msg="Aggregating detailed activity and emission data to NEI SCCs."
         )
+        scenario = {
+            "year": xml_year_selected,
+            "season": xml_season_selected,
+            "dayType": xml_daytype_selected,
+        }
         scc_emis_df = (
             act_emis_dict["emis"]
             .loc[
                 lambda df: (df.pollutantCode.isin(xml_pols_selected))
-                & (df.year == xml_year_selected)
-                & (df.season == xml_season_selected)
-                & (df.dayType == xml_daytype_selected)
+                & self._scenario_mask(df, scenario)
             ]
             .assign(
                 sccNEI=lambda df: self.sccfun(df),
             )
         )
-        agg_emis_scc = scc_emis_df.groupby(
+        agg_emis_scc = sum_by(
+            scc_emis_df,
             [
                 "area",
                 "year",
@@ -548,18 +796,16 @@ class CsvXmlGen:
                 "pollutantCode",
                 "emissionunits",
             ],
-            as_index=False,
-        ).emission.sum()
+            "emission",
+        )
         scc_act_df = (
             act_emis_dict["act"]
             .loc[
-                lambda df: (df.actTypeABB == "VMT")
-                & (df.year == xml_year_selected)
-                & (df.season == xml_season_selected)
-                & (df.dayType == xml_daytype_selected)
+                lambda df: (df.actTypeABB == "VMT") & self._scenario_mask(df, scenario)
             ]
             .assign(
-                sccNEI=lambda df: self.sccfun(df), E6MILE=lambda df: df.activity / 1e6
+                sccNEI=lambda df: self.sccfun(df),
+                E6MILE=lambda df: df.activity.astype("float64", copy=False) / 1e6,
             )
         )
         agg_act_scc = scc_act_df.groupby(
@@ -575,3 +821,36 @@ class CsvXmlGen:
             msg="Aggregated detailed activity and emission data to NEI SCC."
         )
         return df_nei_scc
+
+
+def make_csvxmlgen(gui_obj):
+    """
+    Create the CsvXmlGen of the execution backend selected by the `csvxml_backend`
+    parameter of the post-processing.
+
+    Parameters
+    ----------
+    gui_obj : object
+        An instance of the PostProcessorGUI class.
+
+    Returns
+    -------
+    CsvXmlGen
+        A CsvXmlGen ("pandas" backend) or DuckDBCsvXmlGen ("duckdb" backend).
+
+    Raises
+    ------
+    ValueError
+        If the backend is unknown.
+    """
+    backend = getattr(gui_obj, "csvxml_backend", "pandas")
+    if backend not in CSVXML_BACKENDS:
+        raise ValueError(
+            f"Unknown CsvXmlGen backend {backend}. Use one of {CSVXML_BACKENDS}."
+        )
+    if backend == "duckdb":
+        # Imported here: duckdb is an optional dependency.
+        from ttionroadei.csvxmlpostprc.duckdbgen import DuckDBCsvXmlGen
+
+        return DuckDBCsvXmlGen(gui_obj)
+    return CsvXmlGen(gui_obj)
@@ -0,0 +1,560 @@
+"""
+DuckDB execution backend of the CsvXmlGen transformations.
+
+The ingest (filter, rename, unpivot, pollutant selection, and unit conversion),
+labelling, aggregation, and NEI SCC steps run as SQL queries in an embedded DuckDB
+database: the main module outputs are scanned directly by the DuckDB CSV reader and
+each step runs as one multithreaded query, which spills to disk beyond the memory
+limit, instead of materializing a pandas DataFrame after every filter, melt, and
+merge. The steps take and return the same DataFrames as the pandas backend, so the
+stage cache, the sharding, and the writers are shared by both backends.
+
+The results match the pandas backend, except that the ingested data are in no
+particular order and the detailed data are sorted by their index columns. Requires
+duckdb (optional dependency).
+"""
+from contextlib import contextmanager
+from pathlib import Path
+import pandas as pd
+
+from ttionroadei.csvxmlpostprc.csvxmlgen import (
+    CsvXmlGen,
+    EMIS_OFFNET_CATS,
+    EMIS_HOTELLING_CATS,
+    ACT_OFFNET_CATS,
+    ACT_HOTELLING_CATS,
+)
+from ttionroadei.csvxmlpostprc.preflight import read_header
+
+# SQL of `CsvXmlGen.sccfun` and `CsvXmlGen.sutFtfun`.
+_FT_SQL = "CAST(fuelTypeID AS VARCHAR)"
+SCC_SQL = (
+    f"'22' || lpad({_FT_SQL}, CAST(greatest(length({_FT_SQL}), 2) AS INTEGER), '0') "
+    "|| CAST(sourceUseTypeID AS VARCHAR) || '0080'"
+)
+SUTFT_SQL = "sutLab || '_' || ftLab"
+# Group columns of the XML staging table.
+SCC_GROUP_COLS = ["area", "year", "season", "dayType", "FIPS", "sccNEI"]
+
+
+def _ident(name):
+    # Quoted SQL identifier.
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _literal(val):
+    # SQL literal of a string or an integer.
+    if isinstance(val, str):
+        return "'" + val.replace("'", "''") + "'"
+    return f"CAST({int(val)} AS BIGINT)"
+
+
+def _sum_sql(df, col):
+    # Sum of a value column with the dtype of the pandas sum. fsum is a compensated
+    # sum, like the pandas sum of floats.
+    if pd.api.types.is_float_dtype(df[col]):
+        return f"COALESCE(fsum({_ident(col)}), 0)"
+    return f"CAST(COALESCE(sum({_ident(col)}), 0) AS BIGINT)"
+
+
+class DuckDBCsvXmlGen(CsvXmlGen):
+    """
+    CsvXmlGen running the ingest, labelling, aggregation, and NEI SCC steps as
+    DuckDB queries. The `use_fips_index` and `ingest_engine` parameters do not apply:
+    DuckDB scans the main module outputs itself.
+
+    Attributes
+    ----------
+    con : duckdb.DuckDBPyConnection
+        The connection to the in-memory DuckDB database.
+    memory_limit : str or None
+        The DuckDB memory limit: the `memory_budget` shared by the
+        `shard_n_workers`, or None (DuckDB default).
+
+    Methods
+    -------
+    query(sql, params=None, **frames)
+        Run a query over DataFrames and return the result as a DataFrame.
+    """
+
+    def __init__(self, gui_obj):
+        super().__init__(gui_obj)
+        try:
+            import duckdb
+        except ImportError as err:
+            raise ImportError(
+                "The duckdb backend requires duckdb. Install duckdb (see "
+                "requirements-optional.txt) or use the pandas backend."
+            ) from err
+        config = {}
+        memory_budget = getattr(gui_obj, "memory_budget", None)
+        self.memory_limit = None
+        if memory_budget is not None:
+            n_workers = max(getattr(gui_obj, "shard_n_workers", 1), 1)
+            self.memory_limit = f"{int(memory_budget * 1024 / n_workers)}MiB"
+            config["memory_limit"] = self.memory_limit
+        out_dir = getattr(gui_obj, "out_dir_pp", None)
+        if out_dir is not None:
+            config["temp_directory"] = str(Path(out_dir).joinpath(".duckdbtmp"))
+        self.con = duckdb.connect(database=":memory:", config=config)
+
+    @contextmanager
+    def _registered(self, frames):
+        # Register the DataFrames as views for the duration of a query.
+        for name, df in frames.items():
+            self.con.register(name, df)
+        try:
+            yield
+        finally:
+            for name in frames:
+                self.con.unregister(name)
+
+    def query(self, sql, params=None, **frames):
+        """
+        Run a query over DataFrames and return the result as a DataFrame.
+
+        Parameters
+        ----------
+        sql : str
+            The SQL query.
+        params : list, optional
+            The values of the query parameters. Default is None.
+        **frames
+            The DataFrames the query reads, by view name.
+
+        Returns
+        -------
+        pd.DataFrame
+            The query result.
+        """
+        with self._registered(frames):
+            return self.con.execute(sql, params or []).df()
+
+    def _unpivot_sql(self, path, rename, id_cols, value_name, constants):
+        """
+        Build the query reading the rows of the selected counties of a main module
+        output with the renamed columns, and unpivoting its value columns to the
+        actTypeABB and value columns (like `pd.DataFrame.melt`).
+
+        Parameters
+        ----------
+        path : str or Path
+            The main module output file path.
+        rename : dict
+            Mapping of the raw column names to the post-processing names.
+        id_cols : list
+            The (renamed) id columns.
+        value_name : str
+            The name of the value column.
+        constants : dict
+            The columns set to a constant value, overriding the file columns.
+
+        Returns
+        -------
+        str or None
+            The query, or None if the file has no value column.
+
+        Raises
+        ------
+        KeyError
+            If the file lacks id columns.
+        """
+        raw_cols = {}
+        for col in read_header(path):
+            if col in rename:
+                raw_cols.setdefault(rename[col], col)
+        exprs = {col: _ident(raw) for col, raw in raw_cols.items()}
+        exprs.update({col: _literal(val) for col, val in constants.items()})
+        missing = [col for col in id_cols if col not in exprs]
+        if missing:
+            raise KeyError(f"{path} lacks the columns {missing}.")
+        value_cols = [col for col in exprs if col not in id_cols]
+        if not value_cols:
+            return None
+        fips = ", ".join(str(int(fips)) for fips in self.FIPSs_selected)
+        select = ", ".join(f"{expr} AS {_ident(col)}" for col, expr in exprs.items())
+        return (
+            f"SELECT * FROM (SELECT {select} FROM read_csv({_literal(str(path))}, "
+            f"delim={_literal(chr(9))}, header=true) "
+            f"WHERE {_ident(raw_cols['FIPS'])} IN ({fips})) "
+            f"UNPIVOT INCLUDE NULLS ({_ident(value_name)} FOR actTypeABB IN "
+            f"({', '.join(_ident(col) for col in value_cols)}))"
+        )
+
+    def _emisprc(self, dev_w_mvs3):
+        """
+        This method reads the emissions data of the selected counties of every EI
+        category, unpivots them, keeps the selected pollutants, and converts their
+        units in one DuckDB query.
+
+        Parameters
+        ----------
+        dev_w_mvs3 : bool
+            A flag indicating whether the data is from MOVES3 or MOVES4 utilities.
+
+        Returns
+        -------
+        pd.DataFrame
+            Processed emissions data containing pollutant emissions by category and
+            attributes.
+        """
+        emis_id_cols = self._melt_id_cols(
+            "csvxml_ei", ["pollutantCode", "actTypeABB"], dev_w_mvs3
+        )
+        file_sqls = []
+        for ei in self.EIs_selected:
+            for cat, path in self.ei_fis[ei].items():
+                constants = {"EIType": ei}
+                if cat in EMIS_OFFNET_CATS:
+                    constants.update(funcClassID=-99, areaTypeID=-99)
+                if cat in EMIS_HOTELLING_CATS:
+                    constants.update(sourceUseTypeID=62, fuelTypeID=2)
+                # The generic emission column is named after the category.
+                rename = {
+                    raw: cat if col == "emission" else col
+                    for raw, col in self.settings["emis_rename"].items()
+                }
+                file_sql = self._unpivot_sql(
+                    path, rename, emis_id_cols, "emission", constants
+                )
+                if file_sql is not None:
+                    file_sqls.append(file_sql)
+        raw_cols = [
+            _ident(col)
+            for col in emis_id_cols
+            if col not in ("pollutantID", "emissionunits")
+        ]
+        df = self.query(
+            f"""
+            WITH raw AS ({" UNION ALL BY NAME ".join(file_sqls)})
+            SELECT p.pollutantCode, p.pollutantID, {", ".join(f"r.{col}" for col in raw_cols)},
+                r.actTypeABB, r.emission * c.confactor AS emission,
+                c.output_units AS emissionunits, r.emissionunits AS input_units
+            FROM outpollutants AS p
+            LEFT JOIN raw AS r ON r.pollutantID = p.pollutantID
+            LEFT JOIN conversion_factor AS c ON r.emissionunits = c.input_units
+            """,
+            outpollutants=self.outpollutants,
+            conversion_factor=self.conversion_factor,
+        )
+        self.qc_input_units_and_conversion(
+            df[["input_units"]].rename(columns={"input_units": "emissionunits"})
+        )
+        del df["input_units"]
+        return df
+
+    def _actprc(self, dev_w_mvs3):
+        """
+        This method reads the activity data of the selected counties of every
+        category and unpivots them in one DuckDB query.
+
+        Parameters
+        ----------
+        dev_w_mvs3 : bool
+            A flag indicating whether the data is from MOVES3 or MOVES4 utilities.
+
+        Returns
+        -------
+        pd.DataFrame
+            Processed off-road activity data containing activity values by category
+            and attributes.
+        """
+        act_id_cols = self._melt_id_cols(
+            "csvxml_act", ["actTypeABB", "activityunits"], dev_w_mvs3
+        )
+        file_sqls = []
+        for cat, path in self.act_fis.items():
+            if cat == "TotSHP":
+                # Note: removing total SHP. It is a combination of AdjSHP and ONI.
+                continue
+            constants = {}
+            if cat in ACT_OFFNET_CATS:
+                constants.update(funcClassID=-99, areaTypeID=-99)
+            if cat in ACT_HOTELLING_CATS:
+                constants.update(sourceUseTypeID=62, fuelTypeID=2)
+            file_sql = self._unpivot_sql(
+                path, self.settings["act_rename"], act_id_cols, "activity", constants
+            )
+            if file_sql is not None:
+                file_sqls.append(file_sql)
+        activityunits = pd.DataFrame(
+            list(self.settings["activityunits"].items()),
+            columns=["actTypeABB", "activityunits"],
+        )
+        return self.query(
+            f"""
+            SELECT r.*, u.activityunits
+            FROM ({" UNION ALL BY NAME ".join(file_sqls)}) AS r
+            LEFT JOIN activityunits AS u ON r.actTypeABB = u.actTypeABB
+            """,
+            activityunits=activityunits,
+        )
+
+    def _add_labs_sql(self, df_, joins, columns_key):
+        """
+        Join the label tables to the data and keep the detailed data columns,
+        sorted by their index columns.
+
+        Parameters
+        ----------
+        df_ : pd.DataFrame
+            The data to which labels are added.
+        joins : list
+            The (label DataFrame, join columns, join type) of each label table, in
+            join order. A column is taken from the data or the first table having
+            it.
+        columns_key : str
+            The settings key of the detailed data columns ("csvxml_act" or
+            "csvxml_ei").
+
+        Returns
+        -------
+        pd.DataFrame
+            The data with added labels.
+        """
+        sources = {col: "d" for col in df_.columns}
+        frames = {"d": df_}
+        join_sqls = []
+        for i, (lab_df, on, how) in enumerate(joins):
+            alias = f"l{i}"
+            frames[alias] = lab_df
+            cond = " AND ".join(
+                f"{sources[col]}.{_ident(col)} = {alias}.{_ident(col)}" for col in on
+            )
+            join_sqls.append(f"{how} JOIN {alias} ON {cond}")
+            for col in lab_df.columns:
+                sources.setdefault(col, alias)
+        computed = {"sccNEI": SCC_SQL, "sutFtLabel": SUTFT_SQL}
+        columns = [
+            col
+            for sublist in self.settings[columns_key].values()
+            for col in sublist
+            if col in sources or col in computed
+        ]
+        select = [
+            f"{computed[col]} AS {_ident(col)}" if col in computed else _ident(col)
+            for col in columns
+        ]
+        order = [
+            _ident(col) for col in self.settings[columns_key]["idx"] if col in columns
+        ]
+        labelled = ", ".join(f"{src}.{_ident(col)}" for col, src in sources.items())
+        return self.query(
+            f"""
+            SELECT {", ".join(select)}
+            FROM (SELECT {labelled} FROM d {" ".join(join_sqls)})
+            ORDER BY {", ".join(order)}
+            """,
+            **frames,
+        )
+
+    def act_add_labs(self, df_):
+        """
+        This method adds labels to the activity data with a DuckDB query.
+
+        Parameters
+        ----------
+        df_ : pd.DataFrame
+            The activity data to which labels are added.
+
+        Returns
+        -------
+        pd.DataFrame
+            Activity data with added labels and merged data, sorted by the index
+            columns.
+        """
+        joins = [
+            (self.area_rdtype_df, ["area", "funcClassID", "areaTypeID"], "LEFT"),
+            (self.labels["moves_roadtypes"], ["mvsRoadTypeID"], "INNER"),
+            (self.labels["moves_sut"], ["sourceUseTypeID"], "INNER"),
+            (self.labels["moves_ft"], ["fuelTypeID"], "INNER"),
+            (self.labels["act_lab"], ["actTypeABB"], "INNER"),
+            (self.labels["county"], ["FIPS"], "INNER"),
+        ]
+        return self._add_labs_sql(df_, joins, "csvxml_act")
+
+    def emis_add_labs(self, df_):
+        """
+        This method adds labels to the emissions data with a DuckDB query.
+
+        Parameters
+        ----------
+        df_ : pd.DataFrame
+            The emissions data to which labels are added.
+
+        Returns
+        -------
+        pd.DataFrame
+            Emissions data with added labels and merged data, sorted by the index
+            columns.
+        """
+        joins = [
+            (
+                self.labels["emisprc"].drop(columns="processName"),
+                ["processID"],
+                "LEFT",
+            ),
+            (self.area_rdtype_df, ["area", "funcClassID", "areaTypeID"], "LEFT"),
+            (self.labels["moves_roadtypes"], ["mvsRoadTypeID"], "INNER"),
+            (self.labels["moves_sut"], ["sourceUseTypeID"], "INNER"),
+            (self.labels["moves_ft"], ["fuelTypeID"], "INNER"),
+            (self.labels["county"], ["FIPS"], "INNER"),
+            (self.labels["pollutants"], ["pollutantID"], "INNER"),
+        ]
+        return self._add_labs_sql(df_, joins, "csvxml_ei")
+
+    def _group_sum(self, table, keys, value_sql, value, where=None):
+        # Sum a value column of a table by keys, dropping rows with missing keys and
+        # sorting by the keys like `pd.DataFrame.groupby`.
+        conds = [f"{_ident(key)} IS NOT NULL" for key in keys]
+        if where is not None:
+            conds.append(where)
+        keys_sql = ", ".join(_ident(key) for key in keys)
+        return self.query(
+            f"""
+            SELECT {keys_sql}, {value_sql} AS {_ident(value)}
+            FROM {table} WHERE {" AND ".join(conds)}
+            GROUP BY {keys_sql} ORDER BY {keys_sql}
+            """
+        )
+
+    def aggxlsxpartial(self, act_emis_dict):
+        """
+        Sum detailed activity and emissions data by the indices of each aggregation
+        type with DuckDB queries (see `CsvXmlGen.aggxlsxpartial`). The columns used
+        by the aggregations are copied to DuckDB tables once for all the
+        aggregation types.
+
+        Parameters
+        ----------
+        act_emis_dict : dict
+            A dictionary containing detailed activity and emissions data.
+
+        Returns
+        -------
+        dict
+            A dictionary containing the summed activity and emissions data by
+            aggregation type.
+        """
+        idx = {
+            "act": (self.settings["csvxml_act"]["idx"], "activity"),
+            "emis": (self.settings["csvxml_ei"]["idx"], "emission"),
+        }
+        group_keys = {}
+        for aggtype, val in self.settings["xlsxxml_aggpiv_opts"].items():
+            for key, (key_idx, _) in idx.items():
+                keys = set(key_idx) - set(val["remove"]) | set(val["add"])
+                group_keys[aggtype, key] = list(keys)
+        value_sqls = {}
+        for key, (_, value) in idx.items():
+            df = act_emis_dict[key]
+            used = {value, "actTypeABB"}
+            for (_, frame_key), keys in group_keys.items():
+                if frame_key == key:
+                    used.update(keys)
+            value_sqls[key] = _sum_sql(df, value)
+            with self._registered({"d": df}):
+                self.con.execute(
+                    f"CREATE OR REPLACE TEMP TABLE agg_{key} AS SELECT "
+                    f"{', '.join(_ident(col) for col in df.columns if col in used)} "
+                    "FROM d"
+                )
+        aggdfs = {}
+        try:
+            for aggtype in self.settings["xlsxxml_aggpiv_opts"]:
+                aggdfs[aggtype] = {
+                    "act": self._group_sum(
+                        "agg_act",
+                        group_keys[aggtype, "act"],
+                        value_sqls["act"],
+                        "activity",
+                        where="actTypeABB IS DISTINCT FROM 'Speed'",
+                    ),
+                    "emis": self._group_sum(
+                        "agg_emis",
+                        group_keys[aggtype, "emis"],
+                        value_sqls["emis"],
+                        "emission",
+                    ),
+                }
+        finally:
+            for key in idx:
+                self.con.execute(f"DROP TABLE IF EXISTS agg_{key}")
+        return aggdfs
+
+    def aggsccgen(
+        self,
+        act_emis_dict,
+        xml_pols_selected,
+        xml_year_selected=None,
+        xml_season_selected=None,
+        xml_daytype_selected=None,
+    ):
+        """
+        This method aggregates detailed activity and emissions data to NEI SCCs with
+        one DuckDB query (see `CsvXmlGen.aggsccgen`).
+
+        Parameters
+        ----------
+        act_emis_dict : dict
+            A dictionary containing detailed activity and emissions data.
+        xml_pols_selected : list
+            A list of pollutant codes for NEI.
+        xml_year_selected : int, optional
+            The selected year for NEI data. Default is None (all years).
+        xml_season_selected : int, optional
+            The selected season for NEI data. Default is None (all seasons).
+        xml_daytype_selected : int, optional
+            The selected day type for NEI data. Default is None (all day types).
+
+        Returns
+        -------
+        pd.DataFrame
+            Aggregated data for NEI SCCs (Source Classification Codes).
+        """
+        self.logger.info(
+            msg="Aggregating detailed activity and emission data to NEI SCCs."
+        )
+        scenario = {
+            "year": xml_year_selected,
+            "season": xml_season_selected,
+            "dayType": xml_daytype_selected,
+        }
+        scenario_conds = [
+            f"{_ident(col)} = ?" for col, val in scenario.items() if val is not None
+        ]
+        scenario_vals = [val for val in scenario.values() if val is not None]
+        emis_cols = [
+            f"{SCC_SQL} AS sccNEI" if col == "sccNEI" else _ident(col)
+            for col in SCC_GROUP_COLS + ["pollutantCode", "emissionunits"]
+        ]
+        emis_keys = ", ".join(
+            _ident(col) for col in SCC_GROUP_COLS + ["pollutantCode", "emissionunits"]
+        )
+        act_keys = ", ".join(_ident(col) for col in SCC_GROUP_COLS)
+        # The SCCs are recomputed from the source use and fuel types, like with the
+        # pandas backend.
+        emis_conds = " AND ".join(["list_contains(?, pollutantCode)"] + scenario_conds)
+        act_conds = " AND ".join(["actTypeABB = 'VMT'"] + scenario_conds)
+        df_nei_scc = self.query(
+            f"""
+            WITH e AS (
+                SELECT {", ".join(emis_cols)}, COALESCE(fsum(emission), 0) AS emission
+                FROM emis WHERE {emis_conds} GROUP BY ALL
+            ), a AS (
+                SELECT {", ".join(emis_cols[:len(SCC_GROUP_COLS)])},
+                    COALESCE(fsum(activity / 1e6), 0) AS E6MILE
+                FROM act WHERE {act_conds} GROUP BY ALL
+            )
+            SELECT e.*, COALESCE(a.E6MILE, 0) AS E6MILE
+            FROM e LEFT JOIN a USING ({act_keys})
+            ORDER BY {emis_keys}
+            """,
+            [list(xml_pols_selected)] + scenario_vals + scenario_vals,
+            emis=act_emis_dict["emis"],
+            act=act_emis_dict["act"],
+        )
+        self.logger.info(
+            msg="Aggregated detailed activity and emission data to NEI SCC."
+        )
+        return df_nei_scc
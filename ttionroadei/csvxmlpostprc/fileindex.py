@@ -0,0 +1,325 @@
+"""
+Sidecar byte-offset index of the main module outputs by county.
+
+The utility outputs are written grouped by county (and by hour within a county).
+The index records the byte range of every contiguous block of rows of the same
+county and hour, so the rows of the selected counties are read directly from a
+memory map of the file instead of parsing the whole (e.g., statewide) file. The
+index is stored in an index directory (the post-processing uses one under its
+output directory) as `<file name>.<path hash>.fipsidx.json`, or next to the file as
+`<file name>.fipsidx.json` without an index directory, and is rebuilt when the size
+or modification time of the file changes.
+
+Example usage (prebuilding the indexes of a post-processing output directory):
+```
+python -m ttionroadei.csvxmlpostprc.fileindex Emission_output/*.txt --index-dir Summary/.ppfipsidx
+```
+"""
+import argparse
+import hashlib
+import json
+import logging as lg
+import mmap
+import os
+from pathlib import Path
+
+from ttionroadei.csvxmlpostprc.readers import read_delimited
+
+INDEX_SUFFIX = ".fipsidx.json"
+INDEX_VERSION = 1
+# Raw column names of the county and hour in the utility outputs.
+FIPS_COL = "County"
+HOUR_COLS = ("Hour", "hour")
+# Files with more blocks are not grouped by county: the index is not worth it.
+MAX_BLOCKS = 500_000
+
+
+def index_path(path, index_dir=None):
+    """
+    Get the index path of a file.
+
+    Parameters
+    ----------
+    path : str or Path
+        The main module output file path.
+    index_dir : str or Path, optional
+        The directory of the indexes. Default is None (next to the file).
+
+    Returns
+    -------
+    pathlib.Path
+        The index file path.
+    """
+    path = Path(path)
+    if index_dir is None:
+        return path.with_name(path.name + INDEX_SUFFIX)
+    # Files of the same name in different directories get their own index.
+    path_hash = hashlib.blake2b(str(path.resolve()).encode(), digest_size=8).hexdigest()
+    return Path(index_dir).joinpath(f"{path.name}.{path_hash}{INDEX_SUFFIX}")
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _scan_blocks(f, offset, cols, sep):
+    # Contiguous blocks of lines of the same county and hour, or None when there are
+    # more than MAX_BLOCKS blocks.
+    sep = sep.encode()
+    fips_pos = cols.index(FIPS_COL)
+    hour_pos = next((cols.index(col) for col in HOUR_COLS if col in cols), None)
+    max_pos = max(fips_pos, hour_pos if hour_pos is not None else -1)
+    blocks = []
+    key, start = None, offset
+    for line in f:
+        if line.strip():
+            fields = line.split(sep, max_pos + 1)
+            line_key = (
+                int(fields[fips_pos]),
+                int(fields[hour_pos]) if hour_pos is not None else None,
+            )
+            if line_key != key:
+                if key is not None:
+                    blocks.append([*key, start, offset])
+                    if len(blocks) > MAX_BLOCKS:
+                        return None
+                key, start = line_key, offset
+        offset += len(line)
+    if key is not None:
+        blocks.append([*key, start, offset])
+    return blocks
+
+
+def build_index(path, sep="\t", save=True, index_dir=None, logger=None):
+    """
+    Build the byte-offset index of a file by county and hour.
+
+    Parameters
+    ----------
+    path : str or Path
+        The main module output file path.
+    sep : str, optional
+        The column delimiter. Default is tab.
+    save : bool, optional
+        Save the index. Default is True. An index that cannot be saved (e.g.,
+        read-only directory) is still returned, with a warning.
+    index_dir : str or Path, optional
+        The directory of the indexes. Default is None (next to the file).
+    logger : logging.Logger, optional
+        The logger of the save failures. Default is None (module logger).
+
+    Returns
+    -------
+    dict
+        The index: file size and modification time ("size", "mtime_ns"), the byte
+        length of the header ("header_end"), whether the rows are grouped by
+        county ("grouped"), and the contiguous blocks as [FIPS, hour or None, start
+        byte, end byte] ("blocks").
+    """
+    stamp = _file_stamp(path)
+    with open(path, "rb") as f:
+        header = f.readline()
+        cols = header.rstrip(b"\r\n").decode().split(sep)
+        # Files without a county column are always read in full.
+        blocks = _scan_blocks(f, len(header), cols, sep) if FIPS_COL in cols else None
+    grouped = blocks is not None
+    index = {
+        "version": INDEX_VERSION,
+        **stamp,
+        "header_end": len(header),
+        "grouped": grouped,
+        "blocks": blocks if grouped else [],
+    }
+    if save:
+        idx_fi = index_path(path, index_dir)
+        tmp_fi = idx_fi.with_name(f"{idx_fi.name}.{os.getpid()}.tmp")
+        try:
+            idx_fi.parent.mkdir(parents=True, exist_ok=True)
+            # Write and rename, so concurrent readers never see a partial index.
+            with open(tmp_fi, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_fi, idx_fi)
+        except OSError as err:
+            (logger or lg.getLogger(name=__file__)).warning(
+                f"Could not save the county index of {str(path)} to {str(idx_fi)}: "
+                f"{err}. The index is rebuilt on the next read."
+            )
+    return index
+
+
+def load_index(path, index_dir=None):
+    """
+    Load the index of a file if it is still valid.
+
+    Parameters
+    ----------
+    path : str or Path
+        The main module output file path.
+    index_dir : str or Path, optional
+        The directory of the indexes. Default is None (next to the file).
+
+    Returns
+    -------
+    dict or None
+        The index (see `build_index`), or None if there is no index or the file
+        changed since it was built.
+    """
+    idx_fi = index_path(path, index_dir)
+    if not idx_fi.exists():
+        return None
+    try:
+        with open(idx_fi, "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    stamp = _file_stamp(path)
+    if (
+        index.get("version") != INDEX_VERSION
+        or index.get("size") != stamp["size"]
+        or index.get("mtime_ns") != stamp["mtime_ns"]
+    ):
+        return None
+    return index
+
+
+def get_index(path, sep="\t", index_dir=None, logger=None):
+    """
+    Load the valid index of a file, or build it.
+
+    Parameters
+    ----------
+    path : str or Path
+        The main module output file path.
+    sep : str, optional
+        The column delimiter. Default is tab.
+    index_dir : str or Path, optional
+        The directory of the indexes. Default is None (next to the file).
+    logger : logging.Logger, optional
+        The logger of the save failures. Default is None (module logger).
+
+    Returns
+    -------
+    dict
+        The index (see `build_index`).
+    """
+    return load_index(path, index_dir) or build_index(
+        path, sep=sep, index_dir=index_dir, logger=logger
+    )
+
+
+def county_ranges(index, FIPSs):
+    """
+    Get the merged byte ranges of the rows of counties.
+
+    Parameters
+    ----------
+    index : dict
+        The index of the file (see `build_index`).
+    FIPSs : list
+        The county FIPS codes.
+
+    Returns
+    -------
+    list
+        The (start, end) byte ranges, in file order.
+    """
+    FIPSs = set(int(fips) for fips in FIPSs)
+    ranges = []
+    for fips, _, start, end in index["blocks"]:
+        if fips not in FIPSs:
+            continue
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return [tuple(byte_range) for byte_range in ranges]
+
+
+def read_counties(
+    path,
+    FIPSs,
+    sep="\t",
+    use_index=True,
+    engine="pandas",
+    columns=None,
+    index_dir=None,
+    logger=None,
+):
+    """
+    Read the rows of counties of a main module output, seeking directly to their
+    byte ranges in a memory map of the file.
+
+    The rows are in file order, so the result is the same as reading the whole
+    file and keeping the rows of the counties, up to the row index. Files that are
+    not grouped by county are read in full.
+
+    Parameters
+    ----------
+    path : str or Path
+        The main module output file path.
+    FIPSs : list
+        The county FIPS codes.
+    sep : str, optional
+        The column delimiter. Default is tab.
+    use_index : bool, optional
+        Use (and build if needed) the index. Default is True. False reads the whole
+        file.
+    engine : str, optional
+        The ingestion engine (see `readers.read_delimited`). Default is "pandas".
+    columns : iterable, optional
+        The columns to read. Default is None (all columns).
+    index_dir : str or Path, optional
+        The directory of the indexes. Default is None (next to the file).
+    logger : logging.Logger, optional
+        The logger of the index save failures. Default is None (module logger).
+
+    Returns
+    -------
+    tuple
+        The DataFrame of the rows read and the number of bytes read.
+    """
+    index = (
+        get_index(path, sep=sep, index_dir=index_dir, logger=logger)
+        if use_index
+        else None
+    )
+    if index is None or not index["grouped"] or not index["blocks"]:
+        df = read_delimited(path, engine=engine, sep=sep, columns=columns)
+        return df, os.stat(path).st_size
+    ranges = county_ranges(index, FIPSs)
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = b"".join(
+                [mm[: index["header_end"]]] + [mm[start:end] for start, end in ranges]
+            )
+    df = read_delimited(data, engine=engine, sep=sep, columns=columns)
+    return df, len(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build the county byte-offset indexes of main module outputs."
+    )
+    parser.add_argument("paths", nargs="+", help="Main module output files.")
+    parser.add_argument(
+        "--index-dir",
+        default=None,
+        help="Directory of the indexes, e.g., `.ppfipsidx` in the post-processing "
+        "output directory (default: next to each file).",
+    )
+    args = parser.parse_args(argv)
+    for path in args.paths:
+        index = build_index(path, index_dir=args.index_dir)
+        n_counties = len(set(block[0] for block in index["blocks"]))
+        status = (
+            f"{len(index['blocks'])} blocks, {n_counties} counties"
+            if index["grouped"]
+            else "not grouped by county"
+        )
+        print(f"{index_path(path, args.index_dir)}: {status}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,198 @@
+"""
+Incremental append of new scenario partitions to existing post-processing outputs.
+
+The detailed data, the aggregate tables, and the XML staging table are all keyed by
+the (year, season, dayType, FIPS) partitions: no aggregation sums across them. When
+a new season or day type is added for an area already processed, only the selected
+partitions missing from the detailed outputs are ingested (the selections are
+restricted to their years, seasons, day types, and counties) and labelled; their rows
+are appended to the detailed outputs, and their aggregate and XML staging table rows
+are merged into the existing tables. The rows of the other partitions are reused
+as-is.
+"""
+from itertools import product
+import pandas as pd
+
+from ttionroadei.csvxmlpostprc.sharding import merge_scc_tables
+
+PARTITION_COLS = ["year", "season", "dayType", "FIPS"]
+# Scenario columns of the aggregate tables, by which their rows are ordered first
+# (see `CsvXmlGen.aggxlsxfinal`).
+AGG_SCENARIO_COLS = {
+    "act": ["area", "FIPS", "year", "season", "dayType"],
+    "emis": ["EIType", "area", "FIPS", "year", "season", "dayType"],
+}
+
+
+def _partition_keys(df):
+    # Partition of each row, as strings: the CSV and Excel round trips can change the
+    # dtypes of the scenario columns.
+    return pd.MultiIndex.from_frame(df[PARTITION_COLS].astype(str))
+
+
+def selected_partitions(years, seasons, daytypes, FIPSs):
+    """
+    Get the (year, season, dayType, FIPS) partitions of the selections.
+
+    Parameters
+    ----------
+    years, seasons, daytypes, FIPSs : list
+        The selected years, seasons, day types, and county FIPS codes.
+
+    Returns
+    -------
+    set
+        The partitions, as tuples of strings.
+    """
+    return {
+        tuple(str(val) for val in partition)
+        for partition in product(years, seasons, daytypes, FIPSs)
+    }
+
+
+def partition_selections(partitions, years, seasons, daytypes, FIPSs):
+    """
+    Restrict the selections to the values of partitions, so only the data of these
+    partitions is ingested.
+
+    Parameters
+    ----------
+    partitions : set
+        The partitions, as tuples of strings.
+    years, seasons, daytypes, FIPSs : list
+        The selected years, seasons, day types, and county FIPS codes.
+
+    Returns
+    -------
+    tuple
+        The selected years, seasons, day types, and county FIPS codes in the
+        partitions, in selection order. Their product can still include other
+        partitions (e.g., a new county and a new season).
+    """
+    selections = (years, seasons, daytypes, FIPSs)
+    return tuple(
+        [val for val in selection if str(val) in {part[i] for part in partitions}]
+        for i, selection in enumerate(selections)
+    )
+
+
+def existing_partitions(paths):
+    """
+    Get the partitions of existing detailed outputs, reading only their partition
+    columns.
+
+    Parameters
+    ----------
+    paths : list
+        The detailed activity and emission data (or fact table) CSV files.
+
+    Returns
+    -------
+    set
+        The partitions, as tuples of strings.
+    """
+    partitions = set()
+    for path in paths:
+        df = pd.read_csv(path, usecols=PARTITION_COLS).drop_duplicates()
+        partitions.update(_partition_keys(df))
+    return partitions
+
+
+def partition_mask(df, partitions):
+    """
+    Boolean mask of the rows of a DataFrame in partitions.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Data with the partition columns.
+    partitions : set
+        The partitions, as tuples of strings.
+
+    Returns
+    -------
+    np.ndarray
+        Boolean mask aligned with `df`.
+    """
+    return _partition_keys(df).isin(list(partitions))
+
+
+def append_csv(df, path):
+    """
+    Append rows to a CSV file, in the column order of its header.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The rows to append, with the columns of the file.
+    path : str or Path
+        The CSV file path.
+
+    Returns
+    -------
+    None
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    df[list(header)].to_csv(path, mode="a", header=False, index=False)
+
+
+def merge_aggregate_tables(old_sheets, new_aggs, partitions):
+    """
+    Replace the rows of partitions in the aggregate tables.
+
+    The rows of each table are ordered by the scenario columns first, so a stable
+    sort by those columns puts the new rows where a run over all the partitions
+    would have put them.
+
+    Parameters
+    ----------
+    old_sheets : dict
+        The existing aggregate tables by sheet name ("<aggregation type>_act" and
+        "<aggregation type>_emis"), as read from the Excel file.
+    new_aggs : dict
+        The aggregate tables of the new partitions, from `CsvXmlGen.aggxlsxgen`.
+    partitions : set
+        The new partitions, as tuples of strings.
+
+    Returns
+    -------
+    dict
+        The merged aggregate tables, in the format of `CsvXmlGen.aggxlsxgen`.
+    """
+    merged = {}
+    for aggtype, val in new_aggs.items():
+        merged[aggtype] = {}
+        for key, new_df in val.items():
+            old_df = old_sheets.get(f"{aggtype}_{key}")
+            if old_df is None:
+                merged[aggtype][key] = new_df
+                continue
+            old_df = old_df.loc[~partition_mask(old_df, partitions)]
+            merged[aggtype][key] = (
+                pd.concat([old_df, new_df[list(old_df.columns)]])
+                .sort_values(AGG_SCENARIO_COLS[key], kind="mergesort")
+                .reset_index(drop=True)
+            )
+    return merged
+
+
+def merge_scc_rows(old_df, new_df, partitions):
+    """
+    Replace the rows of partitions in the XML staging table.
+
+    Parameters
+    ----------
+    old_df : pd.DataFrame
+        The existing XML staging table.
+    new_df : pd.DataFrame
+        The XML staging table of the new partitions.
+    partitions : set
+        The new partitions, as tuples of strings.
+
+    Returns
+    -------
+    pd.DataFrame
+        The merged XML staging table, in the group order of `CsvXmlGen.aggsccgen`.
+    """
+    old_df = old_df.loc[~partition_mask(old_df, partitions)]
+    return merge_scc_tables([old_df, new_df[list(old_df.columns)]])
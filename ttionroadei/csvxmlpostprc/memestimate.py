@@ -0,0 +1,155 @@
+"""
+Estimate the peak memory of the post-processing from the main module outputs before
+reading them.
+
+The raw files are probed at evenly spaced byte offsets instead of being read: the
+probed rows give the average row size (hence the row count from the file size), the
+share of rows kept by the county and pollutant filters, and the number of value
+columns melted into rows. The estimated number of detailed rows is then scaled by
+the measured peak memory per labelled detailed row.
+"""
+from pathlib import Path
+import numpy as np
+
+# Peak resident memory growth per labelled detailed activity or emission row while
+# ingesting and labelling (the chained merges hold the previous and the merged frame
+# at the same time). Measured on MOVES3 utility outputs of 3 to 12 counties.
+PEAK_ROW_BYTES = 850
+# Resident memory of the interpreter, the libraries, and the labels.
+BASELINE_BYTES = 256 * 2**20
+
+
+def probe_rows(path, n_probes=256, sep="\t"):
+    """
+    Read the header and rows at evenly spaced byte offsets of a delimited file.
+
+    Parameters
+    ----------
+    path : str or Path
+        The delimited text file path.
+    n_probes : int, optional
+        The number of probed rows. Default is 256.
+    sep : str, optional
+        The column delimiter. Default is tab.
+
+    Returns
+    -------
+    tuple
+        The header columns, the probed rows as lists of fields, and the estimated
+        number of rows in the file.
+    """
+    size = Path(path).stat().st_size
+    with open(path, "rb") as f:
+        header = f.readline().decode().rstrip("\r\n").split(sep)
+        data_start = f.tell()
+        data_size = size - data_start
+        lines = []
+        for i in range(n_probes):
+            offset = data_start + data_size * i // n_probes
+            f.seek(offset)
+            if offset > data_start:
+                # Skip to the start of the next full row.
+                f.readline()
+            line = f.readline()
+            if line.strip():
+                lines.append(line)
+    if not lines:
+        return header, [], 0
+    n_rows = int(round(data_size / np.mean([len(line) for line in lines])))
+    rows = [line.decode().rstrip("\r\n").split(sep) for line in lines]
+    return header, rows, n_rows
+
+
+def estimate_detailed_rows(path, rename, id_cols, FIPSs, pollutant_weights=None):
+    """
+    Estimate the number of detailed rows that a main module output file produces.
+
+    Parameters
+    ----------
+    path : str or Path
+        The main module output file path.
+    rename : dict
+        Mapping of the raw column names to the post-processing names.
+    id_cols : iterable
+        The id columns kept when melting the value columns into rows.
+    FIPSs : list
+        The selected county FIPS codes.
+    pollutant_weights : dict, optional
+        Number of output pollutant codes per MOVES pollutantID, for emission files.
+        Default is None (activity file).
+
+    Returns
+    -------
+    float
+        The estimated number of detailed rows.
+    """
+    header, rows, n_rows = probe_rows(path)
+    if not rows:
+        return 0.0
+    renamed = [rename.get(col) for col in header]
+    n_value_cols = sum(
+        1 for col in renamed if col is not None and col not in set(id_cols)
+    )
+    FIPSs = set(int(fips) for fips in FIPSs)
+    fips_pos = renamed.index("FIPS")
+    pol_pos = renamed.index("pollutantID") if pollutant_weights is not None else None
+    weights = []
+    for row in rows:
+        try:
+            weight = float(int(row[fips_pos]) in FIPSs)
+            if pol_pos is not None:
+                weight *= pollutant_weights.get(int(row[pol_pos]), 0)
+        except (IndexError, ValueError):
+            weight = 0.0
+        weights.append(weight)
+    return n_rows * np.mean(weights) * max(n_value_cols, 1)
+
+
+def estimate_peak_memory(csvxmlgen):
+    """
+    Estimate the peak memory of ingesting and labelling the selected data.
+
+    Parameters
+    ----------
+    csvxmlgen : CsvXmlGen
+        An instance of the CsvXmlGen class with the selected counties, pollutants,
+        and main module output files.
+
+    Returns
+    -------
+    dict
+        The input file size ("input_bytes"), the estimated detailed activity and
+        emission rows ("act_rows", "emis_rows"), and the estimated peak memory
+        ("peak_bytes").
+    """
+    settings = csvxmlgen.settings
+    act_id_cols = set(settings["csvxml_act"]["idx"]) - {"actTypeABB", "activityunits"}
+    emis_id_cols = set(settings["csvxml_ei"]["idx"]) - {"pollutantCode", "actTypeABB"}
+    pollutant_weights = (
+        csvxmlgen.outpollutants.pollutantID.astype(int).value_counts().to_dict()
+    )
+    input_bytes, act_rows, emis_rows = 0, 0.0, 0.0
+    for cat, path in csvxmlgen.act_fis.items():
+        if cat == "TotSHP":
+            continue
+        input_bytes += Path(path).stat().st_size
+        act_rows += estimate_detailed_rows(
+            path, settings["act_rename"], act_id_cols, csvxmlgen.FIPSs_selected
+        )
+    for ei in csvxmlgen.EIs_selected:
+        for path in csvxmlgen.ei_fis[ei].values():
+            input_bytes += Path(path).stat().st_size
+            emis_rows += estimate_detailed_rows(
+                path,
+                settings["emis_rename"],
+                emis_id_cols,
+                csvxmlgen.FIPSs_selected,
+                pollutant_weights=pollutant_weights,
+            )
+    peak_bytes = BASELINE_BYTES + (act_rows + emis_rows) * PEAK_ROW_BYTES
+    return {
+        "input_bytes": input_bytes,
+        "act_rows": int(act_rows),
+        "emis_rows": int(emis_rows),
+        "peak_bytes": int(peak_bytes),
+    }
@@ -0,0 +1,297 @@
+"""
+Pre-flight validation of the post-processing selections against the main module
+outputs.
+
+Only the file headers and the key columns (county, pollutant, unit, area and road
+type) are read, so wrong selections (counties or pollutants missing from the
+outputs, unit mismatches, or a wrong TDM/HPMS road type mapping) are reported
+before the full ingest and melt of the data. With the county index of the files
+(see `fileindex`), the counties come from the index and only the rows of the
+selected counties are read.
+"""
+import pandas as pd
+
+from ttionroadei.csvxmlpostprc.fileindex import get_index, read_counties
+
+# Renamed columns every main module output must have.
+ACT_REQUIRED = ["FIPS", "hour"]
+EMIS_REQUIRED = ["FIPS", "hour", "pollutantID", "processID", "emissionunits"]
+# Renamed id columns. The other renamed columns are value columns.
+ID_COLS = {
+    "area",
+    "year",
+    "season",
+    "dayType",
+    "EIType",
+    "FIPS",
+    "hour",
+    "areaTypeID",
+    "funcClassID",
+    "sourceUseTypeID",
+    "fuelTypeID",
+    "pollutantID",
+    "processID",
+    "emissionunits",
+}
+# Rows read at a time when scanning the key columns.
+SCAN_CHUNKSIZE = 2_000_000
+
+
+def read_header(path, sep="\t"):
+    """
+    Read the column names of a delimited file.
+
+    Parameters
+    ----------
+    path : str or Path
+        The delimited text file path.
+    sep : str, optional
+        The column delimiter. Default is tab.
+
+    Returns
+    -------
+    list
+        The column names.
+    """
+    with open(path, "r") as f:
+        return f.readline().rstrip("\r\n").split(sep)
+
+
+def scan_keys(path, rename, columns, combos=(), sep="\t"):
+    """
+    Get the unique values of key columns of a main module output by streaming only
+    these columns.
+
+    Parameters
+    ----------
+    path : str or Path
+        The main module output file path.
+    rename : dict
+        Mapping of the raw column names to the post-processing names.
+    columns : list
+        The (renamed) columns whose unique values are collected. Columns not in the
+        file are skipped.
+    combos : tuple, optional
+        Tuples of (renamed) columns whose unique combinations are collected.
+        Combinations with columns not in the file are skipped. Default is ().
+    sep : str, optional
+        The column delimiter. Default is tab.
+
+    Returns
+    -------
+    dict
+        The set of unique values by column and of unique tuples by combination.
+    """
+    raw_cols = {rename[col]: col for col in read_header(path, sep) if col in rename}
+    columns = [col for col in columns if col in raw_cols]
+    combos = [combo for combo in combos if all(col in raw_cols for col in combo)]
+    keys = {col: set() for col in columns}
+    keys.update({combo: set() for combo in combos})
+    usecols = set(columns) | {col for combo in combos for col in combo}
+    if not usecols:
+        return keys
+    reader = pd.read_csv(
+        path,
+        sep=sep,
+        usecols=[raw_cols[col] for col in usecols],
+        chunksize=SCAN_CHUNKSIZE,
+    )
+    for chunk in reader:
+        chunk = chunk.rename(columns=rename)
+        for col in columns:
+            keys[col].update(chunk[col].unique().tolist())
+        for combo in combos:
+            keys[combo].update(
+                chunk[list(combo)].drop_duplicates().itertuples(index=False, name=None)
+            )
+    return keys
+
+
+def index_keys(path, rename, FIPSs, combos=(), sep="\t", index_dir=None, logger=None):
+    """
+    Get the counties of a main module output from its county index, and the unique
+    combinations of key columns of the rows of the selected counties.
+
+    Parameters
+    ----------
+    path : str or Path
+        The main module output file path.
+    rename : dict
+        Mapping of the raw column names to the post-processing names.
+    FIPSs : iterable
+        The selected county FIPS codes.
+    combos : tuple, optional
+        Tuples of (renamed) columns whose unique combinations are collected.
+        Combinations with columns not in the file are skipped. Default is ().
+    sep : str, optional
+        The column delimiter. Default is tab.
+    index_dir : str or Path, optional
+        The directory of the indexes (see `fileindex.get_index`). Default is None.
+    logger : logging.Logger, optional
+        The logger of the index save failures. Default is None.
+
+    Returns
+    -------
+    dict or None
+        The set of counties ("FIPS") and of unique tuples by combination (see
+        `scan_keys`), or None if the file is not grouped by county.
+    """
+    index = get_index(path, sep=sep, index_dir=index_dir, logger=logger)
+    if not index["grouped"] or not index["blocks"]:
+        return None
+    raw_cols = {rename[col]: col for col in read_header(path, sep) if col in rename}
+    combos = [combo for combo in combos if all(col in raw_cols for col in combo)]
+    keys = {"FIPS": set(fips for fips, *_ in index["blocks"])}
+    keys.update({combo: set() for combo in combos})
+    usecols = {col for combo in combos for col in combo}
+    if not usecols:
+        return keys
+    df, _ = read_counties(
+        path,
+        FIPSs,
+        sep=sep,
+        columns=[raw_cols[col] for col in usecols],
+        index_dir=index_dir,
+        logger=logger,
+    )
+    df = df.rename(columns=rename)
+    for combo in combos:
+        keys[combo].update(
+            df[list(combo)].drop_duplicates().itertuples(index=False, name=None)
+        )
+    return keys
+
+
+def check_header(path, rename, required):
+    """
+    Check that a main module output has the required columns and a value column.
+
+    Parameters
+    ----------
+    path : str or Path
+        The main module output file path.
+    rename : dict
+        Mapping of the raw column names to the post-processing names.
+    required : list
+        The required (renamed) columns.
+
+    Returns
+    -------
+    list
+        The problems found.
+    """
+    renamed = [rename[col] for col in read_header(path) if col in rename]
+    problems = []
+    missing = [col for col in required if col not in renamed]
+    if missing:
+        problems.append(f"{path} lacks the columns {missing}.")
+    if not set(renamed) - ID_COLS:
+        problems.append(f"{path} has no value column.")
+    return problems
+
+
+def preflight_problems(csvxmlgen):
+    """
+    Check the selections of the post-processing against the headers and key columns
+    of the main module outputs.
+
+    Checks that the files exist and have the expected columns, that the selected
+    counties are in every file and in the county labels, that the selected
+    pollutants are in the emission outputs, that their units have a conversion
+    factor, and that the area and road type combinations are in the road type
+    mapping. With `use_fips_index`, the counties of each file come from its county
+    index and the other keys from the rows of the selected counties (see
+    `index_keys`), instead of scanning the whole files.
+
+    Parameters
+    ----------
+    csvxmlgen : CsvXmlGen
+        An instance of the CsvXmlGen class with the selections and main module
+        output files.
+
+    Returns
+    -------
+    list
+        The problems found. Empty if the selections are valid.
+    """
+    settings = csvxmlgen.settings
+    FIPSs = set(int(fips) for fips in csvxmlgen.FIPSs_selected)
+    rdtype_combo = ("areaTypeID", "funcClassID")
+    files = [
+        (path, settings["act_rename"], ACT_REQUIRED)
+        for cat, path in csvxmlgen.act_fis.items()
+        if cat != "TotSHP"
+    ]
+    emis_paths = [
+        path for ei in csvxmlgen.EIs_selected for path in csvxmlgen.ei_fis[ei].values()
+    ]
+    files += [(path, settings["emis_rename"], EMIS_REQUIRED) for path in emis_paths]
+    problems = []
+    county_lab = csvxmlgen.labels.get("county")
+    if county_lab is not None:
+        no_label = sorted(FIPSs - set(county_lab.FIPS.astype(int)))
+        if no_label:
+            problems.append(f"Counties {no_label} are not in the county labels.")
+    pollutant_units = set()
+    rdtypes = set()
+    for path, rename, required in files:
+        try:
+            header_problems = check_header(path, rename, required)
+        except FileNotFoundError:
+            problems.append(f"{path} does not exist.")
+            continue
+        problems += header_problems
+        if header_problems:
+            continue
+        combos = [rdtype_combo, ("pollutantID", "emissionunits")]
+        keys = None
+        if getattr(csvxmlgen, "use_fips_index", False):
+            keys = index_keys(
+                path,
+                rename,
+                FIPSs,
+                combos=combos,
+                index_dir=csvxmlgen.fips_index_dir,
+                logger=csvxmlgen.logger,
+            )
+        if keys is None:
+            keys = scan_keys(path, rename, ["FIPS"], combos=combos)
+        missing = sorted(FIPSs - set(int(fips) for fips in keys["FIPS"]))
+        if missing:
+            problems.append(f"{path} has no data for the counties {missing}.")
+        pollutant_units |= keys.get(("pollutantID", "emissionunits"), set())
+        rdtypes |= keys.get(rdtype_combo, set())
+    pollutant_codes = (
+        csvxmlgen.outpollutants.astype({"pollutantID": int})
+        .groupby("pollutantID")
+        .pollutantCode.apply(list)
+        .to_dict()
+    )
+    found_pollutants = set(int(pol) for pol, _ in pollutant_units)
+    for pol, codes in pollutant_codes.items():
+        if pol not in found_pollutants:
+            problems.append(
+                f"MOVES pollutantID {pol} (pollutant codes {codes}) is not in the "
+                f"emission outputs of {list(csvxmlgen.EIs_selected)}."
+            )
+    units = set(unit for pol, unit in pollutant_units if int(pol) in pollutant_codes)
+    no_factor = sorted(units - set(csvxmlgen.conversion_factor.input_units.values))
+    if no_factor:
+        problems.append(
+            f"The units {no_factor} of the selected pollutants in the utilities "
+            f"output have no conversion factor (input units "
+            f"{list(csvxmlgen.conversion_factor.input_units.values)})."
+        )
+    mapped = set(
+        csvxmlgen.area_rdtype_df[list(rdtype_combo)]
+        .astype(int)
+        .itertuples(index=False, name=None)
+    )
+    unmapped = set((int(at), int(fc)) for at, fc in rdtypes) - mapped
+    if unmapped:
+        problems.append(
+            f"The (areaTypeID, funcClassID) combinations {sorted(unmapped)} are not in "
+            "the road type mapping. Switch from TDM to HPMS or vice-versa in "
+            "`use_tdm_area_rdtype`."
+        )
+    return problems
@@ -0,0 +1,131 @@
+"""
+Ingestion engines of the tab-delimited main module outputs.
+
+The "pandas" engine parses with the pandas C parser. The "arrow" engine memory-maps
+the file and parses it with the multithreaded Arrow CSV reader (requires pyarrow),
+handing the columns to pandas without copies where the dtypes allow. Both engines
+read only the projected columns and produce identical frames: the Arrow reader
+rounds some floats differently from the default float parser of pandas, so the
+arrow engine leaves the float columns to the pandas C parser and reads the others;
+empty strings are missing values.
+"""
+from io import BytesIO
+from pathlib import Path
+import pandas as pd
+
+INGEST_ENGINES = ("pandas", "arrow")
+# Bytes of the head of a table from which the arrow engine infers the float columns,
+# the block size from which the Arrow CSV reader infers the column types.
+INFER_BYTES = 1 << 20
+
+
+def _header(source, sep):
+    # Column names of a file path or of the bytes of a delimited table.
+    if isinstance(source, bytes):
+        end = source.find(b"\n")
+        first_line = source[:end] if end >= 0 else source
+    else:
+        with open(source, "rb") as f:
+            first_line = f.readline()
+    return first_line.rstrip(b"\r\n").decode().split(sep)
+
+
+def _read_pandas(source, sep, columns):
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    return pd.read_csv(source, sep=sep, usecols=columns)
+
+
+def _read_arrow(source, sep, columns):
+    try:
+        import pyarrow as pa
+        from pyarrow import csv as pa_csv
+    except ImportError as err:
+        raise ImportError(
+            "The arrow ingestion engine requires pyarrow. Install pyarrow or use the "
+            "pandas engine."
+        ) from err
+
+    def open_stream():
+        if isinstance(source, bytes):
+            return pa.BufferReader(source)
+        return pa.memory_map(source, "r")
+
+    columns = columns if columns is not None else _header(source, sep)
+    read_options = pa_csv.ReadOptions(use_threads=True, block_size=INFER_BYTES)
+    parse_options = pa_csv.ParseOptions(delimiter=sep)
+    with open_stream() as stream:
+        head = bytes(stream.read(INFER_BYTES))
+    # Whole lines only, unless the head is a single line.
+    head = head[: head.rfind(b"\n") + 1] or head
+    head_schema = pa_csv.read_csv(
+        pa.BufferReader(head),
+        read_options=read_options,
+        parse_options=parse_options,
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=columns, strings_can_be_null=True
+        ),
+    ).schema
+    float_cols = [
+        field.name for field in head_schema if pa.types.is_floating(field.type)
+    ]
+    arrow_cols = [col for col in columns if col not in float_cols]
+    if not arrow_cols:
+        return _read_pandas(source, sep, columns)
+    with open_stream() as stream:
+        table = pa_csv.read_csv(
+            stream,
+            read_options=read_options,
+            parse_options=parse_options,
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=arrow_cols, strings_can_be_null=True
+            ),
+        )
+    # Numeric columns without missing values are handed over without copies.
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    if float_cols:
+        float_df = _read_pandas(source, sep, float_cols)
+        for loc, col in enumerate(columns):
+            if col in float_cols:
+                df.insert(loc, col, float_df[col].to_numpy())
+    return df
+
+
+def read_delimited(source, engine="pandas", sep="\t", columns=None):
+    """
+    Read a delimited main module output with an ingestion engine.
+
+    Parameters
+    ----------
+    source : str, Path, or bytes
+        The file path, or the bytes of a delimited table with its header.
+    engine : str, optional
+        The ingestion engine, "pandas" or "arrow". Default is "pandas".
+    sep : str, optional
+        The column delimiter. Default is tab.
+    columns : iterable, optional
+        The columns to read. Columns not in the file are skipped. Default is None
+        (all columns).
+
+    Returns
+    -------
+    pd.DataFrame
+        The table, with the columns in file order.
+
+    Raises
+    ------
+    ValueError
+        If the engine is unknown.
+    """
+    if engine not in INGEST_ENGINES:
+        raise ValueError(
+            f"Unknown ingestion engine {engine}. Use one of {INGEST_ENGINES}."
+        )
+    if isinstance(source, (str, Path)):
+        source = str(source)
+    if columns is not None:
+        columns = set(columns)
+        columns = [col for col in _header(source, sep) if col in columns]
+    if engine == "arrow":
+        return _read_arrow(source, sep, columns)
+    return _read_pandas(source, sep, columns)
@@ -0,0 +1,319 @@
+"""
+Keyed differences between the outputs of two post-processing runs, in bounded
+memory.
+
+The detailed outputs of both runs are streamed in chunks of their key and measure
+columns. Each chunk is summed by the keys (e.g., county, SCC, and pollutant) and the
+partial sums are spilled to hash partitions of the keys on disk. The partitions are
+then compared one at a time, so the memory is bounded by the chunk size and the
+largest partition instead of the size of the runs. Keys whose values differ beyond
+the tolerances (see `numpy.isclose`) are written to a CSV change report, with a JSON
+summary of the totals and the largest changes next to it.
+
+Aggregate table workbooks are small and are compared sheet by sheet in memory.
+
+Example usage:
+```
+python -m ttionroadei.csvxmlpostprc.rundiff old/emissionDetailed.csv \
+    new/emissionDetailed.csv --out emissionChanges.csv
+python -m ttionroadei.csvxmlpostprc.rundiff old/aggregateTable.xlsx \
+    new/aggregateTable.xlsx --out aggregateChanges.csv
+```
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+import tempfile
+import numpy as np
+import pandas as pd
+
+from ttionroadei.csvxmlpostprc.sharding import SCC_KEYS
+
+CHUNK_ROWS = 1_000_000
+N_PARTITIONS = 64
+N_TOP = 20
+RTOL = 1e-9
+ATOL = 0.0
+# Default keys and measures of the detailed outputs (and star schema fact tables).
+DIFF_KEYS = {
+    "emission": SCC_KEYS,
+    "activity": [
+        "area",
+        "year",
+        "season",
+        "dayType",
+        "FIPS",
+        "sccNEI",
+        "actTypeABB",
+        "activityunits",
+    ],
+}
+
+
+def _value_col(columns):
+    # Measure column of an output.
+    for value in DIFF_KEYS:
+        if value in columns:
+            return value
+    raise ValueError(f"No activity or emission column in {list(columns)}.")
+
+
+def diff_frames(old_df, new_df, keys, value, rtol=RTOL, atol=ATOL):
+    """
+    Compare the values of two DataFrames summed by keys.
+
+    Parameters
+    ----------
+    old_df, new_df : pd.DataFrame
+        The data of the old and new runs, with the key and value columns.
+    keys : list
+        The key columns.
+    value : str
+        The value column (e.g., "emission").
+    rtol, atol : float, optional
+        The relative and absolute tolerances of `numpy.isclose`. Default is RTOL
+        and ATOL.
+
+    Returns
+    -------
+    pd.DataFrame
+        The keys whose values differ: the keys, the old and new values
+        ("<value>Old", "<value>New"), the change ("<value>Change"), the relative
+        change ("relChange", NaN for a zero old value), and the status ("added",
+        "removed", or "changed").
+    """
+    old_col, new_col = f"{value}Old", f"{value}New"
+    old_sum = old_df.groupby(keys, dropna=False)[value].sum().rename(old_col)
+    new_sum = new_df.groupby(keys, dropna=False)[value].sum().rename(new_col)
+    df = pd.concat([old_sum, new_sum], axis=1, join="outer")
+    old_vals, new_vals = df[old_col].to_numpy(), df[new_col].to_numpy()
+    status = np.select(
+        [np.isnan(old_vals), np.isnan(new_vals)], ["added", "removed"], "changed"
+    )
+    same = np.isclose(new_vals, old_vals, rtol=rtol, atol=atol)
+    change = np.nan_to_num(new_vals) - np.nan_to_num(old_vals)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rel_change = np.where(old_vals != 0, change / np.abs(old_vals), np.nan)
+    df = df.assign(
+        **{f"{value}Change": change},
+        relChange=rel_change,
+        status=status,
+    )
+    return df.loc[~same].reset_index()
+
+
+def _partition(df, keys, n_partitions):
+    # Hash partition of each row by its keys.
+    hashes = pd.util.hash_pandas_object(df[keys], index=False).to_numpy()
+    return hashes % np.uint64(n_partitions)
+
+
+def _spill(path, keys, value, part_dir, tag, n_partitions, chunk_rows):
+    # Sum the chunks of a CSV file by the keys and append the partial sums to the
+    # partition files. Returns the number of rows read.
+    n_rows = 0
+    reader = pd.read_csv(
+        path,
+        usecols=keys + [value],
+        dtype={key: str for key in keys},
+        float_precision="round_trip",
+        chunksize=chunk_rows,
+    )
+    for chunk in reader:
+        n_rows += len(chunk)
+        partial = chunk.groupby(keys, as_index=False, dropna=False)[value].sum()
+        for part, part_df in partial.groupby(_partition(partial, keys, n_partitions)):
+            part_fi = part_dir.joinpath(f"{tag}{part}.csv")
+            part_df.to_csv(part_fi, mode="a", header=not part_fi.exists(), index=False)
+    return n_rows
+
+
+def _read_part(part_fi, keys, value):
+    if not part_fi.exists():
+        return pd.DataFrame(columns=keys + [value]).astype({value: float})
+    return pd.read_csv(
+        part_fi,
+        dtype={key: str for key in keys},
+        keep_default_na=False,
+        float_precision="round_trip",
+    )
+
+
+def _summary(summary, changes, value):
+    # Update the summary with the changes of a partition.
+    for status, n in changes.status.value_counts().items():
+        summary[status] += int(n)
+    if len(summary["top"]):
+        changes = pd.concat([summary["top"], changes], ignore_index=True)
+    largest = changes[f"{value}Change"].abs().sort_values(ascending=False)
+    summary["top"] = changes.loc[largest.index[:N_TOP]].reset_index(drop=True)
+
+
+def diff_csv(
+    old_fi,
+    new_fi,
+    out_fi,
+    keys=None,
+    rtol=RTOL,
+    atol=ATOL,
+    n_partitions=N_PARTITIONS,
+    chunk_rows=CHUNK_ROWS,
+):
+    """
+    Compare two detailed outputs (or star schema fact tables) by keys in bounded
+    memory and write the change report.
+
+    Parameters
+    ----------
+    old_fi, new_fi : str or Path
+        The CSV files of the old and new runs.
+    out_fi : str or Path
+        The change report CSV file (see `diff_frames`). The JSON summary is written
+        to the same path with a ".json" suffix.
+    keys : list, optional
+        The key columns. Default is None: the county, SCC, pollutant (or activity
+        type), and scenario columns of `DIFF_KEYS`.
+    rtol, atol : float, optional
+        The relative and absolute tolerances of `numpy.isclose`. Default is RTOL
+        and ATOL.
+    n_partitions : int, optional
+        The number of hash partitions of the keys. Default is N_PARTITIONS.
+    chunk_rows : int, optional
+        The rows per chunk read. Default is CHUNK_ROWS.
+
+    Returns
+    -------
+    dict
+        The summary: rows read, keys compared, number of changed, added, and removed
+        keys, old and new totals, and the N_TOP largest absolute changes.
+    """
+    out_fi = Path(out_fi)
+    value = _value_col(pd.read_csv(old_fi, nrows=0).columns)
+    keys = list(keys or DIFF_KEYS[value])
+    summary = {"changed": 0, "added": 0, "removed": 0, "top": pd.DataFrame()}
+    totals = {"keys": 0, "old": 0.0, "new": 0.0}
+    tmp_fi = out_fi.with_name(f"{out_fi.name}.{os.getpid()}.tmp")
+    with tempfile.TemporaryDirectory(dir=out_fi.parent) as part_dir:
+        part_dir = Path(part_dir)
+        n_rows = {
+            tag: _spill(fi, keys, value, part_dir, tag, n_partitions, chunk_rows)
+            for tag, fi in [("old", old_fi), ("new", new_fi)]
+        }
+        header = True
+        for part in range(n_partitions):
+            old_df = _read_part(part_dir.joinpath(f"old{part}.csv"), keys, value)
+            new_df = _read_part(part_dir.joinpath(f"new{part}.csv"), keys, value)
+            changes = diff_frames(old_df, new_df, keys, value, rtol, atol)
+            totals["keys"] += len(
+                pd.concat([old_df[keys], new_df[keys]]).drop_duplicates()
+            )
+            totals["old"] += old_df[value].sum()
+            totals["new"] += new_df[value].sum()
+            changes.to_csv(
+                tmp_fi, mode="w" if header else "a", header=header, index=False
+            )
+            header = False
+            _summary(summary, changes, value)
+    os.replace(tmp_fi, out_fi)
+    summary = {
+        "old_fi": str(old_fi),
+        "new_fi": str(new_fi),
+        "keys": keys,
+        "rtol": rtol,
+        "atol": atol,
+        "rows_old": n_rows["old"],
+        "rows_new": n_rows["new"],
+        "keys_compared": totals["keys"],
+        f"{value}_old": totals["old"],
+        f"{value}_new": totals["new"],
+        "changed": summary["changed"],
+        "added": summary["added"],
+        "removed": summary["removed"],
+        "top": json.loads(summary["top"].to_json(orient="records")),
+    }
+    with open(out_fi.with_suffix(".json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def diff_aggregate_tables(old_fi, new_fi, out_fi, rtol=RTOL, atol=ATOL):
+    """
+    Compare the aggregate table workbooks of two runs sheet by sheet and write the
+    change report, keyed by all the columns of a sheet except its measure.
+
+    Parameters
+    ----------
+    old_fi, new_fi : str or Path
+        The aggregate table workbooks of the old and new runs.
+    out_fi : str or Path
+        The change report CSV file, with a "sheet" column (see `diff_frames`).
+    rtol, atol : float, optional
+        The relative and absolute tolerances of `numpy.isclose`. Default is RTOL
+        and ATOL.
+
+    Returns
+    -------
+    dict
+        The number of changed, added, and removed keys by sheet.
+    """
+    old_sheets = pd.read_excel(old_fi, sheet_name=None)
+    new_sheets = pd.read_excel(new_fi, sheet_name=None)
+    reports, summary = [], {}
+    for sheet in sorted(set(old_sheets) | set(new_sheets)):
+        # A sheet of one workbook only is compared with an empty sheet.
+        if sheet in old_sheets:
+            old_df = old_sheets[sheet]
+            new_df = new_sheets[sheet] if sheet in new_sheets else old_df.iloc[:0]
+        else:
+            new_df = new_sheets[sheet]
+            old_df = new_df.iloc[:0]
+        value = _value_col(old_df.columns)
+        keys = [col for col in old_df.columns if col != value]
+        changes = diff_frames(old_df, new_df, keys, value, rtol, atol)
+        summary[sheet] = {
+            status: int((changes.status == status).sum())
+            for status in ["changed", "added", "removed"]
+        }
+        reports.append(changes.assign(sheet=sheet))
+    pd.concat(reports).to_csv(out_fi, index=False)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare the outputs of two post-processing runs."
+    )
+    parser.add_argument("old", help="Detailed CSV or aggregate workbook (old run).")
+    parser.add_argument("new", help="Detailed CSV or aggregate workbook (new run).")
+    parser.add_argument("--out", required=True, help="Change report CSV file.")
+    parser.add_argument("--keys", help="Comma separated key columns (detailed CSV).")
+    parser.add_argument("--rtol", type=float, default=RTOL)
+    parser.add_argument("--atol", type=float, default=ATOL)
+    parser.add_argument("--partitions", type=int, default=N_PARTITIONS)
+    args = parser.parse_args(argv)
+    if Path(args.old).suffix == ".xlsx":
+        summary = diff_aggregate_tables(
+            args.old, args.new, args.out, rtol=args.rtol, atol=args.atol
+        )
+        for sheet, counts in summary.items():
+            print(f"{sheet}: {counts}")
+        return 0
+    summary = diff_csv(
+        args.old,
+        args.new,
+        args.out,
+        keys=args.keys.split(",") if args.keys else None,
+        rtol=args.rtol,
+        atol=args.atol,
+        n_partitions=args.partitions,
+    )
+    print(
+        f"{summary['keys_compared']} keys compared: {summary['changed']} changed, "
+        f"{summary['added']} added, {summary['removed']} removed. Report: {args.out}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
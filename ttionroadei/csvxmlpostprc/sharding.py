@@ -0,0 +1,214 @@
+"""
+Per-county sharded post-processing with a map-reduce merge of the shard outputs.
+
+Every step up to the aggregation is independent per county (FIPS). The selected
+counties are split into shards; each shard is ingested, labelled, and partially
+aggregated on its own, so the peak memory is bounded by the largest shard instead of
+the whole area. The shards read only the rows of their counties through the county
+index of the main module outputs (see `fileindex`), so the files are not parsed in
+full once per shard. The detailed shard outputs are then concatenated and the partial
+aggregates summed.
+"""
+import shutil
+import numpy as np
+import pandas as pd
+
+from ttionroadei.csvxmlpostprc.csvxmlgen import make_csvxmlgen
+from ttionroadei.csvxmlpostprc.starschema import fact_table
+from ttionroadei.metrics import count_rows, count_bytes
+
+# Group columns of the XML staging table produced by `CsvXmlGen.aggsccgen`.
+SCC_KEYS = [
+    "area",
+    "year",
+    "season",
+    "dayType",
+    "FIPS",
+    "sccNEI",
+    "pollutantCode",
+    "emissionunits",
+]
+
+
+def split_fips(FIPSs, n_shards):
+    """
+    Split counties into shards of nearly equal size, keeping their order.
+
+    Parameters
+    ----------
+    FIPSs : list
+        The county FIPS codes.
+    n_shards : int
+        The number of shards. Capped at the number of counties.
+
+    Returns
+    -------
+    list
+        The county FIPS codes of each shard.
+    """
+    n_shards = max(1, min(int(n_shards), len(FIPSs)))
+    return [
+        [int(fips) for fips in shard] for shard in np.array_split(list(FIPSs), n_shards)
+    ]
+
+
+def shard_outputs(shard_dir, genaggpivfiles, genxmlfile):
+    """
+    Get the output file paths of a shard.
+
+    Parameters
+    ----------
+    shard_dir : pathlib.Path
+        The directory receiving the shard outputs.
+    genaggpivfiles : bool
+        Whether the partial aggregate tables are produced.
+    genxmlfile : bool
+        Whether the XML staging table is produced.
+
+    Returns
+    -------
+    dict
+        The paths of the detailed CSV parts ("act", "emis"), of the pickled partial
+        aggregate tables ("agg", None unless `genaggpivfiles`), and of the pickled
+        XML staging table ("scc", None unless `genxmlfile`).
+    """
+    return {
+        "act": shard_dir.joinpath("activityDetailed.csv"),
+        "emis": shard_dir.joinpath("emissionDetailed.csv"),
+        "agg": shard_dir.joinpath("aggregatePartial.pkl") if genaggpivfiles else None,
+        "scc": shard_dir.joinpath("xmlSCCStagingTable.pkl") if genxmlfile else None,
+    }
+
+
+def run_shard(params, FIPSs, shard_dir, metrics=None):
+    """
+    Ingest, label, and partially aggregate the data of a shard of counties.
+
+    Runs in a worker process. The post-processing is rebuilt from its parameters, so
+    only the parameter dictionary is sent to the worker. The detailed data (their
+    fact tables with the "star" `detailed_format`) are written as CSV parts and the
+    partial aggregates are pickled to `shard_dir`, so only file paths are sent back
+    to the parent process.
+
+    Parameters
+    ----------
+    params : dict
+        The post-processing parameters, as returned by `PostProcessorGUI.get_params`,
+        with a `labels_snapshot` directory so the worker does not query the labels
+        database.
+    FIPSs : list
+        The county FIPS codes of the shard.
+    shard_dir : pathlib.Path
+        The directory receiving the shard outputs.
+    metrics : MetricsRecorder, optional
+        The metrics recorder of the run, so the shard metrics are written to the
+        metrics file of the run. Default is None (metrics kept in the worker).
+
+    Returns
+    -------
+    dict
+        The shard output file paths (see `shard_outputs`).
+    """
+    # Imported here: the GUI module imports this module.
+    from ttionroadei.GUI import PostProcessorGUI
+
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    gui_obj = PostProcessorGUI(ei_base_dir=None, log_dir=params["log_dir"])
+    gui_obj.load_params(params)
+    if metrics is not None:
+        gui_obj.metrics = metrics
+    csvxmlgen = make_csvxmlgen(gui_obj)
+    csvxmlgen.FIPSs_selected = FIPSs
+    csvxmlgen.logger.info(msg=f"Processing shard of counties {FIPSs}...")
+    with csvxmlgen.metrics.measure("shard", FIPS=FIPSs) as record:
+        act_emis_dict = csvxmlgen.detailedcsvgen()
+        shard_out = shard_outputs(shard_dir, gui_obj.genaggpivfiles, gui_obj.genxmlfile)
+        for key in ["act", "emis"]:
+            df = act_emis_dict[key]
+            if gui_obj.detailed_format == "star":
+                df = fact_table(df, key)
+            df.to_csv(shard_out[key], index=False)
+        if gui_obj.genaggpivfiles:
+            pd.to_pickle(csvxmlgen.aggxlsxpartial(act_emis_dict), shard_out["agg"])
+        if gui_obj.genxmlfile:
+            gui_obj.get_scc_table(csvxmlgen, act_emis_dict).to_pickle(shard_out["scc"])
+        record.update(
+            rows_out=count_rows(act_emis_dict),
+            bytes_written=count_bytes(
+                [fi for fi in shard_out.values() if fi is not None]
+            ),
+        )
+    csvxmlgen.logger.info(msg=f"Processed shard of counties {FIPSs}.")
+    return shard_out
+
+
+def concat_csv_parts(part_fis, out_fi):
+    """
+    Concatenate CSV files with the same columns, keeping the header of the first.
+
+    Parameters
+    ----------
+    part_fis : list
+        The CSV part file paths, in output order.
+    out_fi : pathlib.Path
+        The concatenated CSV file path.
+
+    Returns
+    -------
+    None
+    """
+    with open(out_fi, "wb") as out:
+        for i, part_fi in enumerate(part_fis):
+            with open(part_fi, "rb") as part:
+                header = part.readline()
+                if i == 0:
+                    out.write(header)
+                shutil.copyfileobj(part, out)
+
+
+def merge_partial_aggs(partial_aggs):
+    """
+    Merge the partial aggregates of the shards by summing them again by their
+    indices.
+
+    Parameters
+    ----------
+    partial_aggs : list
+        The outputs of `CsvXmlGen.aggxlsxpartial` for each shard.
+
+    Returns
+    -------
+    dict
+        The summed activity and emissions data by aggregation type, for
+        `CsvXmlGen.aggxlsxfinal`.
+    """
+    merged = {}
+    for aggtype in partial_aggs[0]:
+        merged[aggtype] = {}
+        for key, measure in [("act", "activity"), ("emis", "emission")]:
+            df = pd.concat([partial[aggtype][key] for partial in partial_aggs])
+            idx = [col for col in df.columns if col != measure]
+            merged[aggtype][key] = df.groupby(idx, as_index=False)[measure].sum()
+    return merged
+
+
+def merge_scc_tables(scc_tables):
+    """
+    Concatenate the XML staging tables of the shards. Counties do not overlap
+    between shards, so no group is split across shards.
+
+    Parameters
+    ----------
+    scc_tables : list
+        The XML staging tables of the shards.
+
+    Returns
+    -------
+    pd.DataFrame
+        The XML staging table, in the group order of `CsvXmlGen.aggsccgen`.
+    """
+    return (
+        pd.concat(scc_tables)
+        .sort_values(SCC_KEYS, kind="mergesort")
+        .reset_index(drop=True)
+    )
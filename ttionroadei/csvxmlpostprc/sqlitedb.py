@@ -0,0 +1,217 @@
+"""
+Indexed SQLite database of the post-processing outputs.
+
+The detailed activity and emission data, the aggregate tables, and the XML staging
+table are bulk loaded into one SQLite file, with the label tables and the road type
+mapping as separate dimension tables, so the outputs can be queried by county, SCC,
+and pollutant (e.g., from Access or Excel) without loading the detailed CSV files.
+The rows are inserted with batched `executemany` calls in a single transaction, and
+the indexes are created after the load. The database is written to a temporary file
+that replaces the previous database once complete.
+
+Example query:
+```
+SELECT * FROM emissionDetailed
+WHERE FIPS = 48201 AND sccNEI = '2202210080' AND pollutantCode = 'NOx';
+```
+"""
+import os
+from pathlib import Path
+import sqlite3
+import pandas as pd
+
+# Rows per `executemany` batch and per chunk of the detailed CSV files.
+BATCH_ROWS = 50_000
+CSV_CHUNK_ROWS = 500_000
+# Indexed column groups of the fact tables (detailed, aggregate, and staging
+# tables): the scenario keys, the county, SCC, and pollutant point-query keys, and
+# the dimension keys. Each table gets an index on the columns of a group it has.
+INDEX_GROUPS = [
+    ["area", "year", "season", "dayType", "FIPS"],
+    ["FIPS", "sccNEI", "pollutantCode"],
+    ["sccNEI"],
+    ["pollutantCode"],
+    ["sourceUseTypeID", "fuelTypeID"],
+    ["mvsRoadTypeID"],
+    ["processID"],
+    ["actTypeABB"],
+]
+# Keys of the dimension tables (label tables and road type mapping).
+DIM_KEYS = {
+    "county": ["FIPS"],
+    "emisprc": ["processID"],
+    "pollutants": ["pollutantID"],
+    "moves_roadtypes": ["mvsRoadTypeID"],
+    "moves_sut": ["sourceUseTypeID"],
+    "moves_ft": ["fuelTypeID"],
+    "act_lab": ["actTypeABB"],
+    "area_rdtype": ["area", "funcClassID", "areaTypeID"],
+}
+# Text columns that look numeric in the CSV outputs.
+TEXT_COLS = {"sccNEI": str}
+
+
+def _quote(name):
+    # Quoted SQLite identifier.
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _sqlite_type(dtype):
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+
+def insert_frames(con, table, frames, batch_rows=BATCH_ROWS):
+    """
+    Create a table and insert the rows of DataFrames with batched `executemany`
+    calls. The column types are those of the first DataFrame.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        The database connection, in a transaction.
+    table : str
+        The table name.
+    frames : iterable
+        The DataFrames (e.g., chunks of a CSV file) with the same columns.
+    batch_rows : int, optional
+        The rows per `executemany` call. Default is BATCH_ROWS.
+
+    Returns
+    -------
+    tuple
+        The table columns and the number of rows inserted.
+    """
+    columns, n_rows, insert_sql = None, 0, None
+    for df in frames:
+        if columns is None:
+            columns = list(df.columns)
+            col_defs = ", ".join(
+                f"{_quote(col)} {_sqlite_type(df[col].dtype)}" for col in columns
+            )
+            con.execute(f"DROP TABLE IF EXISTS {_quote(table)}")
+            con.execute(f"CREATE TABLE {_quote(table)} ({col_defs})")
+            insert_sql = (
+                f"INSERT INTO {_quote(table)} VALUES "
+                f"({', '.join('?' * len(columns))})"
+            )
+        # Missing values are stored as NULL.
+        df = df[columns].astype(object).where(df[columns].notna(), None)
+        for start in range(0, len(df), batch_rows):
+            con.executemany(
+                insert_sql,
+                df.iloc[start : start + batch_rows].itertuples(index=False, name=None),
+            )
+        n_rows += len(df)
+    return columns or [], n_rows
+
+
+def create_indexes(con, table, columns, groups=INDEX_GROUPS):
+    """
+    Create the indexes of a table on the column groups it has.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        The database connection.
+    table : str
+        The table name.
+    columns : list
+        The table columns.
+    groups : list, optional
+        The indexed column groups. Default is INDEX_GROUPS.
+
+    Returns
+    -------
+    list
+        The indexed column tuples.
+    """
+    indexed = []
+    for group in groups:
+        cols = tuple(col for col in group if col in columns)
+        if not cols or cols in indexed:
+            continue
+        con.execute(
+            f"CREATE INDEX {_quote(f'ix_{table}_' + '_'.join(cols))} ON "
+            f"{_quote(table)} ({', '.join(_quote(col) for col in cols)})"
+        )
+        indexed.append(cols)
+    return indexed
+
+
+def write_sqlite_db(
+    db_fi,
+    detailed_fis=None,
+    agg_tab_fi=None,
+    xmlscc_fi=None,
+    dims=None,
+    batch_rows=BATCH_ROWS,
+):
+    """
+    Bulk load the post-processing outputs into an indexed SQLite database.
+
+    Parameters
+    ----------
+    db_fi : str or Path
+        The SQLite database file path. An existing database is replaced.
+    detailed_fis : dict, optional
+        The detailed CSV file paths by table name (e.g., "activityDetailed"). The
+        files are read in chunks of CSV_CHUNK_ROWS rows. Default is None.
+    agg_tab_fi : str or Path, optional
+        The aggregate tables Excel file. Each sheet is loaded as a table. Default is
+        None.
+    xmlscc_fi : str or Path, optional
+        The XML staging table CSV file, loaded as the "xmlSCCStagingTable" table.
+        Default is None.
+    dims : dict, optional
+        The dimension DataFrames by name (label tables and road type mapping),
+        loaded as "dim_<name>" tables indexed on their keys (see DIM_KEYS). Default
+        is None.
+    batch_rows : int, optional
+        The rows per `executemany` call. Default is BATCH_ROWS.
+
+    Returns
+    -------
+    dict
+        The number of rows loaded by table.
+    """
+    db_fi = Path(db_fi)
+    tmp_fi = db_fi.with_name(f"{db_fi.name}.{os.getpid()}.tmp")
+    if tmp_fi.exists():
+        tmp_fi.unlink()
+    facts = {}
+    for table, fi in (detailed_fis or {}).items():
+        facts[table] = pd.read_csv(
+            fi, dtype=TEXT_COLS, chunksize=CSV_CHUNK_ROWS, low_memory=False
+        )
+    if agg_tab_fi is not None:
+        for sheet, df in pd.read_excel(agg_tab_fi, sheet_name=None).items():
+            facts[sheet] = [df]
+    if xmlscc_fi is not None:
+        facts["xmlSCCStagingTable"] = [pd.read_csv(xmlscc_fi, dtype=TEXT_COLS)]
+    n_rows = {}
+    # No journal: the temporary file is discarded if the load fails.
+    con = sqlite3.connect(tmp_fi, isolation_level=None)
+    try:
+        con.execute("PRAGMA journal_mode = OFF")
+        con.execute("PRAGMA synchronous = OFF")
+        con.execute("BEGIN")
+        for table, frames in facts.items():
+            columns, n_rows[table] = insert_frames(con, table, frames, batch_rows)
+            create_indexes(con, table, columns)
+        for name, df in (dims or {}).items():
+            table = f"dim_{name}"
+            columns, n_rows[table] = insert_frames(con, table, [df], batch_rows)
+            create_indexes(con, table, columns, groups=[DIM_KEYS.get(name, [])])
+        con.execute("COMMIT")
+        con.execute("ANALYZE")
+    except BaseException:
+        con.close()
+        tmp_fi.unlink()
+        raise
+    con.close()
+    os.replace(tmp_fi, db_fi)
+    return n_rows
@@ -0,0 +1,463 @@
+"""
+Input-hash based caching of the post-processing stage artifacts.
+"""
+from functools import lru_cache
+import hashlib
+import json
+from pathlib import Path
+import pandas as pd
+
+from ttionroadei.utils import settings
+
+# Post-processing stages in execution order, mapped to the upstream stage whose
+# output they consume.
+STAGE_UPSTREAM = {
+    "ingest": None,
+    "label": "ingest",
+    "detailed": "label",
+    "aggregate": "label",
+    "scc": "label",
+    "xml": "scc",
+    "sqlite": "detailed",
+}
+# Stages whose output is activity and emission DataFrames consumed in memory by the
+# downstream stages. The other stages only produce output files.
+FRAME_STAGES = ("ingest", "label")
+# Sections of the settings used by each stage (and by the sharded processing).
+STAGE_SETTINGS = {
+    "ingest": ["act_rename", "emis_rename", "csvxml_act", "csvxml_ei", "activityunits"],
+    "label": ["csvxml_act", "csvxml_ei"],
+    "detailed": ["csvxml_act", "csvxml_ei"],
+    "aggregate": ["csvxml_act", "csvxml_ei", "xlsxxml_aggpiv_opts"],
+    "scc": [],
+    "xml": [],
+    "sqlite": [],
+    "shard": ["xlsxxml_aggpiv_opts"],
+    "merge": ["csvxml_act", "csvxml_ei", "xlsxxml_aggpiv_opts"],
+}
+# Package directories whose modules implement the stages (see `code_version`).
+CODE_DIRS = [Path(__file__).parents[1], Path(__file__).parent]
+
+
+def _hash_json(obj):
+    # Hex digest of a JSON serializable object.
+    payload = json.dumps(obj, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def code_version():
+    """
+    Hash the source of the post-processing modules, so the cached artifacts of an
+    older version of the code are not reused.
+
+    Returns
+    -------
+    str
+        Hex digest of the module sources (tests excluded).
+    """
+    digest = hashlib.blake2b(digest_size=32)
+    for code_dir in CODE_DIRS:
+        for path in sorted(code_dir.glob("*.py")):
+            if not path.name.startswith("test_"):
+                digest.update(path.name.encode())
+                digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+class StageCache:
+    """
+    Cache of the post-processing stage artifacts keyed by a hash of the stage
+    inputs.
+
+    Every stage records in a JSON manifest the hash of its inputs (the upstream
+    artifact hash, the relevant slice of the post-processing parameters and of the
+    settings, and the code version), the paths of the artifacts it produced, and
+    their size and modification time fingerprint. A stage whose input hash is
+    unchanged and whose artifacts are still on disk, unmodified, can be skipped and
+    its artifacts reused. The artifacts are never read back to hash their content:
+    the artifact hash passed to the downstream stages is the hash of their
+    fingerprint, so a rerun stage always reruns its downstream stages.
+
+    The cache also tracks the stages completed by the current run in a run state
+    file, so a failed run can be resumed from its last completed stage.
+
+    Attributes
+    ----------
+    cache_dir : pathlib.Path
+        The directory holding the manifest and the cached DataFrames.
+    manifest_fi : pathlib.Path
+        The JSON manifest file path.
+    manifest : dict
+        The stage entries of the manifest.
+    run_fi : pathlib.Path
+        The JSON run state file path.
+    run_state : dict
+        The hash of the run parameters ("run_hash"), the status ("running" or
+        "completed"), and the stages completed ("completed") of the last run.
+    logger : logging.Logger
+        A logger for recording the cache decisions.
+
+    Methods
+    -------
+    hash_inputs(params, upstream_hash)
+        Hash the parameters and the upstream artifact hash of a stage.
+    hash_settings(sections)
+        Hash sections of the settings.
+    hash_fingerprints(paths)
+        Hash the size and modification time fingerprint of files.
+    hash_frames(frames)
+        Hash the content of DataFrames.
+    fingerprint_files(paths)
+        Cheap size and modification time fingerprint of files.
+    is_fresh(stage, input_hash)
+        Check if the cached artifacts of a stage can be reused.
+    artifacts_intact(stage)
+        Check if the recorded artifacts of a stage exist and were not modified.
+    artifact_hash(stage)
+        Get the recorded artifact hash of a stage.
+    record(stage, input_hash, artifacts)
+        Record the input hash and artifacts of a completed stage.
+    save_frames(stage, frames)
+        Persist the DataFrames produced by a stage.
+    load_frames(stage)
+        Load the DataFrames persisted by a stage.
+    begin_run(run_hash, resume)
+        Start tracking the completed stages of a run.
+    complete_stage(stage)
+        Mark a stage of the current run as completed.
+    end_run()
+        Mark the current run as completed.
+    """
+
+    def __init__(self, cache_dir, logger):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_fi = self.cache_dir.joinpath("manifest.json")
+        self.logger = logger
+        self.manifest = self._read_json(self.manifest_fi)
+        self.run_fi = self.cache_dir.joinpath("run.json")
+        self.run_state = self._read_json(self.run_fi)
+
+    def _read_json(self, path):
+        """Read a JSON file of the cache, or get an empty dict if it is unusable."""
+        if not path.exists():
+            return {}
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except ValueError:
+            self.logger.warning(f"Ignoring unreadable stage cache file {str(path)}.")
+            return {}
+
+    @staticmethod
+    def hash_inputs(params, upstream_hash=None):
+        """
+        Hash the parameters and the upstream artifact hash of a stage.
+
+        Parameters
+        ----------
+        params : dict
+            The slice of the post-processing parameters used by the stage.
+        upstream_hash : str or None
+            The artifact hash of the upstream stage.
+
+        Returns
+        -------
+        str
+            Hex digest of the stage inputs.
+        """
+        return _hash_json({"params": params, "upstream": upstream_hash})
+
+    @staticmethod
+    def hash_settings(sections):
+        """
+        Hash sections of the settings.
+
+        Parameters
+        ----------
+        sections : list
+            The settings keys (see `STAGE_SETTINGS`).
+
+        Returns
+        -------
+        str
+            Hex digest of the settings sections.
+        """
+        return _hash_json({key: settings.get(key) for key in sections})
+
+    @classmethod
+    def hash_fingerprints(cls, paths):
+        """
+        Hash the size and modification time fingerprint of files.
+
+        Parameters
+        ----------
+        paths : list
+            The file paths.
+
+        Returns
+        -------
+        str
+            Hex digest of the fingerprint (see `fingerprint_files`).
+        """
+        return _hash_json(cls.fingerprint_files(paths))
+
+    @staticmethod
+    def hash_frames(frames):
+        """
+        Hash the content of DataFrames.
+
+        Parameters
+        ----------
+        frames : dict
+            Mapping of names to DataFrames.
+
+        Returns
+        -------
+        str
+            Hex digest of the DataFrame contents and columns.
+        """
+        digest = hashlib.blake2b(digest_size=32)
+        for key in sorted(frames):
+            df = frames[key]
+            digest.update(key.encode())
+            digest.update(str(list(df.columns)).encode())
+            digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def fingerprint_files(paths):
+        """
+        Cheap size and modification time fingerprint of files.
+
+        Used for the raw main module outputs and the stage artifacts, which are too
+        large to hash on every run.
+
+        Parameters
+        ----------
+        paths : list
+            The file paths.
+
+        Returns
+        -------
+        list
+            [path, size, mtime_ns] for each file, or [path, None, None] for missing
+            files.
+        """
+        fingerprint = []
+        for path in paths:
+            path = Path(path)
+            if path.exists():
+                stat = path.stat()
+                fingerprint.append([str(path), stat.st_size, stat.st_mtime_ns])
+            else:
+                fingerprint.append([str(path), None, None])
+        return fingerprint
+
+    def is_fresh(self, stage, input_hash):
+        """
+        Check if the cached artifacts of a stage can be reused.
+
+        Parameters
+        ----------
+        stage : str
+            The stage name.
+        input_hash : str
+            The current input hash of the stage.
+
+        Returns
+        -------
+        bool
+            True if the input hash matches the recorded one and the recorded
+            artifacts exist and were not modified since.
+        """
+        entry = self.manifest.get(stage)
+        if entry is None or entry["input_hash"] != input_hash:
+            return False
+        return self.artifacts_intact(stage)
+
+    def artifacts_intact(self, stage):
+        """
+        Check if the recorded artifacts of a stage exist and were not modified,
+        whatever its inputs.
+
+        Parameters
+        ----------
+        stage : str
+            The stage name.
+
+        Returns
+        -------
+        bool
+            True if the stage is recorded and its artifacts match their fingerprint.
+        """
+        entry = self.manifest.get(stage)
+        if entry is None:
+            return False
+        return self.fingerprint_files(entry["artifacts"]) == entry["fingerprint"]
+
+    def artifact_hash(self, stage):
+        """
+        Get the recorded artifact hash of a stage.
+
+        Parameters
+        ----------
+        stage : str
+            The stage name.
+
+        Returns
+        -------
+        str
+            Hex digest of the stage artifact fingerprint.
+        """
+        return self.manifest[stage]["artifact_hash"]
+
+    def record(self, stage, input_hash, artifacts):
+        """
+        Record the input hash and artifacts of a completed stage. The downstream
+        stages see the new artifact hash in their inputs and rerun.
+
+        Parameters
+        ----------
+        stage : str
+            The stage name.
+        input_hash : str
+            The input hash of the stage.
+        artifacts : list
+            The artifact file paths produced by the stage.
+
+        Returns
+        -------
+        str
+            Hex digest of the stage artifact fingerprint.
+        """
+        artifacts = [str(path) for path in artifacts]
+        fingerprint = self.fingerprint_files(artifacts)
+        artifact_hash = _hash_json(fingerprint)
+        self.manifest[stage] = {
+            "input_hash": input_hash,
+            "artifact_hash": artifact_hash,
+            "artifacts": artifacts,
+            "fingerprint": fingerprint,
+        }
+        self._write_manifest()
+        return artifact_hash
+
+    def _write_manifest(self):
+        """Write the manifest through a temporary file so it is never half written."""
+        self._write_json(self.manifest_fi, self.manifest)
+
+    @staticmethod
+    def _write_json(path, obj):
+        """Write a JSON file through a temporary file so it is never half written."""
+        tmp_fi = path.with_suffix(".tmp")
+        with open(tmp_fi, "w") as f:
+            json.dump(obj, f, indent=2)
+        tmp_fi.replace(path)
+
+    def save_frames(self, stage, frames):
+        """
+        Persist the DataFrames produced by a stage.
+
+        Parameters
+        ----------
+        stage : str
+            The stage name.
+        frames : dict
+            Mapping of names to DataFrames.
+
+        Returns
+        -------
+        list
+            The paths of the persisted DataFrames.
+        """
+        paths = []
+        for key, df in frames.items():
+            path = self.cache_dir.joinpath(f"{stage}_{key}.pkl")
+            df.to_pickle(path)
+            paths.append(path)
+        return paths
+
+    def load_frames(self, stage):
+        """
+        Load the DataFrames persisted by a stage.
+
+        Parameters
+        ----------
+        stage : str
+            The stage name.
+
+        Returns
+        -------
+        dict
+            Mapping of names to DataFrames.
+        """
+        frames = {}
+        for path in self.manifest[stage]["artifacts"]:
+            key = Path(path).stem[len(stage) + 1 :]
+            frames[key] = pd.read_pickle(path)
+        return frames
+
+    def begin_run(self, run_hash, resume):
+        """
+        Start tracking the completed stages of a run.
+
+        Parameters
+        ----------
+        run_hash : str
+            Hex digest of the run parameters. A run only resumes a previous run with
+            the same parameters.
+        resume : bool
+            Whether to resume the previous run if it failed.
+
+        Returns
+        -------
+        set
+            The stages completed by the previous run, when `resume` and the previous
+            run with the same parameters did not complete; else an empty set. Their
+            artifacts can be reused whatever their inputs.
+        """
+        completed = []
+        if (
+            resume
+            and self.run_state.get("status") == "running"
+            and self.run_state.get("run_hash") == run_hash
+        ):
+            completed = self.run_state["completed"]
+        # The stages resumed stay completed if this run fails as well.
+        self.run_state = {
+            "run_hash": run_hash,
+            "status": "running",
+            "completed": list(completed),
+        }
+        self._write_json(self.run_fi, self.run_state)
+        return set(completed)
+
+    def complete_stage(self, stage):
+        """
+        Mark a stage of the current run as completed.
+
+        Parameters
+        ----------
+        stage : str
+            The stage name.
+
+        Returns
+        -------
+        None
+        """
+        if stage not in self.run_state.get("completed", []):
+            self.run_state.setdefault("completed", []).append(stage)
+            self._write_json(self.run_fi, self.run_state)
+
+    def end_run(self):
+        """
+        Mark the current run as completed, so it is not resumed.
+
+        Returns
+        -------
+        None
+        """
+        self.run_state["status"] = "completed"
+        self._write_json(self.run_fi, self.run_state)
@@ -0,0 +1,210 @@
+"""
+Star-schema output of the detailed activity and emission data.
+
+The detailed data repeat the text labels of the road types, source use types, fuel
+types, pollutants, and processes on every row. In the star schema, the fact tables
+keep only the scenario and ID columns and the measures, and the label tables (see
+`utils.get_labels`) and the road type mapping are written once as dimension tables.
+`load_star_schema` rejoins the facts with the dimensions to the detailed data, or
+to the facts with only the requested labels.
+
+Files of a star schema directory:
+```
+activityFact.csv, emissionFact.csv     fact tables
+dim_<name>.csv                         dimension tables
+```
+"""
+from pathlib import Path
+import pandas as pd
+
+from ttionroadei.utils import settings
+
+FACT_FIS = {"act": "activityFact.csv", "emis": "emissionFact.csv"}
+COLUMNS_KEYS = {"act": "csvxml_act", "emis": "csvxml_ei"}
+# Dimension tables joined to the fact tables, in join order: keys and label columns.
+# The road type mapping provides the MOVES road type ID joining the road types.
+DIMS = {
+    "act": [
+        ("area_rdtype", ["area", "funcClassID", "areaTypeID"]),
+        ("moves_roadtypes", ["mvsRoadTypeID"]),
+        ("moves_sut", ["sourceUseTypeID"]),
+        ("moves_ft", ["fuelTypeID"]),
+        ("act_lab", ["actTypeABB"]),
+    ],
+    "emis": [
+        ("emisprc", ["processID"]),
+        ("area_rdtype", ["area", "funcClassID", "areaTypeID"]),
+        ("moves_roadtypes", ["mvsRoadTypeID"]),
+        ("moves_sut", ["sourceUseTypeID"]),
+        ("moves_ft", ["fuelTypeID"]),
+        ("pollutants", ["pollutantID"]),
+    ],
+}
+# Labels derived from the dimension labels, with the dimensions they need.
+DERIVED_LABELS = {"sutFtLabel": ("moves_sut", "moves_ft")}
+# Dimension label columns that are not in the detailed data.
+HIDDEN_LABELS = {"emisprc": ["processName"]}
+
+
+def fact_columns(key):
+    """
+    Get the columns of a fact table: the index columns, the SCC, and the measure.
+
+    Parameters
+    ----------
+    key : str
+        "act" or "emis".
+
+    Returns
+    -------
+    list
+        The fact table columns.
+    """
+    columns = settings[COLUMNS_KEYS[key]]
+    return columns["idx"] + ["sccNEI"] + columns["values"]
+
+
+def fact_table(df, key):
+    """
+    Get the fact table of detailed activity or emission data.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The detailed activity or emission data.
+    key : str
+        "act" or "emis".
+
+    Returns
+    -------
+    pd.DataFrame
+        The fact table.
+    """
+    return df.filter(items=fact_columns(key))
+
+
+def star_paths(star_dir, dims=()):
+    """
+    Get the file paths of a star schema.
+
+    Parameters
+    ----------
+    star_dir : str or Path
+        The star schema directory.
+    dims : iterable, optional
+        The dimension names. Default is none.
+
+    Returns
+    -------
+    dict
+        The fact table paths by key ("act", "emis") and the dimension table paths by
+        dimension name.
+    """
+    star_dir = Path(star_dir)
+    paths = {key: star_dir.joinpath(fi) for key, fi in FACT_FIS.items()}
+    paths.update({name: star_dir.joinpath(f"dim_{name}.csv") for name in dims})
+    return paths
+
+
+def write_dims(dims, star_dir):
+    """
+    Write the dimension tables of a star schema.
+
+    Parameters
+    ----------
+    dims : dict
+        The dimension DataFrames by name: the label tables from `get_labels` and the
+        road type mapping ("area_rdtype").
+    star_dir : str or Path
+        The star schema directory.
+
+    Returns
+    -------
+    list
+        The dimension table paths.
+    """
+    Path(star_dir).mkdir(parents=True, exist_ok=True)
+    paths = star_paths(star_dir, dims)
+    for name, df in dims.items():
+        df.to_csv(paths[name], index=False)
+    return [paths[name] for name in dims]
+
+
+def write_star_schema(act_emis_dict, dims, star_dir):
+    """
+    Write detailed activity and emission data as a star schema.
+
+    Parameters
+    ----------
+    act_emis_dict : dict
+        The detailed activity ("act") and emission ("emis") data.
+    dims : dict
+        The dimension DataFrames by name (see `write_dims`).
+    star_dir : str or Path
+        The star schema directory.
+
+    Returns
+    -------
+    list
+        The fact and dimension table paths.
+    """
+    dim_fis = write_dims(dims, star_dir)
+    paths = star_paths(star_dir)
+    for key in FACT_FIS:
+        fact_table(act_emis_dict[key], key).to_csv(paths[key], index=False)
+    return [paths[key] for key in FACT_FIS] + dim_fis
+
+
+def load_star_schema(star_dir, keys=("act", "emis"), labels=None):
+    """
+    Load the fact tables of a star schema and rejoin them with the dimension
+    tables.
+
+    Parameters
+    ----------
+    star_dir : str or Path
+        The star schema directory.
+    keys : iterable, optional
+        The fact tables to load, "act" and/or "emis". Default is both.
+    labels : list, optional
+        The label columns to add (e.g., ["pollutant", "mvsRoadType"]); only the
+        dimensions providing them are joined. Default is None: all the labels, giving
+        the same data as the detailed CSV files.
+
+    Returns
+    -------
+    dict
+        The activity and/or emission data by key.
+    """
+    paths = star_paths(star_dir)
+    dims = {}
+    act_emis_dict = {}
+    for key in keys:
+        if labels is None:
+            columns = [
+                col for cols in settings[COLUMNS_KEYS[key]].values() for col in cols
+            ]
+        else:
+            columns = fact_columns(key) + list(labels)
+        for name, _ in DIMS[key]:
+            if name not in dims:
+                dims[name] = pd.read_csv(star_paths(star_dir, [name])[name]).drop(
+                    columns=HIDDEN_LABELS.get(name, [])
+                )
+        # Dimensions providing the labels, and those they are joined through.
+        needed = set()
+        for label in columns:
+            needed.update(DERIVED_LABELS.get(label, ()))
+        for name, on in DIMS[key]:
+            if set(dims[name].columns).difference(on) & set(columns):
+                needed.add(name)
+        if "moves_roadtypes" in needed:
+            needed.add("area_rdtype")
+        df = pd.read_csv(paths[key])
+        for name, on in DIMS[key]:
+            if name in needed:
+                df = df.merge(dims[name], on=on, how="left")
+        if "sutFtLabel" in columns:
+            df = df.assign(sutFtLabel=lambda df: df.sutLab + "_" + df.ftLab)
+        act_emis_dict[key] = df.filter(items=list(dict.fromkeys(columns)))
+    return act_emis_dict
@@ -0,0 +1,81 @@
+"""
+Test the float64 sums of the measures stored as float32 and the validation of the
+measure storage dtype.
+
+To run the tests, use pytest.
+"""
+import pytest
+import numpy as np
+import pandas as pd
+
+from ttionroadei.csvxmlpostprc.csvxmlgen import (
+    MEASURE_DTYPES,
+    make_csvxmlgen,
+    store_measures,
+    sum_by,
+)
+
+IDX = ["FIPS", "sccNEI", "pollutantCode"]
+# Storing a measure as float32 rounds it by at most 2**-24 relative, about 6e-8.
+# Summed in float64, the sums of positive measures keep that relative error.
+FLOAT32_RTOL = 1e-7
+
+
+@pytest.fixture(scope="module")
+def emis_df():
+    """Detailed emission data with many rows per key, spanning magnitudes."""
+    rng = np.random.default_rng(0)
+    n_rows = 100_000
+    return pd.DataFrame(
+        {
+            "FIPS": rng.choice([48001, 48003, 48005], n_rows),
+            "sccNEI": rng.choice(["2201210080", "2202610080"], n_rows),
+            "pollutantCode": rng.choice(["CO", "NOx", "PM10"], n_rows),
+            "emission": rng.random(n_rows) * rng.choice([1e-6, 1.0, 1e6], n_rows),
+        }
+    )
+
+
+def test_sum_by_float64(emis_df):
+    """Test that float64 sums equal the sums of a groupby."""
+    pd.testing.assert_frame_equal(
+        sum_by(emis_df, IDX, "emission"),
+        emis_df.groupby(IDX, as_index=False)["emission"].sum(),
+        check_exact=True,
+    )
+
+
+def test_sum_by_float32(emis_df):
+    """Test that float32 measures are summed in float64 within the tolerance."""
+    float32_df = emis_df.astype({"emission": "float32"})
+    result = sum_by(float32_df, IDX, "emission")
+    expected = sum_by(emis_df, IDX, "emission")
+    assert result.emission.dtype == "float64"
+    pd.testing.assert_frame_equal(result[IDX], expected[IDX])
+    np.testing.assert_allclose(result.emission, expected.emission, rtol=FLOAT32_RTOL)
+
+
+def test_store_measures(emis_df):
+    """Test that the measures are cast to the storage dtype."""
+    act_emis_dict = {
+        "act": pd.DataFrame({"activity": [1.0, 2.0]}),
+        "emis": emis_df.copy(),
+    }
+    store_measures(act_emis_dict, "float32")
+    assert act_emis_dict["act"].activity.dtype == "float32"
+    assert act_emis_dict["emis"].emission.dtype == "float32"
+
+
+@pytest.mark.parametrize("measure_dtype", MEASURE_DTYPES)
+def test_measure_dtype(job_params, make_gui, measure_dtype):
+    """Test that the known measure dtypes are accepted."""
+    ppgui = make_gui(job_params(), measure_dtype=measure_dtype)
+    assert make_csvxmlgen(ppgui).measure_dtype == measure_dtype
+
+
+@pytest.mark.parametrize("measure_dtype", ["float16", "float", "int64"])
+def test_unknown_measure_dtype(job_params, make_gui, measure_dtype):
+    """Test that an unknown measure dtype is rejected."""
+    ppgui = make_gui(job_params(), measure_dtype=measure_dtype)
+    with pytest.raises(ValueError, match="Unknown measure dtype"):
+        make_csvxmlgen(ppgui)
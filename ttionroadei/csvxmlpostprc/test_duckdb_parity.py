@@ -0,0 +1,119 @@
+"""
+Test that the DuckDB backend of the CsvXmlGen transformations gives the same data as
+the pandas backend.
+
+The tests run both backends with the EMS, RF, and TEC inventories. Rows are compared
+after sorting by the index columns where the backends order them differently, and
+values within a relative tolerance of 1e-12 (sums can differ in the last bits).
+
+To run the tests, use pytest.
+"""
+import pytest
+import numpy as np
+
+from ttionroadei.utils import settings
+from ttionroadei.csvxmlpostprc.csvxmlgen import CsvXmlGen, make_csvxmlgen
+
+pytest.importorskip("duckdb")
+
+EIS = ("EMS", "RF", "TEC")
+RTOL = 1e-12
+
+
+@pytest.fixture(scope="module")
+def outputs(job_params, make_gui, synthetic_area):
+    """Run the ingest, label, aggregate, and SCC steps with both backends."""
+    outputs = {}
+    for backend in ("pandas", "duckdb"):
+        ppgui = make_gui(
+            job_params(
+                EIs=EIS,
+                FIPSs_selected=synthetic_area["FIPSs"][:1],
+                csvxml_backend=backend,
+            )
+        )
+        csvxmlgen = make_csvxmlgen(ppgui)
+        ingested = csvxmlgen.ingest()
+        labelled = csvxmlgen.add_labs(ingested)
+        outputs[backend] = {
+            "csvxmlgen": csvxmlgen,
+            "ingest": ingested,
+            "label": labelled,
+            "aggregate": csvxmlgen.aggxlsxgen(labelled),
+            "scc": csvxmlgen.aggsccgen(
+                labelled,
+                ppgui.xml_pollutant_codes_selected,
+                ppgui.xml_year_selected,
+                ppgui.xml_season_selected,
+                ppgui.xml_daytype_selected,
+            ),
+            "scc_all": csvxmlgen.aggsccgen(
+                labelled, ppgui.xml_pollutant_codes_selected
+            ),
+        }
+    return outputs
+
+
+def sort_rows(df, keys):
+    """Sort the rows and columns of a DataFrame."""
+    return (
+        df.sort_values(keys).reset_index(drop=True).reindex(columns=sorted(df.columns))
+    )
+
+
+def assert_frames_match(pd_df, db_df):
+    """
+    Assert that two DataFrames have the same columns, dtypes, and values, with the
+    floats within the relative tolerance.
+    """
+    assert list(pd_df.columns) == list(db_df.columns)
+    assert pd_df.dtypes.equals(db_df.dtypes)
+    assert len(pd_df) == len(db_df)
+    for col in pd_df.columns:
+        if pd_df[col].dtype.kind == "f":
+            np.testing.assert_allclose(
+                db_df[col].values, pd_df[col].values, rtol=RTOL, err_msg=col
+            )
+        else:
+            assert pd_df[col].equals(db_df[col]), col
+
+
+def test_backend_class(outputs):
+    """Test that each backend creates its CsvXmlGen."""
+    assert type(outputs["pandas"]["csvxmlgen"]) is CsvXmlGen
+    assert type(outputs["duckdb"]["csvxmlgen"]).__name__ == "DuckDBCsvXmlGen"
+
+
+@pytest.mark.parametrize("key", ["act", "emis"])
+def test_ingest_parity(outputs, key):
+    """Test the ingested activity and emission data, in any row order."""
+    pd_df = outputs["pandas"]["ingest"][key]
+    db_df = outputs["duckdb"]["ingest"][key]
+    keys = [col for col in sorted(pd_df.columns) if col not in ("activity", "emission")]
+    assert_frames_match(sort_rows(pd_df, keys), sort_rows(db_df, keys))
+
+
+@pytest.mark.parametrize("key", ["act", "emis"])
+def test_label_parity(outputs, key):
+    """Test the detailed activity and emission data, in any row order."""
+    pd_df = outputs["pandas"]["label"][key]
+    db_df = outputs["duckdb"]["label"][key]
+    columns_key = "csvxml_act" if key == "act" else "csvxml_ei"
+    keys = [col for col in settings[columns_key]["idx"] if col in pd_df.columns]
+    assert_frames_match(sort_rows(pd_df, keys), sort_rows(db_df, keys))
+
+
+def test_aggregate_parity(outputs):
+    """Test the aggregate tables, including their row order."""
+    pd_aggs = outputs["pandas"]["aggregate"]
+    db_aggs = outputs["duckdb"]["aggregate"]
+    assert list(pd_aggs) == list(db_aggs)
+    for aggtype, val in pd_aggs.items():
+        for key in ("act", "emis"):
+            assert_frames_match(val[key], db_aggs[aggtype][key])
+
+
+@pytest.mark.parametrize("scc_key", ["scc", "scc_all"])
+def test_scc_parity(outputs, scc_key):
+    """Test the XML staging tables, including their row order."""
+    assert_frames_match(outputs["pandas"][scc_key], outputs["duckdb"][scc_key])
@@ -0,0 +1,113 @@
+"""
+Test the county byte-offset index of the main module outputs: reading the rows of
+counties through the index, the index location, and the rebuild of a stale index.
+
+The tests use a small synthetic tab-delimited output grouped by county and hour.
+
+To run the tests, use pytest.
+"""
+import logging as lg
+import os
+import pytest
+import numpy as np
+import pandas as pd
+
+from ttionroadei.csvxmlpostprc.fileindex import (
+    INDEX_SUFFIX,
+    build_index,
+    get_index,
+    index_path,
+    load_index,
+    read_counties,
+)
+from ttionroadei.csvxmlpostprc.readers import read_delimited
+
+FIPSS = [48001, 48003, 48005]
+
+
+def write_output(path, FIPSs, seed=0):
+    """Write a synthetic emission output grouped by county and hour."""
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_product(
+        [FIPSs, [1, 2, 3], [11, 21], [2, 3]],
+        names=["County", "Hour", "SUT", "Pollutant"],
+    )
+    df = index.to_frame(index=False).assign(
+        VMT_Emission=rng.random(len(index)), Unit="grams"
+    )
+    df.to_csv(path, sep="\t", index=False)
+    return path
+
+
+@pytest.fixture
+def output_fi(tmp_path):
+    """Synthetic emission output of three counties."""
+    return write_output(tmp_path.joinpath("emission_output_VMT.txt"), FIPSS)
+
+
+def full_read(path, FIPSs):
+    """Rows of counties from a full read of a file."""
+    df = read_delimited(path, sep="\t")
+    return df.loc[df.County.isin(FIPSs)].reset_index(drop=True)
+
+
+@pytest.mark.parametrize("FIPSs", [[48001], [48003], [48001, 48005], FIPSS, [48999]])
+def test_read_counties_equals_full_read(output_fi, tmp_path, FIPSs):
+    """Test that reading through the index equals a full read filtered by county."""
+    index_dir = tmp_path.joinpath("index")
+    df, n_bytes = read_counties(output_fi, FIPSs, index_dir=index_dir)
+    pd.testing.assert_frame_equal(
+        df.reset_index(drop=True), full_read(output_fi, FIPSs), check_dtype=False
+    )
+    assert n_bytes <= os.path.getsize(output_fi)
+    assert load_index(output_fi, index_dir)["grouped"]
+
+
+def test_index_dir(output_fi, tmp_path):
+    """Test that an index directory keeps the input directory untouched."""
+    index_dir = tmp_path.joinpath("index")
+    read_counties(output_fi, [48003], index_dir=index_dir)
+    assert not index_path(output_fi).exists()
+    assert [fi.name for fi in index_dir.iterdir()] == [
+        index_path(output_fi, index_dir).name
+    ]
+    other_fi = tmp_path.joinpath("other", output_fi.name)
+    other_fi.parent.mkdir()
+    assert index_path(other_fi, index_dir) != index_path(output_fi, index_dir)
+    assert index_path(output_fi, index_dir).name.endswith(INDEX_SUFFIX)
+
+
+def test_stale_index_size(output_fi, tmp_path):
+    """Test that an index of a file whose size changed is rebuilt."""
+    index_dir = tmp_path.joinpath("index")
+    get_index(output_fi, index_dir=index_dir)
+    write_output(output_fi, FIPSS + [48007], seed=1)
+    assert load_index(output_fi, index_dir) is None
+    df, _ = read_counties(output_fi, [48003, 48007], index_dir=index_dir)
+    pd.testing.assert_frame_equal(
+        df.reset_index(drop=True),
+        full_read(output_fi, [48003, 48007]),
+        check_dtype=False,
+    )
+    assert load_index(output_fi, index_dir)["size"] == os.path.getsize(output_fi)
+
+
+def test_stale_index_mtime(output_fi, tmp_path):
+    """Test that an index of a file whose modification time changed is rebuilt."""
+    index_dir = tmp_path.joinpath("index")
+    index = get_index(output_fi, index_dir=index_dir)
+    mtime_ns = index["mtime_ns"] + 10**9
+    os.utime(output_fi, ns=(mtime_ns, mtime_ns))
+    assert load_index(output_fi, index_dir) is None
+    assert get_index(output_fi, index_dir=index_dir)["mtime_ns"] == mtime_ns
+    assert load_index(output_fi, index_dir)["mtime_ns"] == mtime_ns
+
+
+def test_save_failure_logged(output_fi, tmp_path, caplog):
+    """Test that an index that cannot be saved is returned and the failure logged."""
+    index_dir = tmp_path.joinpath("not_a_dir")
+    index_dir.write_text("")
+    with caplog.at_level(lg.WARNING):
+        index = build_index(output_fi, index_dir=index_dir)
+    assert index["grouped"]
+    assert "Could not save the county index" in caplog.text
@@ -0,0 +1,134 @@
+"""
+Test the incremental post-processing: a run appending new counties or a new season
+to the outputs of an earlier run gives the outputs of a full run, with the wide and
+the star detailed formats.
+
+The MOVES3 utility outputs have one season per run, so the outputs of a full run over
+two seasons are the merged outputs of a full run per season.
+
+To run the tests, use pytest.
+"""
+import shutil
+from pathlib import Path
+import pytest
+import pandas as pd
+
+from ttionroadei.csvxmlpostprc.incremental import (
+    AGG_SCENARIO_COLS,
+    partition_selections,
+)
+from ttionroadei.csvxmlpostprc.sharding import merge_scc_tables
+from ttionroadei.csvxmlpostprc.starschema import load_star_schema
+
+DETAILED_KEYS = {"act": "act_out_fi", "emis": "emis_out_fi"}
+
+
+def csv_lines(fi):
+    """Header and rows of a CSV file."""
+    with open(fi, "r") as f:
+        return f.readline(), f.readlines()
+
+
+def sorted_rows(df):
+    """Rows sorted by all the columns."""
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def assert_detailed_equal(params, expected_params):
+    """
+    Assert that the detailed outputs of a run have the rows of the detailed CSV
+    files of other runs.
+    """
+    for key, out_key in DETAILED_KEYS.items():
+        expected_lines = [csv_lines(fi[out_key]) for fi in expected_params]
+        if params.get("detailed_format") == "star":
+            result = load_star_schema(params["star_out_dir"], keys=[key])[key]
+            expected = pd.concat(
+                [pd.read_csv(fi[out_key], low_memory=False) for fi in expected_params]
+            )
+            assert list(result.columns) == list(expected.columns)
+            assert sorted_rows(result).equals(sorted_rows(expected))
+        else:
+            header, rows = csv_lines(params[out_key])
+            assert header == expected_lines[0][0]
+            assert sorted(rows) == sorted(
+                row for _, expected_rows in expected_lines for row in expected_rows
+            )
+
+
+def read_tables(params):
+    """Aggregate tables and XML staging table of a run."""
+    return {
+        "scc": pd.read_csv(params["xmlscc_csv_out_fi"], dtype={"sccNEI": str}),
+        "sheets": pd.read_excel(params["agg_tab_out_fi"], sheet_name=None),
+    }
+
+
+def assert_tables_equal(result, expected):
+    """Assert that the aggregate tables and XML staging tables are the same."""
+    pd.testing.assert_frame_equal(result["scc"], expected["scc"])
+    assert list(result["sheets"]) == list(expected["sheets"])
+    for sheet, df in expected["sheets"].items():
+        pd.testing.assert_frame_equal(result["sheets"][sheet], df, obj=sheet)
+
+
+def incremental_rows(records):
+    """Rows ingested and labelled by the incremental processing."""
+    return next(rec for rec in records if rec["stage"] == "incremental")["rows_out"]
+
+
+@pytest.mark.parametrize("detailed_format", ["wide", "star"])
+def test_new_county(full_run, job_params, run_job, detailed_format):
+    """Test that appending a county to an earlier run equals a full run."""
+    full_params = full_run[0]
+    params = job_params(xml_all_scenarios=True, detailed_format=detailed_format)
+    run_job(params, FIPSs_selected=params["FIPSs_selected"][:1])
+    records = run_job(params, incremental=True)
+    assert_detailed_equal(params, [full_params])
+    assert_tables_equal(read_tables(params), read_tables(full_params))
+    new_fips = params["FIPSs_selected"][1]
+    new_rows = sum(
+        (pd.read_csv(full_params[out_key], usecols=["FIPS"]).FIPS == new_fips).sum()
+        for out_key in DETAILED_KEYS.values()
+    )
+    assert incremental_rows(records) == new_rows
+
+
+def test_new_season(full_run, job_params, run_job):
+    """Test that appending a season to an earlier run equals a full run."""
+    full_params = full_run[0]
+    winter_params = job_params(xml_all_scenarios=True, seasons_selected=["w"])
+    run_job(winter_params)
+    params = job_params(
+        xml_all_scenarios=True, seasons_selected=["s", "w"], incremental=True
+    )
+    # The earlier run of season "s" is the full run.
+    Path(params["summary_dir"]).mkdir(parents=True)
+    for out_key in [*DETAILED_KEYS.values(), "xmlscc_csv_out_fi", "agg_tab_out_fi"]:
+        shutil.copyfile(full_params[out_key], params[out_key])
+    records = run_job(params)
+    assert_detailed_equal(params, [full_params, winter_params])
+    season_tables = [read_tables(full_params), read_tables(winter_params)]
+    expected = {
+        "scc": merge_scc_tables([tables["scc"] for tables in season_tables]),
+        "sheets": {
+            sheet: pd.concat([tables["sheets"][sheet] for tables in season_tables])
+            .sort_values(AGG_SCENARIO_COLS[sheet.rsplit("_", 1)[1]], kind="mergesort")
+            .reset_index(drop=True)
+            for sheet in season_tables[0]["sheets"]
+        },
+    }
+    assert_tables_equal(read_tables(params), expected)
+    # Only the new season is ingested.
+    new_rows = sum(
+        len(csv_lines(winter_params[out_key])[1]) for out_key in DETAILED_KEYS.values()
+    )
+    assert incremental_rows(records) == new_rows
+
+
+def test_partition_selections():
+    """Test that the selections are restricted to the values of the partitions."""
+    partitions = {("2020", "w", "wkd", "48001"), ("2020", "s", "wkd", "48003")}
+    assert partition_selections(
+        partitions, [2019, 2020], ["s", "w", "f"], ["wkd", "wke"], [48001, 48003, 48005]
+    ) == ([2020], ["s", "w"], ["wkd"], [48001, 48003])
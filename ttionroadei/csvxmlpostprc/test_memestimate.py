@@ -0,0 +1,66 @@
+"""
+Test the peak memory estimate: the estimated detailed rows against those of the full
+run, and the number of shards planned for a memory budget.
+
+To run the tests, use pytest.
+"""
+import pytest
+
+from ttionroadei.csvxmlpostprc.csvxmlgen import make_csvxmlgen
+from ttionroadei.csvxmlpostprc.memestimate import estimate_peak_memory, probe_rows
+
+# Relative tolerance of the estimated rows.
+ROWS_RTOL = 0.05
+
+
+def count_rows(fi):
+    """Number of rows of a CSV file."""
+    with open(fi, "r") as f:
+        return sum(1 for _ in f) - 1
+
+
+def test_probe_rows(tmp_path):
+    """Test that the rows of a file are estimated from the probed rows."""
+    path = tmp_path.joinpath("raw.txt")
+    with open(path, "w") as f:
+        f.write("countyID\tvalue\n")
+        for i in range(10_000):
+            f.write(f"{48001 + 2 * (i % 3)}\t{i % 97}.5\n")
+    header, rows, n_rows = probe_rows(path)
+    assert header == ["countyID", "value"]
+    assert len(rows) == 256
+    assert all(len(row) == 2 for row in rows)
+    assert n_rows == pytest.approx(10_000, rel=ROWS_RTOL)
+
+
+@pytest.mark.parametrize("n_counties", [1, 2])
+def test_estimated_rows(full_run, make_gui, n_counties):
+    """Test that the estimated detailed rows are close to those of the full run."""
+    params = full_run[0]
+    FIPSs = params["FIPSs_selected"][:n_counties]
+    csvxmlgen = make_csvxmlgen(make_gui(params, FIPSs_selected=FIPSs))
+    estimate = estimate_peak_memory(csvxmlgen)
+    # The synthetic counties have the same number of rows.
+    share = n_counties / len(params["FIPSs_selected"])
+    for key, out_key in [("act_rows", "act_out_fi"), ("emis_rows", "emis_out_fi")]:
+        expected = count_rows(params[out_key]) * share
+        assert estimate[key] == pytest.approx(expected, rel=ROWS_RTOL)
+
+
+def plan_shards(make_gui, params, memory_budget):
+    """Number of shards planned for a memory budget, and the memory estimate."""
+    ppgui = make_gui(params, memory_budget=memory_budget, shard_n_workers=1)
+    estimate = ppgui.plan_memory(make_csvxmlgen(ppgui))
+    return ppgui.n_shards, estimate
+
+
+def test_plan_memory(full_run, make_gui):
+    """Test that the shards are increased to fit the memory budget."""
+    params = full_run[0]
+    assert plan_shards(make_gui, params, None) == (1, None)
+    n_shards, estimate = plan_shards(make_gui, params, 1000)
+    assert n_shards == 1
+    peak_gb = estimate["peak_bytes"] / 2**30
+    assert plan_shards(make_gui, params, peak_gb * 0.75)[0] == 2
+    # At most one county per shard.
+    assert plan_shards(make_gui, params, 1e-6)[0] == len(params["FIPSs_selected"])
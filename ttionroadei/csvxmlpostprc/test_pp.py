@@ -30,8 +30,8 @@ import pandas as pd
 from pathlib import Path
 from itertools import chain
 import numpy as np
-import lxml
 from ttionroadei.utils import settings
+from ttionroadei.csvxmlpostprc.xmlreader import read_cers_xml
 
 # Todo: User to update the following for testing.
 log_dir = Path("./logs")
@@ -244,64 +244,9 @@ emis_sheets = [sheet for sheet in x1.sheet_names if sheet.split("_")[1] == "emis
 #######################################################################################
 
 
-def read_xml(
-    path_xml=pp_param["xmlscc_xml_out_fi"],
-    ns={
-        "cer": "http://www.exchangenetwork.net/schema/cer/2",
-        "hdr": "http://www.exchangenetwork.net/schema/header/2",
-        "xsi": "http://www.w3.org/2001/XMLSchema-instance",
-    },
-):
-    parser = lxml.etree.XMLParser(remove_blank_text=True)
-    tree = lxml.etree.parse(str(path_xml), parser)
-    rt = tree.getroot()
-    ns = rt.nsmap
-    cntyelems = rt.findall(".//cer:StateAndCountyFIPSCode", ns)
-    pollutantCode, emission, sccNEI, FIPS, E6MILE = [], [], [], [], []
-    for cntyelem in cntyelems:
-        for rptper in cntyelem.getparent().findall(
-            ".//cer:ReportingPeriodEmissions", ns
-        ):
-            poltmp = [rptper.find("cer:PollutantCode", ns).text]
-            emistmp = [float(rptper.find("cer:TotalEmissions", ns).text)]
-            cntystmp = [
-                int(
-                    rptper.getparent()
-                    .getparent()
-                    .getparent()
-                    .find(".//cer:StateAndCountyFIPSCode", ns)
-                    .text
-                )
-            ]
-            sccstmp = [
-                int(
-                    rptper.getparent()
-                    .getparent()
-                    .find(".//cer:SourceClassificationCode", ns)
-                    .text
-                )
-            ]
-            vmttmp = [
-                float(
-                    rptper.getparent().find(".//cer:CalculationParameterValue", ns).text
-                )
-            ]
-            pollutantCode += list(poltmp)
-            emission += list(emistmp)
-            sccNEI += list(sccstmp)
-            FIPS += list(cntystmp)
-            E6MILE += list(vmttmp)
-
-    daxml = pd.DataFrame(
-        dict(
-            sccNEI=sccNEI,
-            FIPS=FIPS,
-            E6MILE=E6MILE,
-            pollutantCode=pollutantCode,
-            emission=emission,
-        )
-    )
-    return daxml
+def read_xml(path_xml=pp_param["xmlscc_xml_out_fi"]):
+    """Read the XML generated by the post-processor into a DataFrame."""
+    return read_cers_xml(path_xml)
 
 
 # Test
@@ -0,0 +1,118 @@
+"""
+Test the pre-flight validation of the post-processing selections: every failure
+message, with the key columns scanned from the whole files or read through the
+county index.
+
+To run the tests, use pytest.
+"""
+import pytest
+import pandas as pd
+
+from ttionroadei.GUI import PostProcessorGUI
+from ttionroadei.csvxmlpostprc import preflight
+from ttionroadei.csvxmlpostprc.csvxmlgen import make_csvxmlgen
+from ttionroadei.csvxmlpostprc.preflight import preflight_problems
+
+
+@pytest.fixture(scope="module")
+def params(job_params, synthetic_area):
+    """Parameters of a synthetic run of the first of two counties."""
+    return job_params(FIPSs_selected=synthetic_area["FIPSs"][:1])
+
+
+@pytest.fixture(params=[False, True], ids=["scan", "index"])
+def csvxmlgen(request, params, make_gui):
+    """CsvXmlGen of the valid selections, without and with the county index."""
+    return make_csvxmlgen(make_gui(params, use_fips_index=request.param))
+
+
+def test_preflight_is_opt_in(params):
+    """Test that the pre-flight checks are off by default."""
+    ppgui = PostProcessorGUI(ei_base_dir=None, log_dir=params["log_dir"])
+    assert ppgui.preflight is False
+
+
+def test_run_stops_before_ingest(params, make_gui):
+    """Test that a run with the pre-flight checks stops on a problem before ingest."""
+    ppgui = make_gui(
+        params, preflight=True, FIPSs_selected=[*params["FIPSs_selected"], 48999]
+    )
+    with pytest.raises(ValueError, match="Pre-flight checks failed"):
+        ppgui.run_pp()
+    assert [record["stage"] for record in ppgui.metrics.records] == [
+        "preflight",
+        "run_pp",
+    ]
+
+
+def test_valid_selections(csvxmlgen):
+    """Test that valid selections pass."""
+    assert preflight_problems(csvxmlgen) == []
+
+
+def test_missing_county(csvxmlgen):
+    """Test that a county missing from the outputs is reported for every file."""
+    csvxmlgen.FIPSs_selected = [*csvxmlgen.FIPSs_selected, 48999]
+    problems = preflight_problems(csvxmlgen)
+    n_files = len(csvxmlgen.act_fis) - 1 + len(csvxmlgen.ei_fis["EMS"])
+    missing = [problem for problem in problems if "has no data" in problem]
+    assert len(missing) == n_files
+    assert all(problem.endswith("for the counties [48999].") for problem in missing)
+    assert "Counties [48999] are not in the county labels." in problems
+
+
+def test_missing_pollutant(csvxmlgen):
+    """Test that a pollutant missing from the emission outputs is reported."""
+    csvxmlgen.outpollutants = pd.concat(
+        [
+            csvxmlgen.outpollutants,
+            pd.DataFrame({"pollutantCode": ["SO2"], "pollutantID": [31]}),
+        ]
+    )
+    assert preflight_problems(csvxmlgen) == [
+        "MOVES pollutantID 31 (pollutant codes ['SO2']) is not in the emission "
+        "outputs of ['EMS']."
+    ]
+
+
+def test_unit_without_factor(csvxmlgen):
+    """Test that a unit of the selected pollutants without a factor is reported."""
+    factor = csvxmlgen.conversion_factor
+    csvxmlgen.conversion_factor = factor.loc[factor.input_units != "grams"]
+    problems = preflight_problems(csvxmlgen)
+    assert len(problems) == 1
+    assert problems[0].startswith(
+        "The units ['grams'] of the selected pollutants in the utilities output "
+        "have no conversion factor"
+    )
+
+
+def test_unmapped_road_type(csvxmlgen):
+    """Test that an unmapped area and road type combination is reported."""
+    rdtype_df = csvxmlgen.area_rdtype_df
+    combo = tuple(rdtype_df[["areaTypeID", "funcClassID"]].astype(int).iloc[0])
+    csvxmlgen.area_rdtype_df = rdtype_df.loc[
+        (rdtype_df.areaTypeID.astype(int) != combo[0])
+        | (rdtype_df.funcClassID.astype(int) != combo[1])
+    ]
+    problems = preflight_problems(csvxmlgen)
+    assert len(problems) == 1
+    assert problems[0].startswith(
+        f"The (areaTypeID, funcClassID) combinations [{combo}] are not in the road "
+        "type mapping."
+    )
+
+
+def test_index_skips_scan(params, make_gui, monkeypatch):
+    """Test that the files grouped by county are not scanned with the index."""
+    ppgui = make_gui(params, use_fips_index=True)
+    scanned = []
+    scan_keys = preflight.scan_keys
+    monkeypatch.setattr(
+        preflight,
+        "scan_keys",
+        lambda path, *args, **kwargs: scanned.append(path)
+        or scan_keys(path, *args, **kwargs),
+    )
+    assert preflight_problems(make_csvxmlgen(ppgui)) == []
+    assert scanned == []
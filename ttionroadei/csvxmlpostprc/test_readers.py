@@ -0,0 +1,95 @@
+"""
+Test that the arrow ingestion engine reads the same frames as the pandas engine,
+bit for bit.
+
+The engines read synthetic main module outputs (see
+`ttionroadei.benchmark.synthetic`) and a synthetic table of floats that the Arrow
+and pandas float parsers round differently.
+
+To run the tests, use pytest.
+"""
+import pytest
+import numpy as np
+import pandas as pd
+
+from ttionroadei.benchmark.synthetic import write_synthetic_area
+from ttionroadei.csvxmlpostprc.readers import INFER_BYTES, read_delimited
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture(scope="module")
+def area_data(tmp_path_factory):
+    """Synthetic main module outputs of one county."""
+    return write_synthetic_area(tmp_path_factory.mktemp("readers"), n_counties=1)
+
+
+@pytest.fixture(scope="module")
+def floats_fi(tmp_path_factory):
+    """Table of floats in several notations, larger than the type inference head."""
+    rng = np.random.default_rng(0)
+    n_rows = 200_000
+    values = rng.random(n_rows) * rng.choice([1e-9, 1e-3, 1.0, 1e3, 1e9], n_rows)
+    df = pd.DataFrame(
+        {
+            "County": np.repeat([48001, 48003], n_rows // 2),
+            "Repr": [repr(val) for val in values],
+            "Exp": [f"{val:.17e}" for val in values],
+            "Long": [f"{val:.25f}" for val in values],
+            "Short": [f"{val:.3f}" for val in values],
+            "Missing": np.where(rng.random(n_rows) < 0.1, "", values.astype(str)),
+            "IntMissing": np.where(rng.random(n_rows) < 0.1, "", "7"),
+            "Unit": "grams",
+        }
+    )
+    path = tmp_path_factory.mktemp("readers").joinpath("floats.txt")
+    df.to_csv(path, sep="\t", index=False)
+    assert path.stat().st_size > INFER_BYTES
+    return path
+
+
+def assert_engines_equal(source, columns=None):
+    """Assert that both engines read identical frames."""
+    expected = read_delimited(source, engine="pandas", columns=columns)
+    result = read_delimited(source, engine="arrow", columns=columns)
+    pd.testing.assert_frame_equal(result, expected, check_exact=True)
+
+
+def test_float_parity(floats_fi):
+    """Test that floats the parsers round differently are read identically."""
+    assert_engines_equal(floats_fi)
+
+
+def test_arrow_rounding_differs(floats_fi):
+    """Test that the float table has floats the Arrow parser rounds differently."""
+    from pyarrow import csv as pa_csv
+
+    arrow_df = pa_csv.read_csv(
+        floats_fi, parse_options=pa_csv.ParseOptions(delimiter="\t")
+    ).to_pandas()
+    pandas_df = read_delimited(floats_fi, engine="pandas")
+    assert (arrow_df.Long != pandas_df.Long).any()
+
+
+def test_projected_columns(floats_fi):
+    """Test that both engines read the projected columns in file order."""
+    assert_engines_equal(floats_fi, columns=["Unit", "Short", "County", "Absent"])
+
+
+def test_bytes_source(floats_fi):
+    """Test that both engines read the bytes of a table identically."""
+    data = floats_fi.read_bytes()
+    assert_engines_equal(data[: data.index(b"\n", INFER_BYTES // 2) + 1])
+
+
+@pytest.mark.parametrize("key", ["act_fis", "ei_fis_EMS"])
+def test_main_module_outputs(area_data, key):
+    """Test that both engines read the main module outputs identically."""
+    for path in area_data[key].values():
+        assert_engines_equal(path)
+
+
+def test_unknown_engine(floats_fi):
+    """Test that an unknown engine is rejected."""
+    with pytest.raises(ValueError):
+        read_delimited(floats_fi, engine="polars")
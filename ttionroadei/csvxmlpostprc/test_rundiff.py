@@ -0,0 +1,132 @@
+"""
+Test the keyed differences between the outputs of two post-processing runs on small
+synthetic detailed outputs and aggregate table workbooks.
+
+To run the tests, use pytest.
+"""
+import json
+import pytest
+import numpy as np
+import pandas as pd
+
+from ttionroadei.csvxmlpostprc.rundiff import (
+    DIFF_KEYS,
+    diff_frames,
+    diff_csv,
+    diff_aggregate_tables,
+)
+
+FIPSS = [48001, 48003, 48005]
+SCCS = ["2201210080", "2202610080"]
+POLLUTANT_CODES = ["CO", "NOx"]
+
+
+@pytest.fixture
+def emis_df():
+    """Detailed emission data with two hours of every county, SCC, and pollutant."""
+    rng = np.random.default_rng(0)
+    index = pd.MultiIndex.from_product(
+        [FIPSS, SCCS, POLLUTANT_CODES, [1, 2]],
+        names=["FIPS", "sccNEI", "pollutantCode", "hour"],
+    )
+    return index.to_frame(index=False).assign(
+        area="SYN",
+        year=2020,
+        season="s",
+        dayType="wkd",
+        emissionunits="short_ton",
+        emission=rng.random(len(index)),
+    )
+
+
+def test_diff_frames():
+    """Test the changed, added, and removed keys and the tolerance."""
+    old_df = pd.DataFrame({"key": ["a", "a", "b", "c", "d"], "val": [1, 2, 3, 4, 0]})
+    new_df = pd.DataFrame({"key": ["a", "b", "b", "d", "e"], "val": [3, 6, 0, 1, 5]})
+    old_df["val"] = old_df.val.astype(float)
+    new_df["val"] = new_df.val.astype(float)
+    changes = diff_frames(old_df, new_df, ["key"], "val").set_index("key")
+    assert changes.status.to_dict() == {
+        "b": "changed",
+        "c": "removed",
+        "d": "changed",
+        "e": "added",
+    }
+    assert changes.loc["b", "valOld"] == 3.0
+    assert changes.loc["b", "valNew"] == 6.0
+    assert changes.valChange.to_dict() == {"b": 3.0, "c": -4.0, "d": 1.0, "e": 5.0}
+    assert changes.loc["b", "relChange"] == 1.0
+    # Relative change of a zero old value.
+    assert np.isnan(changes.loc["d", "relChange"])
+    # Sums within the tolerance are the same.
+    new_df.loc[new_df.key == "b", "val"] = [3.0 + 1e-12, 0.0]
+    assert "b" not in diff_frames(old_df, new_df, ["key"], "val").key.values
+
+
+def test_diff_csv_one_key(emis_df, tmp_path):
+    """Test that two runs differing in one key give a report of that key."""
+    old_fi, new_fi = tmp_path.joinpath("old.csv"), tmp_path.joinpath("new.csv")
+    emis_df.to_csv(old_fi, index=False)
+    changed = (emis_df.FIPS == 48003) & (emis_df.sccNEI == SCCS[1])
+    changed &= emis_df.pollutantCode == "NOx"
+    new_df = emis_df.copy()
+    new_df.loc[changed & (new_df.hour == 1), "emission"] += 0.5
+    # A different row order of the same sums does not count as a change.
+    new_df.sample(frac=1, random_state=0).to_csv(new_fi, index=False)
+    out_fi = tmp_path.joinpath("changes.csv")
+    summary = diff_csv(old_fi, new_fi, out_fi, n_partitions=4, chunk_rows=5)
+    assert (summary["changed"], summary["added"], summary["removed"]) == (1, 0, 0)
+    assert summary["rows_old"] == summary["rows_new"] == len(emis_df)
+    assert summary["keys_compared"] == len(FIPSS) * len(SCCS) * len(POLLUTANT_CODES)
+    assert summary["emission_new"] == pytest.approx(summary["emission_old"] + 0.5)
+    changes = pd.read_csv(out_fi, dtype={"sccNEI": str})
+    assert len(changes) == 1
+    assert changes.loc[0, ["FIPS", "sccNEI", "pollutantCode"]].tolist() == [
+        48003,
+        SCCS[1],
+        "NOx",
+    ]
+    assert changes.loc[0, "emissionChange"] == pytest.approx(0.5)
+    assert changes.loc[0, "status"] == "changed"
+    with open(out_fi.with_suffix(".json")) as f:
+        assert json.load(f)["keys"] == DIFF_KEYS["emission"]
+
+
+def test_diff_csv_no_change(emis_df, tmp_path):
+    """Test that identical runs give an empty report."""
+    emis_df.to_csv(tmp_path.joinpath("run.csv"), index=False)
+    out_fi = tmp_path.joinpath("changes.csv")
+    summary = diff_csv(
+        tmp_path.joinpath("run.csv"), tmp_path.joinpath("run.csv"), out_fi
+    )
+    assert (summary["changed"], summary["added"], summary["removed"]) == (0, 0, 0)
+    assert pd.read_csv(out_fi).empty
+
+
+@pytest.mark.parametrize("removed", [True, False], ids=["removed", "added"])
+def test_diff_aggregate_tables_sheet(emis_df, tmp_path, removed):
+    """Test that a sheet of one workbook only is reported as removed or added."""
+    by_county = emis_df.groupby(
+        ["FIPS", "pollutantCode"], as_index=False
+    ).emission.sum()
+    by_scc = emis_df.groupby(["sccNEI", "pollutantCode"], as_index=False).emission.sum()
+    both_fi, one_fi = tmp_path.joinpath("both.xlsx"), tmp_path.joinpath("one.xlsx")
+    with pd.ExcelWriter(both_fi) as writer:
+        by_county.to_excel(writer, sheet_name="county_emis", index=False)
+        by_scc.to_excel(writer, sheet_name="scc_emis", index=False)
+    with pd.ExcelWriter(one_fi) as writer:
+        by_county.to_excel(writer, sheet_name="county_emis", index=False)
+    old_fi, new_fi = (both_fi, one_fi) if removed else (one_fi, both_fi)
+    out_fi = tmp_path.joinpath("changes.csv")
+    summary = diff_aggregate_tables(old_fi, new_fi, out_fi)
+    status = "removed" if removed else "added"
+    assert summary["county_emis"] == {"changed": 0, "added": 0, "removed": 0}
+    assert summary["scc_emis"] == {
+        "changed": 0,
+        "added": 0,
+        "removed": 0,
+        status: len(by_scc),
+    }
+    changes = pd.read_csv(out_fi)
+    assert (changes.sheet == "scc_emis").all()
+    assert (changes.status == status).all()
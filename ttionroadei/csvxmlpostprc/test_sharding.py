@@ -0,0 +1,103 @@
+"""
+Test the sharded post-processing: a run split into shards of counties, processed in
+worker processes and merged, gives the outputs of an unsharded run, and each shard
+reads only the rows of its counties.
+
+To run the tests, use pytest.
+"""
+import os
+import pytest
+import pandas as pd
+
+from ttionroadei.csvxmlpostprc.sharding import SCC_KEYS, merge_scc_tables
+
+
+@pytest.fixture(scope="module")
+def runs(full_run, job_params, run_job):
+    """Parameters and metric records of an unsharded and a 2-shard run."""
+    params = job_params(n_shards=2, shard_n_workers=2, xml_all_scenarios=True)
+    return {"full": full_run, "sharded": (params, run_job(params))}
+
+
+def sorted_lines(fi):
+    """Header and sorted rows of a CSV file."""
+    with open(fi, "r") as f:
+        header = f.readline()
+        return header, sorted(f)
+
+
+@pytest.mark.parametrize("key", ["act_out_fi", "emis_out_fi", "xmlscc_csv_out_fi"])
+def test_sharded_csv_equals_full(runs, key):
+    """Test that the merged CSV outputs have the rows of the unsharded run."""
+    full_params, sharded_params = runs["full"][0], runs["sharded"][0]
+    assert sorted_lines(sharded_params[key]) == sorted_lines(full_params[key])
+
+
+def test_sharded_scc_order_equals_full(runs):
+    """Test that the merged XML staging table is in the unsharded row order."""
+    full_params, sharded_params = runs["full"][0], runs["sharded"][0]
+    full_df = pd.read_csv(full_params["xmlscc_csv_out_fi"])
+    sharded_df = pd.read_csv(sharded_params["xmlscc_csv_out_fi"])
+    pd.testing.assert_frame_equal(sharded_df[SCC_KEYS], full_df[SCC_KEYS])
+
+
+def test_sharded_aggregate_equals_full(runs):
+    """Test that the summed partial aggregates equal the unsharded aggregates."""
+    full_params, sharded_params = runs["full"][0], runs["sharded"][0]
+    full_sheets = pd.read_excel(full_params["agg_tab_out_fi"], sheet_name=None)
+    sharded_sheets = pd.read_excel(sharded_params["agg_tab_out_fi"], sheet_name=None)
+    assert list(sharded_sheets) == list(full_sheets)
+    for sheet, df in full_sheets.items():
+        pd.testing.assert_frame_equal(sharded_sheets[sheet], df, obj=sheet)
+
+
+def test_shard_metrics_in_run(runs):
+    """Test that the worker processes record the shard metrics of the run."""
+    records = runs["sharded"][1]
+    shards = [record["FIPS"] for record in records if record["stage"] == "shard"]
+    assert sorted(shards) == [[fips] for fips in runs["sharded"][0]["FIPSs_selected"]]
+    assert all(record["run_id"] == records[0]["run_id"] for record in records)
+
+
+def test_shards_read_their_counties(runs):
+    """Test that each shard reads only the header and the rows of its counties."""
+    params, records = runs["sharded"]
+    assert not params.get("use_fips_index", False)
+    raw_fis = [fi for cat, fi in params["act_fis"].items() if cat != "TotSHP"]
+    raw_fis += list(params["ei_fis_EMS"].values())
+    for raw_fi in raw_fis:
+        reads = [
+            record
+            for record in records
+            if record["stage"] == "ingest" and record["file"] == raw_fi
+        ]
+        assert len(reads) == 2
+        with open(raw_fi, "rb") as f:
+            header_size = len(f.readline())
+            n_rows = sum(1 for _ in f)
+        # The shards split the rows: each reads the header and its rows.
+        assert sum(read["bytes_read"] for read in reads) == (
+            os.path.getsize(raw_fi) + header_size
+        )
+        assert sum(read["rows_in"] for read in reads) == n_rows
+        assert all(read["rows_in"] < n_rows for read in reads)
+
+
+def test_merge_scc_tables():
+    """Test that the shard XML staging tables are merged in the group order."""
+    df = pd.DataFrame(
+        {
+            "area": "SYN",
+            "year": 2020,
+            "season": "s",
+            "dayType": "wkd",
+            "FIPS": [48003, 48003, 48001, 48001],
+            "sccNEI": ["2202610080", "2201210080", "2202610080", "2201210080"],
+            "pollutantCode": "CO",
+            "emissionunits": "short_ton",
+            "emission": [1.0, 2.0, 3.0, 4.0],
+        }
+    )
+    merged = merge_scc_tables([df.iloc[:2], df.iloc[2:]])
+    assert merged.emission.tolist() == [4.0, 3.0, 2.0, 1.0]
+    assert merged.index.tolist() == [0, 1, 2, 3]
@@ -0,0 +1,140 @@
+"""
+Test the SQLite database of the post-processing outputs: the tables and their rows
+against the output files of the full run, a point query, the indexes, the missing
+values, and the replacement of the database through a temporary file.
+
+To run the tests, use pytest.
+"""
+import sqlite3
+from pathlib import Path
+import pytest
+import pandas as pd
+
+from ttionroadei.csvxmlpostprc import sqlitedb
+from ttionroadei.csvxmlpostprc.sqlitedb import write_sqlite_db
+
+DETAILED_FIS = {"activityDetailed": "act_out_fi", "emissionDetailed": "emis_out_fi"}
+POINT_QUERY = (
+    "SELECT COUNT(*), SUM(emission) FROM emissionDetailed "
+    "WHERE FIPS = ? AND sccNEI = ? AND pollutantCode = ?"
+)
+
+
+@pytest.fixture(scope="module")
+def params(full_run):
+    """Parameters of the full run, writing the SQLite database."""
+    return full_run[0]
+
+
+@pytest.fixture(scope="module")
+def con(params):
+    """Read-only connection to the SQLite database of the full run."""
+    con = sqlite3.connect(f"file:{params['sqlite_out_fi']}?mode=ro", uri=True)
+    yield con
+    con.close()
+
+
+@pytest.fixture(scope="module")
+def sheets(params):
+    """Aggregate tables of the full run."""
+    return pd.read_excel(params["agg_tab_out_fi"], sheet_name=None)
+
+
+def tables(con, type_="table"):
+    """Names of the tables or indexes of a database, without the SQLite ones."""
+    return {
+        name
+        for (name,) in con.execute(
+            "SELECT name FROM sqlite_master WHERE type = ? AND name NOT LIKE 'sqlite_%'",
+            (type_,),
+        )
+    }
+
+
+def count_rows(con, table):
+    """Number of rows of a table."""
+    return con.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+
+
+def test_tables(params, con, sheets, make_gui):
+    """Test that the database has the output tables and the dimension tables."""
+    dims = make_gui(params).dimension_tables()
+    assert tables(con) == {
+        *DETAILED_FIS,
+        *sheets,
+        "xmlSCCStagingTable",
+        *(f"dim_{name}" for name in dims),
+    }
+
+
+def test_row_counts(params, con, sheets):
+    """Test that the tables have the rows of the output files."""
+    for table, out_key in DETAILED_FIS.items():
+        with open(params[out_key], "r") as f:
+            assert count_rows(con, table) == sum(1 for _ in f) - 1
+    for sheet, df in sheets.items():
+        assert count_rows(con, sheet) == len(df)
+    xmlscc = pd.read_csv(params["xmlscc_csv_out_fi"])
+    assert count_rows(con, "xmlSCCStagingTable") == len(xmlscc)
+
+
+def test_point_query(params, con):
+    """Test that a county, SCC, and pollutant query matches the detailed CSV file."""
+    emis = pd.read_csv(params["emis_out_fi"], dtype={"sccNEI": str}, low_memory=False)
+    fips, scc, pollutant = emis.loc[0, ["FIPS", "sccNEI", "pollutantCode"]]
+    expected = emis[
+        (emis.FIPS == fips) & (emis.sccNEI == scc) & (emis.pollutantCode == pollutant)
+    ]
+    n_rows, emission = con.execute(POINT_QUERY, (int(fips), scc, pollutant)).fetchone()
+    assert n_rows == len(expected) > 0
+    assert emission == pytest.approx(expected.emission.sum(), rel=1e-12)
+
+
+def test_indexes(con):
+    """Test that the point query uses the county, SCC, and pollutant index."""
+    index = "ix_emissionDetailed_FIPS_sccNEI_pollutantCode"
+    indexes = tables(con, "index")
+    assert index in indexes
+    assert "ix_activityDetailed_area_year_season_dayType_FIPS" in indexes
+    assert "ix_dim_pollutants_pollutantID" in indexes
+    plan = con.execute(f"EXPLAIN QUERY PLAN {POINT_QUERY}", (0, "", "")).fetchall()
+    assert any(index in row[-1] for row in plan)
+
+
+def test_no_temporary_file(params):
+    """Test that the temporary database is renamed to the database."""
+    out_dir = Path(params["sqlite_out_fi"]).parent
+    assert not list(out_dir.glob("*.tmp"))
+
+
+def test_missing_values(tmp_path):
+    """Test that missing values are stored as NULL."""
+    xmlscc_fi = tmp_path.joinpath("xmlscc.csv")
+    xmlscc_fi.write_text("sccNEI,pollutantCode,emission\n2201210080,CO,\n,NOx,2.5\n")
+    db_fi = tmp_path.joinpath("out.sqlite")
+    assert write_sqlite_db(db_fi, xmlscc_fi=xmlscc_fi) == {"xmlSCCStagingTable": 2}
+    with sqlite3.connect(db_fi) as con:
+        rows = con.execute(
+            "SELECT sccNEI, pollutantCode, emission FROM xmlSCCStagingTable"
+        ).fetchall()
+    con.close()
+    assert rows == [("2201210080", "CO", None), (None, "NOx", 2.5)]
+
+
+def test_failed_load(tmp_path, monkeypatch):
+    """Test that a failed load keeps the previous database and no temporary file."""
+    xmlscc_fi = tmp_path.joinpath("xmlscc.csv")
+    xmlscc_fi.write_text("sccNEI,emission\n2201210080,1.0\n")
+    db_fi = tmp_path.joinpath("out.sqlite")
+    write_sqlite_db(db_fi, xmlscc_fi=xmlscc_fi)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("Simulated failure")
+
+    monkeypatch.setattr(sqlitedb, "insert_frames", fail)
+    with pytest.raises(RuntimeError):
+        write_sqlite_db(db_fi, xmlscc_fi=xmlscc_fi)
+    assert sorted(fi.name for fi in tmp_path.iterdir()) == ["out.sqlite", "xmlscc.csv"]
+    with sqlite3.connect(db_fi) as con:
+        assert count_rows(con, "xmlSCCStagingTable") == 1
+    con.close()
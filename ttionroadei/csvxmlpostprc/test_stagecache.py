@@ -0,0 +1,182 @@
+"""
+Test the stage cache of the post-processing: cache hits, misses, and invalidation by
+the parameters, the stage artifacts, the settings, and the code version, and the
+resume of a failed run.
+
+Each test first runs the post-processing once, so that the cache holds the outputs
+of the unmodified inputs whatever the previous tests changed.
+
+To run the tests, use pytest.
+"""
+import os
+import pytest
+
+from ttionroadei.utils import settings
+from ttionroadei.GUI import PostProcessorGUI
+from ttionroadei.csvxmlpostprc.stagecache import StageCache
+
+STAGES = ["ingest", "label", "detailed", "aggregate", "scc", "xml"]
+
+
+@pytest.fixture(scope="module")
+def params(job_params, synthetic_area):
+    """Parameters of a synthetic one-county run with the stage cache."""
+    return job_params(FIPSs_selected=synthetic_area["FIPSs"][:1], use_stage_cache=True)
+
+
+@pytest.fixture
+def resume_params(job_params, synthetic_area):
+    """Parameters of a synthetic one-county run resumed on failure, without cache."""
+    return job_params(FIPSs_selected=synthetic_area["FIPSs"][:1], resume=True)
+
+
+def fail(*args, **kwargs):
+    """Stand-in for a failing step."""
+    raise RuntimeError("Simulated failure")
+
+
+@pytest.fixture(scope="module")
+def run(run_job):
+    """Run the post-processing and get the status of each stage."""
+
+    def stage_status(params, **overrides):
+        return {
+            record["stage"]: record["status"]
+            for record in run_job(params, **overrides)
+            if record.get("file") is None and record["stage"] in STAGES
+        }
+
+    return stage_status
+
+
+def test_cache_is_opt_in(params):
+    """Test that the stage cache is off by default."""
+    ppgui = PostProcessorGUI(ei_base_dir=None, log_dir=params["log_dir"])
+    assert ppgui.use_stage_cache is False
+
+
+def test_cache_hit(params, run):
+    """Test that an unchanged rerun reuses every stage."""
+    run(params)
+    assert run(params) == {stage: "cached" for stage in STAGES}
+
+
+def test_parameter_miss(params, run):
+    """Test that a changed parameter reruns only the stages depending on it."""
+    run(params)
+    status = run(params, xml_compress_level=1)
+    assert status == {**{stage: "cached" for stage in STAGES[:-1]}, "xml": "done"}
+
+
+def test_modified_artifact(params, run):
+    """Test that a modified stage artifact reruns its stage."""
+    run(params)
+    with open(params["act_out_fi"], "a") as f:
+        f.write("\n")
+    status = run(params)
+    assert status["detailed"] == "done"
+    assert all(status[stage] == "cached" for stage in STAGES if stage != "detailed")
+
+
+def test_settings_invalidation(params, monkeypatch, run):
+    """Test that changed settings rerun only the stages using them."""
+    run(params)
+    aggpiv_opts = dict(list(settings["xlsxxml_aggpiv_opts"].items())[:2])
+    monkeypatch.setitem(settings, "xlsxxml_aggpiv_opts", aggpiv_opts)
+    status = run(params)
+    assert status["aggregate"] == "done"
+    assert all(status[stage] == "cached" for stage in STAGES if stage != "aggregate")
+
+
+def test_code_version_invalidation(params, monkeypatch, run):
+    """Test that a new code version reruns every stage."""
+    run(params)
+    monkeypatch.setattr("ttionroadei.GUI.code_version", lambda: "new version")
+    assert run(params) == {stage: "done" for stage in STAGES}
+
+
+def test_resume_after_xml_failure(resume_params, monkeypatch, run):
+    """Test that a run failed in the XML stage resumes without re-ingesting."""
+    with monkeypatch.context() as m:
+        m.setattr("ttionroadei.csvxmlpostprc.xmlgen.XMLGenerator.write_xml", fail)
+        with pytest.raises(RuntimeError):
+            run(resume_params)
+    assert not os.path.exists(resume_params["xmlscc_xml_out_fi"])
+    # The completed stages are resumed even though their inputs changed.
+    os.utime(resume_params["act_fis"]["TotSHP"])
+    monkeypatch.setattr("ttionroadei.csvxmlpostprc.csvxmlgen.CsvXmlGen.ingest", fail)
+    status = run(resume_params)
+    assert status == {**{stage: "resumed" for stage in STAGES[:-1]}, "xml": "done"}
+    assert os.path.exists(resume_params["xmlscc_xml_out_fi"])
+    # A completed run is not resumed.
+    with pytest.raises(RuntimeError):
+        run(resume_params)
+
+
+def test_resume_needs_same_parameters(resume_params, monkeypatch, run):
+    """Test that a failed run is not resumed with other parameters."""
+    monkeypatch.setattr("ttionroadei.csvxmlpostprc.xmlgen.XMLGenerator.write_xml", fail)
+    with pytest.raises(RuntimeError):
+        run(resume_params)
+    monkeypatch.undo()
+    status = run(resume_params, xml_pollutant_codes_selected=["CO"])
+    assert status == {stage: "done" for stage in STAGES}
+
+
+def test_stage_outputs_released(params, make_gui, monkeypatch):
+    """Test that the ingested data are released once labelled, and all after a run."""
+    held = []
+    stage_detailed = PostProcessorGUI._stage_detailed
+
+    def record_held(self, *args):
+        held.append(set(self._stage_outputs))
+        return stage_detailed(self, *args)
+
+    monkeypatch.setattr(PostProcessorGUI, "_stage_detailed", record_held)
+    ppgui = make_gui(params, use_stage_cache=False)
+    ppgui.run_pp()
+    assert held == [{"label"}]
+    assert ppgui._stage_outputs == {}
+    # Also after a failed run.
+    monkeypatch.setattr(PostProcessorGUI, "_stage_aggregate", fail)
+    with pytest.raises(RuntimeError):
+        ppgui.run_pp()
+    assert ppgui._stage_outputs == {}
+
+
+def test_record_fingerprint(tmp_path):
+    """Test that the artifact hash is the fingerprint hash, checked by is_fresh."""
+    cache = StageCache(tmp_path.joinpath("cache"), logger=None)
+    artifact = tmp_path.joinpath("artifact.csv")
+    artifact.write_text("a,b\n1,2\n")
+    artifact_hash = cache.record("detailed", "inputs", [artifact])
+    assert artifact_hash == StageCache.hash_fingerprints([artifact])
+    assert cache.is_fresh("detailed", "inputs")
+    assert not cache.is_fresh("detailed", "other inputs")
+    assert not cache.is_fresh("aggregate", "inputs")
+    # The manifest is reloaded by a new cache.
+    assert StageCache(tmp_path.joinpath("cache"), logger=None).is_fresh(
+        "detailed", "inputs"
+    )
+    artifact.write_text("a,b\n1,3\n4,5\n")
+    assert not cache.is_fresh("detailed", "inputs")
+    artifact.unlink()
+    assert not cache.is_fresh("detailed", "inputs")
+
+
+def test_run_state(tmp_path):
+    """Test that only the completed stages of a failed run are resumable."""
+    cache = StageCache(tmp_path.joinpath("cache"), logger=None)
+    assert cache.begin_run("run", resume=True) == set()
+    cache.complete_stage("ingest")
+    cache.complete_stage("label")
+    reloaded = StageCache(tmp_path.joinpath("cache"), logger=None)
+    assert reloaded.begin_run("other run", resume=True) == set()
+    cache = StageCache(tmp_path.joinpath("cache"), logger=None)
+    assert cache.begin_run("other run", resume=False) == set()
+    cache.complete_stage("ingest")
+    cache = StageCache(tmp_path.joinpath("cache"), logger=None)
+    assert cache.begin_run("other run", resume=True) == {"ingest"}
+    cache.end_run()
+    cache = StageCache(tmp_path.joinpath("cache"), logger=None)
+    assert cache.begin_run("other run", resume=True) == set()
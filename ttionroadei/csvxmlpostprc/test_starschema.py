@@ -0,0 +1,70 @@
+"""
+Test the star-schema detailed output: the fact and dimension tables of a run rejoin
+to the detailed CSV files of the same run in the wide format, with all the labels or
+a subset of them.
+
+To run the tests, use pytest.
+"""
+import os
+import pytest
+import pandas as pd
+
+from ttionroadei.csvxmlpostprc.starschema import fact_columns, load_star_schema
+
+DETAILED_KEYS = {"act": "act_out_fi", "emis": "emis_out_fi"}
+LABELS = {"act": ["mvsRoadType", "sutFtLabel"], "emis": ["pollutant", "mvsRoadType"]}
+
+
+@pytest.fixture(scope="module")
+def star_params(job_params, run_job):
+    """Parameters of the full run written as a star schema."""
+    params = job_params(detailed_format="star", xml_all_scenarios=True)
+    run_job(params)
+    return params
+
+
+@pytest.fixture(scope="module")
+def wide(full_run):
+    """Detailed data of the full run in the wide format."""
+    params = full_run[0]
+    return {
+        key: pd.read_csv(params[out_key], low_memory=False)
+        for key, out_key in DETAILED_KEYS.items()
+    }
+
+
+def sorted_rows(df):
+    """Rows sorted by all the columns."""
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def test_star_schema_files(star_params):
+    """Test that a star run writes the fact tables instead of the wide files."""
+    star_dir = star_params["star_out_dir"]
+    fact_fis = ["activityFact.csv", "emissionFact.csv"]
+    for key, fact_fi in zip(DETAILED_KEYS, fact_fis):
+        assert list(pd.read_csv(f"{star_dir}/{fact_fi}", nrows=0).columns) == (
+            fact_columns(key)
+        )
+    for out_key in DETAILED_KEYS.values():
+        assert not os.path.exists(star_params[out_key])
+
+
+@pytest.mark.parametrize("key", list(DETAILED_KEYS))
+def test_load_star_schema(star_params, wide, key):
+    """Test that the rejoined star schema equals the wide detailed data."""
+    result = load_star_schema(star_params["star_out_dir"], keys=[key])[key]
+    expected = wide[key]
+    assert list(result.columns) == list(expected.columns)
+    assert sorted_rows(result).equals(sorted_rows(expected))
+
+
+@pytest.mark.parametrize("key", list(DETAILED_KEYS))
+def test_load_star_schema_labels(star_params, wide, key):
+    """Test that the star schema rejoined with some labels has only those labels."""
+    result = load_star_schema(
+        star_params["star_out_dir"], keys=[key], labels=LABELS[key]
+    )[key]
+    columns = fact_columns(key) + LABELS[key]
+    assert list(result.columns) == columns
+    assert sorted_rows(result).equals(sorted_rows(wide[key][columns]))
@@ -0,0 +1,134 @@
+"""
+Test the CERS XML writer and reader on a small synthetic XML staging table.
+
+To run the tests, use pytest.
+"""
+import gzip
+import pytest
+import numpy as np
+import pandas as pd
+
+from ttionroadei.csvxmlpostprc.xmlgen import XMLGenerator
+from ttionroadei.csvxmlpostprc.xmlreader import read_cers_xml
+
+FIPSS = [48001, 48003, 48005]
+SCCS = ["2201210080", "2202610080", "2201310080"]
+POLLUTANT_CODES = ["CO", "NOx", "PM10"]
+
+
+def xml_data(location_df):
+    """Header and payload data of a synthetic document."""
+    return {
+        "Header": {
+            "id": "SYN_2020swkd",
+            "AuthorName": "Synthetic",
+            "OrganizationName": "Synthetic",
+            "DocumentTitle": "EIS",
+            "CreationDateTime": "2020-01-01T00:00:00",
+            "Comment": "Synthetic XML staging table",
+            "DataFlowName": "CERS_V2",
+            "Properties": {"SubmissionType": "QA", "DataCategory": "Onroad"},
+        },
+        "Payload": {
+            "UserIdentifier": "SYNTHETIC",
+            "ProgramSystemCode": "TXCEQ",
+            "EmissionsYear": "2020",
+            "Model": "MOVES",
+            "ModelVersion": "MOVES3.0.3",
+            "SubmittalComment": "Synthetic",
+            "ReportingPeriod": "O3D",
+            "CalculationParameterTypeCode": "I",
+            "Location": location_df,
+        },
+    }
+
+
+@pytest.fixture
+def staging_df():
+    """XML staging table with every county, SCC, and pollutant, in random order."""
+    rng = np.random.default_rng(0)
+    index = pd.MultiIndex.from_product(
+        [FIPSS, SCCS, POLLUTANT_CODES], names=["FIPS", "sccNEI", "pollutantCode"]
+    )
+    df = index.to_frame(index=False).assign(
+        area="SYN",
+        year=2020,
+        season="s",
+        dayType="wkd",
+        emissionunits="short_ton",
+        emission=rng.random(len(index)),
+        E6MILE=lambda df: df.groupby(["FIPS", "sccNEI"]).FIPS.transform(
+            lambda fips: rng.random()
+        ),
+    )
+    return df.sample(frac=1, random_state=0).reset_index(drop=True)
+
+
+def tree_bytes(data, path):
+    """Bytes of the document tree of `generate_xml` written to a file."""
+    tree = XMLGenerator(data).generate_xml()
+    tree.write(path, pretty_print=True, xml_declaration=True, encoding="utf-8")
+    return path.read_bytes()
+
+
+def test_streamed_equals_tree(staging_df, tmp_path):
+    """Test that the streamed serial output equals the serialized document tree."""
+    data = xml_data(staging_df)
+    XMLGenerator(data).write_xml(tmp_path.joinpath("streamed.xml"))
+    expected = tree_bytes(data, tmp_path.joinpath("tree.xml"))
+    assert tmp_path.joinpath("streamed.xml").read_bytes() == expected
+
+
+@pytest.mark.parametrize("name", ["failed.xml", "failed.xml.gz"])
+def test_failed_write_removes_file(staging_df, tmp_path, name):
+    """Test that a failed generation leaves no partial file."""
+    # The fourth SCC digit must be 1 (gas) or 2 (diesel).
+    staging_df.loc[staging_df.FIPS == FIPSS[-1], "sccNEI"] = "2203210080"
+    path = tmp_path.joinpath(name)
+    with pytest.raises(ValueError):
+        XMLGenerator(xml_data(staging_df)).write_xml(path)
+    assert not path.exists()
+
+
+@pytest.mark.parametrize("n_workers", [2, 3])
+def test_parallel_equals_serial(staging_df, tmp_path, n_workers):
+    """Test that the fragments built in worker processes give the serial output."""
+    data = xml_data(staging_df)
+    XMLGenerator(data).write_xml(tmp_path.joinpath("serial.xml"))
+    XMLGenerator(data, n_workers=n_workers).write_xml(tmp_path.joinpath("par.xml"))
+    expected = tmp_path.joinpath("serial.xml").read_bytes()
+    assert tmp_path.joinpath("par.xml").read_bytes() == expected
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_gzip_equals_serial(staging_df, tmp_path, n_workers):
+    """Test that the decompressed gzip output equals the serial output."""
+    data = xml_data(staging_df)
+    XMLGenerator(data).write_xml(tmp_path.joinpath("serial.xml"))
+    path = tmp_path.joinpath("out.xml.gz")
+    XMLGenerator(data, n_workers=n_workers).write_xml(path, compresslevel=1)
+    with gzip.open(path, "rb") as f:
+        assert f.read() == tmp_path.joinpath("serial.xml").read_bytes()
+
+
+def test_empty_staging_table(staging_df, tmp_path):
+    """Test that a staging table without rows gives a document without Locations."""
+    data = xml_data(staging_df.iloc[:0])
+    XMLGenerator(data, n_workers=2).write_xml(tmp_path.joinpath("empty.xml"))
+    expected = tree_bytes(data, tmp_path.joinpath("tree.xml"))
+    assert tmp_path.joinpath("empty.xml").read_bytes() == expected
+    assert read_cers_xml(tmp_path.joinpath("empty.xml")).empty
+
+
+@pytest.mark.parametrize("name", ["roundtrip.xml", "roundtrip.xml.gz"])
+def test_round_trip(staging_df, tmp_path, name):
+    """Test that the reader gives back the written XML staging table."""
+    path = tmp_path.joinpath(name)
+    XMLGenerator(xml_data(staging_df)).write_xml(path)
+    expected = (
+        staging_df.sort_values(["FIPS", "sccNEI", "pollutantCode"])
+        .astype({"FIPS": "int64", "sccNEI": "int64"})
+        .filter(items=["FIPS", "sccNEI", "E6MILE", "pollutantCode", "emission"])
+        .reset_index(drop=True)
+    )
+    pd.testing.assert_frame_equal(read_cers_xml(path), expected, check_exact=True)
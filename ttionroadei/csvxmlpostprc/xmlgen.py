@@ -1,7 +1,23 @@
 """
 XML generation code.
 """
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+import gzip
+from itertools import repeat
+from pathlib import Path
+import queue
+import threading
 from lxml import etree
+import numpy as np
+
+# Placeholder written in place of the Location elements when the document is
+# assembled from per-county fragments.
+LOCATIONS_MARKER = "LOCATIONS"
+# Pretty-printed indentation level of the Location elements (Document > Payload >
+# CERS > Location).
+LOCATION_LEVEL = 3
+LOCATION_SEPARATOR = b"\n" + b"  " * LOCATION_LEVEL
 
 
 class XMLGenerator:
@@ -14,6 +30,8 @@ class XMLGenerator:
         The input data for creating the XML document.
     namespace : dict
         A dictionary that defines XML namespaces used in the document.
+    n_workers : int
+        Number of worker processes used to build the per-county Location fragments.
 
     Methods
     -------
@@ -23,18 +41,30 @@ class XMLGenerator:
     create_header_element()
         Create the XML header element based on the provided data.
 
-    create_payload_element()
+    create_payload_element(with_locations=True)
         Create the XML payload element based on the provided data.
 
-    create_location_emissions_process_element(data, SCC)
-        Create an XML element for a location emissions process based on the provided data.
+    sorted_locations()
+        Sort the XML staging table by FIPS, sccNEI, and pollutantCode.
+
+    create_location_elements(cers, location_df)
+        Create the Location elements for the sorted XML staging table in a single pass.
 
-    generate_xml()
+    create_location_emissions_process_element(tag, SCC, E6MILE, ...)
+        Create an XML element for a location emissions process based on the provided
+        pre-formatted values.
+
+    generate_xml(with_locations=True)
         Generate the complete XML document based on the input data and return it as an
         ElementTree object.
+
+    write_xml(path, compresslevel=6)
+        Write the complete XML document to a file, streaming the per-county Location
+        fragments as they are built (in parallel worker processes when `n_workers` >
+        1). `.gz` paths are gzip compressed in a background thread.
     """
 
-    def __init__(self, xml_data):
+    def __init__(self, xml_data, n_workers=1):
         """
         Initialize an XMLGenerator instance.
 
@@ -42,8 +72,12 @@ class XMLGenerator:
         ----------
         xml_data : dict
             A dictionary containing the data for generating the XML document.
+        n_workers : int, optional
+            Number of worker processes used to build the per-county Location
+            fragments in `write_xml`. Default is 1 (serial).
         """
         self.xml_data = xml_data
+        self.n_workers = n_workers
         self.namespace = {
             "hdr": "http://www.exchangenetwork.net/schema/header/2",
             "cer": "http://www.exchangenetwork.net/schema/cer/1",
@@ -119,10 +153,16 @@ class XMLGenerator:
 
         return header
 
-    def create_payload_element(self):
+    def create_payload_element(self, with_locations=True):
         """
         Create the XML payload element based on the provided data.
 
+        Parameters
+        ----------
+        with_locations : bool, optional
+            If False, a placeholder comment is added to the CERS element instead of
+            the Location elements. Default is True.
+
         Returns
         -------
         Element
@@ -145,113 +185,201 @@ class XMLGenerator:
                 cers, self.namespace["cer"], element_name, self.xml_data["Payload"][key]
             )
 
-        grp = self.xml_data["Payload"]["Location"].groupby(["FIPS"])
-        for FIPS, df_FIPS in grp:
-            grp_sccNEI = df_FIPS.groupby(["sccNEI"])
-            location = self.create_element(cers, self.namespace["cer"], "Location")
-            self.create_element(
-                location, self.namespace["cer"], "StateAndCountyFIPSCode", str(FIPS[0])
-            )
-            for SCC, df_sccNEI in grp_sccNEI:
-                location_emissions_process = (
-                    self.create_location_emissions_process_element(df_sccNEI, SCC)
-                )
-                location.append(location_emissions_process)
-
+        if with_locations:
+            self.create_location_elements(cers, self.sorted_locations())
+        else:
+            cers.append(etree.Comment(LOCATIONS_MARKER))
         return payload
 
-    def create_location_emissions_process_element(self, data, SCC):
+    def sorted_locations(self):
+        """
+        Sort the XML staging table by FIPS, sccNEI, and pollutantCode.
+
+        Returns
+        -------
+        DataFrame
+            The sorted XML staging table.
+        """
+        return self.xml_data["Payload"]["Location"].sort_values(
+            ["FIPS", "sccNEI", "pollutantCode"], kind="mergesort"
+        )
+
+    def create_location_elements(self, cers, location_df):
+        """
+        Create the Location elements for the provided XML staging table in a single
+        pass and append them to the CERS element.
+
+        The staging table is walked as NumPy arrays with precomputed FIPS and
+        FIPS + SCC group boundaries instead of nested groupby and iterrows. All the
+        numbers are formatted to strings in bulk before the elements are created.
+
+        Parameters
+        ----------
+        cers : Element
+            The CERS element to which the Location elements are appended.
+        location_df : DataFrame
+            The XML staging table sorted by FIPS, sccNEI, and pollutantCode.
+
+        Returns
+        -------
+        Element
+            The CERS element.
         """
-        Create an XML element for a location emissions process based on the provided data.
+        cer = self.namespace["cer"]
+        tag = {
+            name: etree.QName(cer, name).text
+            for name in (
+                "Location",
+                "StateAndCountyFIPSCode",
+                "LocationEmissionsProcess",
+                "SourceClassificationCode",
+                "ReportingPeriod",
+                "ReportingPeriodTypeCode",
+                "CalculationParameterTypeCode",
+                "CalculationParameterValue",
+                "CalculationParameterUnitofMeasure",
+                "CalculationMaterialCode",
+                "ReportingPeriodEmissions",
+                "PollutantCode",
+                "TotalEmissions",
+                "EmissionsUnitofMeasureCode",
+            )
+        }
+        reporting_period_type = self.xml_data["Payload"]["ReportingPeriod"]
+        calculation_parameter_type = self.xml_data["Payload"][
+            "CalculationParameterTypeCode"
+        ]
+        fips = location_df["FIPS"].to_numpy()
+        scc = location_df["sccNEI"].to_numpy()
+        fips_str = location_df["FIPS"].astype(str).to_numpy()
+        scc_str = location_df["sccNEI"].astype(str).to_numpy()
+        e6mile_str = location_df["E6MILE"].astype(str).to_numpy()
+        pollutant_code = location_df["pollutantCode"].astype(str).to_numpy()
+        emission_str = location_df["emission"].astype(str).to_numpy()
+        emission_units = location_df["emissionunits"].astype(str).to_numpy()
+        # Group boundaries: a new county starts a Location element and a new county +
+        # SCC combination starts a LocationEmissionsProcess element.
+        new_fips = _new_group(fips)
+        new_scc = _new_group(fips, scc)
+        scc_starts = np.flatnonzero(new_scc)
+        scc_ends = np.r_[scc_starts[1:], len(location_df)]
+        new_fips = new_fips.tolist()
+        location = None
+        for start, end in zip(scc_starts.tolist(), scc_ends.tolist()):
+            if new_fips[start]:
+                location = etree.SubElement(cers, tag["Location"])
+                etree.SubElement(
+                    location, tag["StateAndCountyFIPSCode"]
+                ).text = fips_str[start]
+            location.append(
+                self.create_location_emissions_process_element(
+                    tag=tag,
+                    SCC=scc_str[start],
+                    E6MILE=e6mile_str[start],
+                    pollutant_codes=pollutant_code[start:end],
+                    emissions=emission_str[start:end],
+                    emission_units=emission_units[start:end],
+                    reporting_period_type=reporting_period_type,
+                    calculation_parameter_type=calculation_parameter_type,
+                )
+            )
+        return cers
+
+    @staticmethod
+    def create_location_emissions_process_element(
+        tag,
+        SCC,
+        E6MILE,
+        pollutant_codes,
+        emissions,
+        emission_units,
+        reporting_period_type,
+        calculation_parameter_type,
+    ):
+        """
+        Create an XML element for a location emissions process based on the provided
+        pre-formatted values.
 
         Parameters
         ----------
-        data : DataFrame
-            The data containing emissions process information.
+        tag : dict
+            Mapping of element names to namespace qualified tags.
         SCC : str
             The Source Classification Code.
+        E6MILE : str
+            The VMT (million miles) for the SCC.
+        pollutant_codes : array-like of str
+            The pollutant codes reported for the SCC.
+        emissions : array-like of str
+            The total emissions for each pollutant code.
+        emission_units : array-like of str
+            The emission units for each pollutant code.
+        reporting_period_type : str
+            The reporting period type code.
+        calculation_parameter_type : str
+            The calculation parameter type code.
 
         Returns
         -------
         Element
             The XML element for the location emissions process.
         """
-        location_emissions_process = self.create_element(
-            None, self.namespace["cer"], "LocationEmissionsProcess"
-        )
-
-        self.create_element(
-            location_emissions_process,
-            self.namespace["cer"],
-            "SourceClassificationCode",
-            str(SCC[0]),
-        )
-        reporting_period = self.create_element(
-            location_emissions_process, self.namespace["cer"], "ReportingPeriod"
+        sub_element = etree.SubElement
+        location_emissions_process = etree.Element(tag["LocationEmissionsProcess"])
+        sub_element(
+            location_emissions_process, tag["SourceClassificationCode"]
+        ).text = SCC
+        reporting_period = sub_element(
+            location_emissions_process, tag["ReportingPeriod"]
         )
-        self.create_element(
-            reporting_period,
-            self.namespace["cer"],
-            "ReportingPeriodTypeCode",
-            self.xml_data["Payload"]["ReportingPeriod"],
+        sub_element(
+            reporting_period, tag["ReportingPeriodTypeCode"]
+        ).text = reporting_period_type
+        sub_element(
+            reporting_period, tag["CalculationParameterTypeCode"]
+        ).text = calculation_parameter_type
+        sub_element(reporting_period, tag["CalculationParameterValue"]).text = E6MILE
+        sub_element(
+            reporting_period, tag["CalculationParameterUnitofMeasure"]
+        ).text = "E6MILE"
+        calculation_material_code = sub_element(
+            reporting_period, tag["CalculationMaterialCode"]
         )
-        self.create_element(
-            reporting_period,
-            self.namespace["cer"],
-            "CalculationParameterTypeCode",
-            self.xml_data["Payload"]["CalculationParameterTypeCode"],
-        )
-        self.create_element(
-            reporting_period,
-            self.namespace["cer"],
-            "CalculationParameterValue",
-            str(data.iloc[0]["E6MILE"]),
-        )
-        self.create_element(
-            reporting_period,
-            self.namespace["cer"],
-            "CalculationParameterUnitofMeasure",
-            "E6MILE",
-        )
-        calculation_material_code = self.create_element(
-            reporting_period, self.namespace["cer"], "CalculationMaterialCode"
-        )
-        if str(SCC[0])[3] == "1":
+        if SCC[3] == "1":
             calculation_material_code.text = "127"
-        elif str(SCC[0])[3] == "2":
+        elif SCC[3] == "2":
             calculation_material_code.text = "44"
         else:
             raise ValueError("SCC[3] can only be 1 (gas) or 2 (diesel) for MOVES3.")
 
-        for idx, row in data.iterrows():
-            reporting_period_emissions = self.create_element(
-                reporting_period, self.namespace["cer"], "ReportingPeriodEmissions"
-            )
-            self.create_element(
-                reporting_period_emissions,
-                self.namespace["cer"],
-                "PollutantCode",
-                row["pollutantCode"],
-            )
-            self.create_element(
-                reporting_period_emissions,
-                self.namespace["cer"],
-                "TotalEmissions",
-                str(row["emission"]),
-            )
-            self.create_element(
-                reporting_period_emissions,
-                self.namespace["cer"],
-                "EmissionsUnitofMeasureCode",
-                row["emissionunits"],
+        for pollutant_code, emission, emission_unit in zip(
+            pollutant_codes, emissions, emission_units
+        ):
+            reporting_period_emissions = sub_element(
+                reporting_period, tag["ReportingPeriodEmissions"]
             )
+            sub_element(
+                reporting_period_emissions, tag["PollutantCode"]
+            ).text = pollutant_code
+            sub_element(
+                reporting_period_emissions, tag["TotalEmissions"]
+            ).text = emission
+            sub_element(
+                reporting_period_emissions, tag["EmissionsUnitofMeasureCode"]
+            ).text = emission_unit
 
         return location_emissions_process
 
-    def generate_xml(self):
+    def generate_xml(self, with_locations=True):
         """
         Generate the complete XML document based on the input data.
 
+        Parameters
+        ----------
+        with_locations : bool, optional
+            If False, the Location elements are replaced by a placeholder comment.
+            Default is True.
+
         Returns
         -------
         ElementTree
@@ -270,11 +398,224 @@ class XMLGenerator:
         )
         root.addprevious(stylesheet_pi)
         header_element = self.create_header_element()
-        payload_element = self.create_payload_element()
+        payload_element = self.create_payload_element(with_locations=with_locations)
         root.append(header_element)
         root.append(payload_element)
         tree = etree.ElementTree(root)
-        xml_string = etree.tostring(
-            root, pretty_print=True, encoding="utf-8", xml_declaration=True
-        ).decode()
         return tree
+
+    def write_xml(self, path, compresslevel=6):
+        """
+        Write the complete XML document to a file.
+
+        The Location element of each county is built and serialized on its own and
+        streamed to the file in FIPS order, between the CERS preamble and the
+        closing tags, so the whole tree is never held in memory. With `n_workers` >
+        1, the fragments are built in worker processes. The output is identical to
+        serializing the tree of `generate_xml`.
+
+        Paths ending with `.gz` are written through a gzip compressor running in a
+        background thread, so compression overlaps the element generation. A
+        partially written file is deleted if the generation fails.
+
+        Parameters
+        ----------
+        path : str or Path
+            The output XML file path.
+        compresslevel : int, optional
+            The gzip compression level (1-9) for `.gz` paths. Default is 6.
+
+        Returns
+        -------
+        None
+        """
+        try:
+            if self.xml_data["Payload"]["Location"].empty:
+                tree = self.generate_xml()
+                with open_xml_output(path, compresslevel) as f:
+                    tree.write(
+                        f, pretty_print=True, xml_declaration=True, encoding="utf-8"
+                    )
+                return
+            self._write_location_fragments(path, compresslevel)
+        except BaseException:
+            Path(path).unlink(missing_ok=True)
+            raise
+
+    def _write_location_fragments(self, path, compresslevel):
+        """Stream the document with its per-county Location fragments to a file."""
+        skeleton = etree.tostring(
+            self.generate_xml(with_locations=False),
+            pretty_print=True,
+            xml_declaration=True,
+            encoding="UTF-8",
+        )
+        preamble, closing = skeleton.split(f"<!--{LOCATIONS_MARKER}-->".encode())
+        location_df = self.sorted_locations()
+        fips = location_df["FIPS"].to_numpy()
+        starts = np.flatnonzero(_new_group(fips))
+        ends = np.r_[starts[1:], len(location_df)]
+        county_dfs = (
+            location_df.iloc[start:end]
+            for start, end in zip(starts.tolist(), ends.tolist())
+        )
+        xml_data = {
+            "Header": self.xml_data["Header"],
+            "Payload": {
+                key: val
+                for key, val in self.xml_data["Payload"].items()
+                if key != "Location"
+            },
+        }
+        parallel = self.n_workers > 1
+        with open_xml_output(path, compresslevel) as f, (
+            ProcessPoolExecutor(self.n_workers) if parallel else nullcontext()
+        ) as executor:
+            f.write(preamble)
+            fragments = (executor.map if parallel else map)(
+                _location_fragment, repeat(xml_data), county_dfs
+            )
+            for idx, fragment in enumerate(fragments):
+                if idx:
+                    f.write(LOCATION_SEPARATOR)
+                f.write(fragment)
+            f.write(closing)
+
+
+class ThreadedGzipWriter:
+    """
+    Binary file-like writer that gzip compresses the written chunks in a
+    background thread.
+
+    zlib releases the GIL while compressing, so the compression overlaps the XML
+    generation and serialization in the calling thread. The queue of pending chunks
+    is bounded to keep the memory use flat.
+
+    Attributes
+    ----------
+    path : str or Path
+        The output `.gz` file path.
+    compresslevel : int
+        The gzip compression level (1-9).
+    """
+
+    def __init__(self, path, compresslevel=6, max_pending_chunks=64):
+        self.path = path
+        self.compresslevel = compresslevel
+        self._gzip_file = gzip.open(path, "wb", compresslevel=compresslevel)
+        self._chunks = queue.Queue(maxsize=max_pending_chunks)
+        self._error = None
+        self._thread = threading.Thread(target=self._compress, daemon=True)
+        self._thread.start()
+
+    def _compress(self):
+        """Compress the queued chunks until the end-of-stream sentinel (None)."""
+        while True:
+            chunk = self._chunks.get()
+            if chunk is None:
+                break
+            if self._error is None:
+                try:
+                    self._gzip_file.write(chunk)
+                except Exception as err:
+                    self._error = err
+
+    def write(self, data):
+        """Queue a chunk of bytes for compression and return its length."""
+        if self._error is not None:
+            raise self._error
+        self._chunks.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        """Flush the pending chunks, stop the compression thread, and close the file."""
+        if self._thread.is_alive():
+            self._chunks.put(None)
+            self._thread.join()
+        self._gzip_file.close()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def open_xml_output(path, compresslevel=6):
+    """
+    Open the XML output file for binary writing.
+
+    Parameters
+    ----------
+    path : str or Path
+        The output XML file path. Paths ending with `.gz` are gzip compressed in a
+        background thread.
+    compresslevel : int, optional
+        The gzip compression level (1-9). Default is 6.
+
+    Returns
+    -------
+    file-like
+        Binary file-like object supporting the context manager protocol.
+    """
+    if str(path).endswith(".gz"):
+        return ThreadedGzipWriter(path, compresslevel=compresslevel)
+    return open(path, "wb")
+
+
+def _new_group(*keys):
+    """
+    Flag the rows of sorted key arrays that start a new group.
+
+    Parameters
+    ----------
+    *keys : np.ndarray
+        Sorted key arrays of equal length.
+
+    Returns
+    -------
+    np.ndarray
+        Boolean array that is True for the first row of each group.
+    """
+    new_group = np.zeros(len(keys[0]), dtype=bool)
+    new_group[:1] = True
+    for key in keys:
+        new_group[1:] |= key[1:] != key[:-1]
+    return new_group
+
+
+def _location_fragment(xml_data, location_df):
+    """
+    Build and serialize the Location element of a single county.
+
+    Runs in a worker process for `XMLGenerator.write_xml`. The fragment is indented
+    for its position in the document and the namespace declarations repeated on the
+    standalone element are dropped, since the document root declares them.
+
+    Parameters
+    ----------
+    xml_data : dict
+        The header and payload data without the XML staging table.
+    location_df : DataFrame
+        The sorted XML staging table rows of a single county.
+
+    Returns
+    -------
+    bytes
+        The serialized Location element.
+    """
+    xmlgen = XMLGenerator(xml_data)
+    cers = etree.Element(
+        etree.QName(xmlgen.namespace["cer"], "CERS"), nsmap=xmlgen.namespace
+    )
+    xmlgen.create_location_elements(cers, location_df)
+    location = cers[0]
+    etree.indent(location, level=LOCATION_LEVEL)
+    fragment = etree.tostring(location, encoding="utf-8", with_tail=False)
+    start_tag_end = fragment.index(b">")
+    start_tag = fragment[:start_tag_end]
+    for prefix, uri in xmlgen.namespace.items():
+        start_tag = start_tag.replace(f' xmlns:{prefix}="{uri}"'.encode(), b"")
+    return start_tag + fragment[start_tag_end:]
@@ -0,0 +1,297 @@
+"""
+Structured timing, row count, and memory metrics of the post-processing stages.
+
+Metrics are written as JSON lines next to the post-processing log, one record per
+stage, shard, or input file, so runs and areas can be compared over time. Example
+record:
+```
+{"run_id": "20231017T101500_4242_9f1c2ab0", "stage": "ingest", "file": null,
+ "wall_s": 12.3, "cpu_s": 11.9, "rows_in": null, "rows_out": 1327968,
+ "bytes_read": 73471415, "bytes_written": null, "peak_rss_mb": 1680.2,
+ "tracemalloc_peak_mb": null, "status": "done"}
+```
+"""
+from contextlib import contextmanager, nullcontext
+from itertools import count
+import json
+import os
+from pathlib import Path
+import time
+import tracemalloc
+from uuid import uuid4
+
+from ttionroadei.utils import (
+    log_filename,
+    peak_rss_mb,
+    reset_peak_rss,
+    ts,
+    profiled,
+    aggregate_profiles,
+)
+
+# Number of the `.prof` files of the process. Process-wide, as a worker process gets
+# a new copy of the recorder for each task.
+_profile_numbers = count(1)
+
+
+def metrics_file(log_dir):
+    """
+    Get the metrics file path next to the post-processing log file.
+
+    Parameters
+    ----------
+    log_dir : str or Path
+        The log directory.
+
+    Returns
+    -------
+    pathlib.Path
+        The JSON lines metrics file path.
+    """
+    return Path(log_dir) / f'{log_filename}_{ts(style="date")}.metrics.jsonl'
+
+
+def count_rows(frames):
+    """
+    Count the rows of the activity and emission DataFrames of a stage.
+
+    Parameters
+    ----------
+    frames : dict or None
+        Mapping of names to DataFrames.
+
+    Returns
+    -------
+    int or None
+        The total number of rows, or None if there are no DataFrames.
+    """
+    if not isinstance(frames, dict):
+        return None
+    return int(sum(len(df) for df in frames.values()))
+
+
+def count_bytes(paths):
+    """
+    Sum the sizes of the existing files.
+
+    Parameters
+    ----------
+    paths : list
+        The file paths.
+
+    Returns
+    -------
+    int
+        The total size in bytes.
+    """
+    return int(sum(Path(path).stat().st_size for path in paths if Path(path).exists()))
+
+
+class MetricsRecorder:
+    """
+    Recorder of per-stage and per-file wall time, CPU time, rows, bytes, and peak
+    memory.
+
+    Measures can be nested (e.g., input files within the ingest stage): the peak
+    memory and the bytes read of a nested measure are folded into the enclosing
+    one.
+
+    Attributes
+    ----------
+    metrics_fi : pathlib.Path or None
+        The JSON lines metrics file. None keeps the records in memory only.
+    run_id : str
+        Identifier shared by all the records of a post-processing run, including
+        those written by worker processes: the start time, the process ID, and a
+        random suffix.
+    trace_memory : bool
+        Whether to also measure the peak Python allocations with `tracemalloc`.
+        Slows down the run noticeably.
+    records : list
+        The records measured in this process.
+    profile_stages : frozenset
+        The stages profiled with `cProfile` (see `utils.get_profile_stages`), or
+        "all". Empty disables profiling.
+    profile_dir : pathlib.Path or None
+        The directory receiving the `.prof` files of the run.
+    profile_aggregate : bool
+        Whether to merge the `.prof` files of the same stage from all processes
+        when the outermost measure of the main process exits.
+
+    Methods
+    -------
+    measure(stage, **fields)
+        Context manager measuring a stage or file.
+    read_run()
+        Get the records of the run, including those of worker processes.
+    """
+
+    def __init__(
+        self,
+        metrics_fi=None,
+        run_id=None,
+        trace_memory=False,
+        profile_stages=(),
+        profile_aggregate=True,
+    ):
+        self.metrics_fi = Path(metrics_fi) if metrics_fi is not None else None
+        # The random suffix tells apart the runs started in the same second.
+        self.run_id = run_id or (
+            f"{ts(template='{:%Y%m%dT%H%M%S}')}_{os.getpid()}_{uuid4().hex[:8]}"
+        )
+        self.trace_memory = trace_memory
+        self.profile_stages = frozenset(profile_stages)
+        self.profile_aggregate = profile_aggregate
+        self.profile_dir = None
+        if self.profile_stages and self.metrics_fi is not None:
+            self.profile_dir = self.metrics_fi.parent.joinpath("profiles", self.run_id)
+        self.records = []
+        self._stack = []
+        self._profiling = False
+        self._pid = os.getpid()
+
+    def __getstate__(self):
+        # Worker processes start their own measures and write to the same file.
+        state = self.__dict__.copy()
+        state["records"], state["_stack"] = [], []
+        state["_profiling"] = False
+        return state
+
+    def _profiler(self, stage):
+        # One profiler at a time: a stage nested in a profiled stage is included in
+        # its profile.
+        if self.profile_dir is None or self._profiling:
+            return nullcontext()
+        if stage not in self.profile_stages and "all" not in self.profile_stages:
+            return nullcontext()
+        self._profiling = True
+        return profiled(
+            self.profile_dir.joinpath(
+                f"{stage}_{os.getpid()}_{next(_profile_numbers)}.prof"
+            )
+        )
+
+    def _memory_peaks(self):
+        traced = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+        return peak_rss_mb(), traced
+
+    def _fold(self, frame, rss, traced):
+        if rss is not None:
+            frame["peak_rss"] = max(frame["peak_rss"] or 0, rss)
+        if traced is not None:
+            frame["peak_traced"] = max(frame["peak_traced"], traced)
+
+    @contextmanager
+    def measure(self, stage, **fields):
+        """
+        Measure a stage or file. The yielded record can be updated with rows_in,
+        rows_out, bytes_read, bytes_written, or other fields.
+
+        Parameters
+        ----------
+        stage : str
+            The stage name.
+        **fields
+            Additional fields of the record (e.g., file).
+
+        Yields
+        ------
+        dict
+            The record, written when the block exits.
+        """
+        record = {
+            "run_id": self.run_id,
+            "stage": stage,
+            "file": None,
+            **fields,
+            "rows_in": None,
+            "rows_out": None,
+            "bytes_read": None,
+            "bytes_written": None,
+        }
+        if self._stack:
+            # The nested measure resets the peaks: keep the enclosing ones.
+            self._fold(self._stack[-1], *self._memory_peaks())
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        reset_peak_rss()
+        traced_start = None
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            traced_start = tracemalloc.get_traced_memory()[0]
+        frame = {"peak_rss": None, "peak_traced": 0, "bytes_read": 0}
+        self._stack.append(frame)
+        profiling = self._profiling
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        status, error = "done", None
+        try:
+            with self._profiler(stage):
+                yield record
+        except BaseException as err:
+            status, error = "failed", f"{type(err).__name__}: {err}"
+            raise
+        finally:
+            self._profiling = profiling
+            wall_s = time.perf_counter() - wall_start
+            cpu_s = time.process_time() - cpu_start
+            self._fold(frame, *self._memory_peaks())
+            self._stack.pop()
+            if record["bytes_read"] is None and frame["bytes_read"]:
+                record["bytes_read"] = frame["bytes_read"]
+            if self._stack:
+                parent = self._stack[-1]
+                self._fold(parent, frame["peak_rss"], frame["peak_traced"])
+                parent["bytes_read"] += record["bytes_read"] or 0
+            record.update(
+                wall_s=round(wall_s, 4),
+                cpu_s=round(cpu_s, 4),
+                peak_rss_mb=(
+                    round(frame["peak_rss"], 1)
+                    if frame["peak_rss"] is not None
+                    else None
+                ),
+                tracemalloc_peak_mb=(
+                    (frame["peak_traced"] - traced_start) / 2**20
+                    if traced_start is not None
+                    else None
+                ),
+                status=status if error is not None else record.get("status", status),
+            )
+            if error is not None:
+                record["error"] = error
+            self._write(record)
+            if not self._stack and os.getpid() == self._pid:
+                self._aggregate_profiles()
+
+    def _aggregate_profiles(self):
+        if (
+            self.profile_aggregate
+            and self.profile_dir is not None
+            and self.profile_dir.exists()
+        ):
+            aggregate_profiles(self.profile_dir)
+
+    def _write(self, record):
+        self.records.append(record)
+        if self.metrics_fi is None:
+            return
+        self.metrics_fi.parent.mkdir(parents=True, exist_ok=True)
+        # One short append per record, so records of concurrent worker processes
+        # do not interleave.
+        with open(self.metrics_fi, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+    def read_run(self):
+        """
+        Get the records of the run, including those written by worker processes.
+
+        Returns
+        -------
+        list
+            The metric records of the run.
+        """
+        if self.metrics_fi is None or not self.metrics_fi.exists():
+            return list(self.records)
+        with open(self.metrics_fi, "r") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        return [record for record in records if record["run_id"] == self.run_id]
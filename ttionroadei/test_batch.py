@@ -0,0 +1,80 @@
+"""
+Test the batch runner: the jobs sharing an output or log directory are rejected, and
+a failed job is reported in the summary without stopping the other jobs.
+
+To run the tests, use pytest.
+"""
+import threading
+import pytest
+import yaml
+
+from ttionroadei.batch import check_job_isolation, format_summary, run_batch
+
+# Seconds before a batch is considered hung.
+BATCH_TIMEOUT_S = 600
+
+
+def write_job(params, job_fi):
+    """Write the parameters of a job to a job file."""
+    with open(job_fi, "w") as yaml_file:
+        yaml.safe_dump(params, yaml_file)
+    return job_fi
+
+
+@pytest.fixture
+def job_fis(job_params, synthetic_area, tmp_path):
+    """Factory of the job files of synthetic one-county runs."""
+
+    def make(n_jobs, **options):
+        return [
+            write_job(
+                job_params(FIPSs_selected=synthetic_area["FIPSs"][:1], **options),
+                tmp_path.joinpath(f"job{i}.yaml"),
+            )
+            for i in range(n_jobs)
+        ]
+
+    return make
+
+
+@pytest.mark.parametrize("key", ["summary_dir", "log_dir"])
+def test_shared_directory(job_fis, tmp_path, key):
+    """Test that the jobs sharing an output or log directory are rejected."""
+    fis = job_fis(2)
+    check_job_isolation(fis)
+    with open(fis[1], "r") as yaml_file:
+        params = yaml.safe_load(yaml_file)
+    with open(fis[0], "r") as yaml_file:
+        params[key] = yaml.safe_load(yaml_file)[key]
+    write_job(params, fis[1])
+    with pytest.raises(ValueError, match=f"share the {key}"):
+        check_job_isolation(fis)
+    with pytest.raises(ValueError, match=f"share the {key}"):
+        run_batch(fis)
+
+
+def test_failed_job(job_fis, tmp_path):
+    """Test that a failed job is reported and the other job completes."""
+    ok_fi, failing_fi = job_fis(2)
+    with open(failing_fi, "r") as yaml_file:
+        params = yaml.safe_load(yaml_file)
+    # The total SHP file is not read.
+    cat = next(cat for cat in params["act_fis"] if cat != "TotSHP")
+    params["act_fis"][cat] = str(tmp_path.joinpath("missing.csv"))
+    write_job(params, failing_fi)
+    results = []
+    batch = threading.Thread(
+        target=lambda: results.extend(run_batch([ok_fi, failing_fi], 2)), daemon=True
+    )
+    batch.start()
+    batch.join(BATCH_TIMEOUT_S)
+    assert not batch.is_alive(), "The batch hung."
+    assert [result["job"] for result in results] == [str(ok_fi), str(failing_fi)]
+    assert [result["status"] for result in results] == ["done", "failed"]
+    assert results[0]["error"] == ""
+    assert "missing.csv" in results[1]["error"]
+    summary = format_summary(results).splitlines()
+    assert summary[2].startswith(str(ok_fi))
+    assert summary[3].startswith(str(failing_fi))
+    assert "failed" in summary[3]
+    assert summary[4] == f"    {results[1]['error']}"
@@ -0,0 +1,174 @@
+"""
+Test the metrics recorder: the run identifiers, the nested measures, the records of
+a run written by the main and worker processes to a shared metrics file, and the
+profiles of the stages.
+
+To run the tests, use pytest.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+from pathlib import Path
+import pstats
+import tracemalloc
+import pytest
+
+from ttionroadei.metrics import MetricsRecorder
+from ttionroadei.utils import get_profile_stages, profile_env_var, settings
+
+MB = 2**20
+
+
+def measure_file(metrics, stage, fi):
+    """Measure a file in a worker process."""
+    with metrics.measure(stage, file=fi) as record:
+        record["rows_in"] = 1
+
+
+def test_unique_run_ids():
+    """Test that the recorders started in the same second have different run IDs."""
+    assert len({MetricsRecorder().run_id for _ in range(100)}) == 100
+
+
+def test_nested_measures():
+    """Test that the bytes read and peaks of the nested measures are folded."""
+    metrics = MetricsRecorder(trace_memory=True)
+    try:
+        with metrics.measure("ingest"):
+            for fi, size in [("a.csv", 10), ("b.csv", 20)]:
+                with metrics.measure("ingest", file=fi) as record:
+                    record["bytes_read"] = size
+                    if fi == "a.csv":
+                        buffer = bytearray(32 * MB)
+                        del buffer
+    finally:
+        # Tracing slows down the other tests.
+        tracemalloc.stop()
+    files = {record["file"]: record for record in metrics.records[:2]}
+    outer = metrics.records[2]
+    assert outer["file"] is None
+    assert outer["bytes_read"] == 30
+    assert files["a.csv"]["tracemalloc_peak_mb"] >= 32
+    assert files["b.csv"]["tracemalloc_peak_mb"] < 32
+    assert outer["tracemalloc_peak_mb"] >= files["a.csv"]["tracemalloc_peak_mb"]
+    assert outer["peak_rss_mb"] >= max(
+        record["peak_rss_mb"] for record in files.values()
+    )
+
+
+def test_failed_measure():
+    """Test that a failed measure is recorded with its error."""
+    metrics = MetricsRecorder()
+    with pytest.raises(ValueError):
+        with metrics.measure("label"):
+            raise ValueError("bad label")
+    assert metrics.records[0]["status"] == "failed"
+    assert metrics.records[0]["error"] == "ValueError: bad label"
+
+
+def test_read_run(tmp_path):
+    """Test that the records of a run are read back without those of other runs."""
+    metrics_fi = tmp_path.joinpath("pp.metrics.jsonl")
+    runs = [MetricsRecorder(metrics_fi), MetricsRecorder(metrics_fi)]
+    for stage in ["ingest", "label"]:
+        for metrics in runs:
+            with metrics.measure(stage):
+                pass
+    for metrics in runs:
+        assert metrics.read_run() == metrics.records
+        assert [record["stage"] for record in metrics.read_run()] == [
+            "ingest",
+            "label",
+        ]
+
+
+def test_worker_records(tmp_path):
+    """Test that the records of worker processes have the run ID of the run."""
+    metrics = MetricsRecorder(tmp_path.joinpath("pp.metrics.jsonl"))
+    with metrics.measure("ingest"):
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            for fi in ["a.csv", "b.csv"]:
+                executor.submit(measure_file, metrics, "ingest", fi).result()
+    # Only the main process records are kept in memory.
+    assert [record["file"] for record in metrics.records] == [None]
+    records = metrics.read_run()
+    assert sorted(str(record["file"]) for record in records) == [
+        "None",
+        "a.csv",
+        "b.csv",
+    ]
+    assert all(record["run_id"] == metrics.run_id for record in records)
+
+
+def test_get_profile_stages(monkeypatch):
+    """Test that the environment variable overrides the profiled stages setting."""
+    monkeypatch.setitem(settings, "profile_stages", ["scc"])
+    monkeypatch.delenv(profile_env_var, raising=False)
+    assert get_profile_stages() == {"scc"}
+    monkeypatch.setenv(profile_env_var, "ingest, label")
+    assert get_profile_stages() == {"ingest", "label"}
+    monkeypatch.setenv(profile_env_var, "")
+    assert get_profile_stages() == frozenset()
+
+
+def test_profiling_off(tmp_path):
+    """Test that no profile is written without profiled stages."""
+    metrics = MetricsRecorder(tmp_path.joinpath("pp.metrics.jsonl"))
+    with metrics.measure("ingest"):
+        pass
+    assert metrics.profile_dir is None
+    assert [fi.name for fi in tmp_path.iterdir()] == ["pp.metrics.jsonl"]
+
+
+def test_profiles(tmp_path):
+    """
+    Test that the profiled stages of the main and worker processes are written and
+    merged by stage.
+    """
+    metrics = MetricsRecorder(
+        tmp_path.joinpath("pp.metrics.jsonl"), profile_stages=["ingest", "shard"]
+    )
+    with metrics.measure("run_pp"):
+        with metrics.measure("ingest"):
+            with metrics.measure("ingest", file="a.csv"):
+                pass
+        with metrics.measure("label"):
+            pass
+        # One worker running both shards writes a profile for each.
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            for fi in ["a.csv", "b.csv"]:
+                executor.submit(measure_file, metrics, "shard", fi).result()
+        assert not metrics.profile_dir.joinpath("shard.prof").exists()
+    assert metrics.profile_dir == tmp_path.joinpath("profiles", metrics.run_id)
+    prof_fis = {fi.name for fi in metrics.profile_dir.iterdir()}
+    part_fis = {
+        stage: sorted(fi for fi in prof_fis if fi.startswith(f"{stage}_"))
+        for stage in ["ingest", "shard"]
+    }
+    # The nested measure and the label stage are not profiled on their own.
+    assert prof_fis == {
+        "ingest.prof",
+        "shard.prof",
+        *part_fis["ingest"],
+        *part_fis["shard"],
+    }
+    assert len(part_fis["ingest"]) == 1
+    assert part_fis["ingest"][0].startswith(f"ingest_{os.getpid()}_")
+    assert len(part_fis["shard"]) == 2
+    for stage, fis in part_fis.items():
+        merged = pstats.Stats(str(metrics.profile_dir.joinpath(f"{stage}.prof")))
+        assert merged.total_calls == sum(
+            pstats.Stats(str(metrics.profile_dir.joinpath(fi))).total_calls
+            for fi in fis
+        )
+
+
+def test_run_profiles(job_params, run_job, synthetic_area, full_run, monkeypatch):
+    """Test that a run profiles the stages given by the environment variable."""
+    monkeypatch.setenv(profile_env_var, "ingest,label")
+    params = job_params(FIPSs_selected=synthetic_area["FIPSs"][:1])
+    records = run_job(params)
+    prof_dir = Path(params["log_dir"], "profiles", records[0]["run_id"])
+    assert {"ingest.prof", "label.prof"} <= {fi.name for fi in prof_dir.iterdir()}
+    assert not any(fi.stem.startswith("detailed") for fi in prof_dir.iterdir())
+    # The full run is not profiled.
+    assert not Path(full_run[0]["log_dir"], "profiles").exists()
@@ -1,24 +1,26 @@
 """General utility functions."""
 from io import StringIO
+from contextlib import contextmanager
 import cProfile
 import pstats
-from functools import wraps
+from functools import lru_cache, wraps
+from importlib import resources
+import os
 import pandas as pd
 import datetime
 import datetime as dt
 import logging as lg
+import sys
 from pathlib import Path
-from sqlalchemy import create_engine
-import pkg_resources
 import yaml
-from pint import UnitRegistry
 
 package_name = "ttionroadei"
 try:
-    # Get the path to the settings.yaml file within the package
-    settings_yaml_path = pkg_resources.resource_filename(package_name, "settings.yaml")
+    # Get the settings.YAML file within the package. Unlike `pkg_resources`,
+    # `importlib.resources` does not scan the installed distributions.
+    settings_yaml_path = resources.files(package_name).joinpath("settings.YAML")
     # Read and parse the YAML file
-    with open(settings_yaml_path, "r") as yaml_file:
+    with settings_yaml_path.open("r") as yaml_file:
         settings = yaml.safe_load(yaml_file)
 except Exception as e:
     print(f"Error: {e}")
@@ -27,6 +29,7 @@ log_filename = settings.get("log_filename")
 log_level = settings.get("log_level")
 mvs4defaultdb = settings.get("MOVES4_Default_DB")
 valid_units = settings.get("valid_units")
+profile_env_var = "TTIONROADEI_PROFILE"
 
 
 def profile(
@@ -82,6 +85,78 @@ def profile(
     return inner
 
 
+def get_profile_stages():
+    """
+    Get the post-processing stages to profile, from the `TTIONROADEI_PROFILE`
+    environment variable (comma separated) or else the `profile_stages` setting.
+
+    Returns
+    -------
+    frozenset
+        The stage names, "all" for every stage, or empty when profiling is off.
+    """
+    env_stages = os.environ.get(profile_env_var)
+    if env_stages is not None:
+        stages = env_stages.split(",")
+    else:
+        stages = settings.get("profile_stages") or []
+    return frozenset(stage.strip() for stage in stages if stage.strip())
+
+
+@contextmanager
+def profiled(prof_fi):
+    """
+    Profile a block with `cProfile` and dump the binary stats (loadable with
+    `pstats` or snakeviz) to a file, also when the block fails.
+
+    Parameters
+    ----------
+    prof_fi : str or Path
+        The `.prof` output file path.
+
+    Yields
+    ------
+    cProfile.Profile
+        The active profiler.
+    """
+    pr = cProfile.Profile()
+    pr.enable()
+    try:
+        yield pr
+    finally:
+        pr.disable()
+        Path(prof_fi).parent.mkdir(parents=True, exist_ok=True)
+        pr.dump_stats(prof_fi)
+
+
+def aggregate_profiles(prof_dir):
+    """
+    Merge the `.prof` files of the same stage written by the main and worker
+    processes (named `<stage>_<pid>_<n>.prof`) into `<stage>.prof`.
+
+    Parameters
+    ----------
+    prof_dir : str or Path
+        The directory holding the `.prof` files of a run.
+
+    Returns
+    -------
+    list
+        The merged `.prof` file paths.
+    """
+    prof_fis = {}
+    for prof_fi in sorted(Path(prof_dir).glob("*_*_*.prof")):
+        stage = prof_fi.stem.rsplit("_", 2)[0]
+        prof_fis.setdefault(stage, []).append(prof_fi)
+    merged_fis = []
+    for stage, fis in prof_fis.items():
+        stats = pstats.Stats(*[str(fi) for fi in fis])
+        merged_fi = Path(prof_dir).joinpath(f"{stage}.prof")
+        stats.dump_stats(merged_fi)
+        merged_fis.append(merged_fi)
+    return merged_fis
+
+
 def ts(style="datetime", template=None):
     """
     Get current timestamp as string.
@@ -184,6 +259,9 @@ def get_labels(
         - 'moves_ft': Dataframe with fuel type labels.
         - 'act_lab': Dataframe with activity labels.
     """
+    # Imported here: sqlalchemy is slow to import and only needed for the labels.
+    from sqlalchemy import create_engine
+
     db_url = f"mysql+pymysql://{user}:{password}@{host}:{port}/{database_nm}"
     engine = create_engine(db_url)
     conn = engine.connect()
@@ -293,6 +371,62 @@ def get_labels(
     }
 
 
+def save_labels_snapshot(labels, snapshot_dir):
+    """
+    Save the labels retrieved by `get_labels` as CSV files, so the post-processing
+    can run without a MOVES default database.
+
+    Parameters
+    ----------
+    labels : dict
+        The label DataFrames returned by `get_labels`.
+    snapshot_dir : str or Path
+        The directory receiving one `<label>.csv` file per label DataFrame.
+
+    Returns
+    -------
+    pathlib.Path
+        The snapshot directory.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    for name, df in labels.items():
+        df.to_csv(snapshot_dir.joinpath(f"{name}.csv"), index=False)
+    return snapshot_dir
+
+
+def load_labels_snapshot(snapshot_dir):
+    """
+    Load the labels saved by `save_labels_snapshot`.
+
+    Parameters
+    ----------
+    snapshot_dir : str or Path
+        The snapshot directory.
+
+    Returns
+    -------
+    dict
+        The label DataFrames, as returned by `get_labels`.
+    """
+    return {
+        label_fi.stem: pd.read_csv(label_fi)
+        for label_fi in sorted(Path(snapshot_dir).glob("*.csv"))
+    }
+
+
+@lru_cache(maxsize=None)
+def _unit_registry():
+    # Imported and built on first use: pint is slow to import and the registry
+    # slow to build.
+    from pint import UnitRegistry
+
+    ureg = UnitRegistry()
+    ureg.define("MBTU = 1e6 BTU")
+    ureg.define("Kilojoules = kilojoule")
+    return ureg
+
+
 def unit_converter(in_unit, out_unit):
     """
     Convert a quantity from one unit to another using the Pint library. This function
@@ -320,9 +454,7 @@ def unit_converter(in_unit, out_unit):
     value_in_kilojoules = value_in_mbtu * conversion_factor
     ```
     """
-    ureg = UnitRegistry()
-    ureg.define("MBTU = 1e6 BTU")
-    ureg.define("Kilojoules = kilojoule")
+    ureg = _unit_registry()
     # Define the source and target units
     source_unit = ureg(in_unit)
     target_unit = ureg(out_unit)
@@ -333,6 +465,62 @@ def unit_converter(in_unit, out_unit):
     return conversion_factor
 
 
+def peak_rss_mb():
+    """
+    Get the peak resident set size of the current process.
+
+    Uses `/proc/self/status` on Linux, the `resource` module on other Unix
+    systems, and `psutil`, when installed, on Windows.
+
+    Returns
+    -------
+    float or None
+        The peak resident set size in MB, or None if it cannot be measured.
+    """
+    if sys.platform.startswith("linux"):
+        # VmHWM is reset on exec, unlike ru_maxrss, so spawned workers do not
+        # report the peak of their parent.
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2**20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on other Unix systems.
+    if sys.platform == "darwin":
+        return peak / 2**20
+    return peak / 2**10
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of the current process to its current
+    resident set size, so `peak_rss_mb` measures the peak of the following code.
+
+    Only supported on Linux (`/proc/self/clear_refs`).
+
+    Returns
+    -------
+    bool
+        True if the peak was reset.
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
 def delete_old_log_files(log_directory, max_age_in_days):
     """
     This function iterates through the log files in the specified directory, checks their